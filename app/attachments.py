@@ -0,0 +1,75 @@
+"""
+Пересылка вложений заявки в служебный канал.
+
+Идущие подряд фото и видео уходят общим альбомом (sendMediaGroup, до 10
+штук), идущие подряд документы — альбомом из документов (Telegram не
+смешивает их с фото), голосовые в альбом не входят и отправляются по одному.
+Всё отправляется последовательно и ответом на карточку, так что порядок
+вложений и привязка к заявке сохраняются.
+Лимиты и повтор по flood control — в send_queue.
+"""
+
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+MEDIA_GROUP_MAX = 10
+
+# Тип вложения -> группа альбома (None — в альбом не входит)
+_GROUP_OF = {"photo": "visual", "video": "visual", "document": "document", "voice": None}
+
+_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+}
+
+
+async def _send_single(bot: Bot, chat_id: int, a: Dict[str, str], reply_to: int) -> None:
+    send = {
+        "photo": bot.send_photo,
+        "video": bot.send_video,
+        "document": bot.send_document,
+        "voice": bot.send_voice,
+    }[a["type"]]
+    await send(chat_id, a["file_id"], reply_to_message_id=reply_to)
+
+
+def plan_sends(attachments: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """
+    Разбить вложения на отправки: альбомы (до 10) и одиночные сообщения.
+    Порядок вложений сохраняется как есть: в альбом собираются только идущие
+    подряд вложения одной группы, поэтому фото вперемешку с документами
+    дадут больше сообщений, но сотрудник увидит их в своём порядке.
+    """
+    plan: List[List[Dict[str, str]]] = []
+    current: List[Dict[str, str]] = []
+    current_group: Optional[str] = None
+    for a in attachments:
+        group = _GROUP_OF.get(a["type"])
+        if current and (group is None or group != current_group or len(current) >= MEDIA_GROUP_MAX):
+            plan.append(current)
+            current = []
+        if group is None:
+            plan.append([a])
+            continue
+        current.append(a)
+        current_group = group
+    if current:
+        plan.append(current)
+    return plan
+
+
+async def send_attachments(
+    bot: Bot,
+    chat_id: int,
+    attachments: List[Dict[str, str]],
+    reply_to: int,
+) -> None:
+    for chunk in plan_sends(attachments):
+        if len(chunk) == 1:
+            await _send_single(bot, chat_id, chunk[0], reply_to)
+            continue
+        media = [_INPUT_MEDIA[a["type"]](media=a["file_id"]) for a in chunk]
+        await bot.send_media_group(chat_id, media, reply_to_message_id=reply_to)
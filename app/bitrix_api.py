@@ -1,6 +1,12 @@
-from typing import Any, Dict, Optional
-import sys
-import requests
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+import asyncio
+import logging
+import re
+import time
+
+import aiohttp
 
 from .config import (
     BITRIX_BASE,
@@ -11,111 +17,414 @@ from .config import (
     BITRIX_SMART_STAGE_ID,
     BITRIX_SMART_STAGE_WORK,
     BITRIX_SMART_STAGE_CLOSED,
+    BITRIX_MAX_CONNECTIONS,
+    BITRIX_KEEPALIVE,
+    BITRIX_BATCH_WINDOW,
+    BITRIX_RATE,
+    BITRIX_BURST,
+    BITRIX_MIN_CONCURRENCY,
+    BITRIX_MAX_CONCURRENCY,
+    BITRIX_LIMIT_RETRIES,
+)
+from .health import note_bitrix
+from .metrics import BITRIX_CONCURRENCY, BITRIX_QUEUE_DEPTH, BITRIX_REQUESTS, BITRIX_SECONDS, on_collect
+from .ratelimit import OutboundLimiter
+
+log = logging.getLogger(__name__)
+
+# Ошибки, означающие «запрос не выполнен, слишком часто»
+_LIMIT_ERRORS = {"QUERY_LIMIT_EXCEEDED", "OPERATION_TIME_LIMIT"}
+
+# Общий лимитер всех вызовов портала (см. ratelimit.py)
+limiter = OutboundLimiter(
+    rate=BITRIX_RATE,
+    burst=BITRIX_BURST,
+    min_concurrency=BITRIX_MIN_CONCURRENCY,
+    max_concurrency=BITRIX_MAX_CONCURRENCY,
 )
 
-def bitrix_task_add(title: str, description: str, responsible_id: int) -> Optional[int]:
-    url = BITRIX_BASE + "tasks.task.add"
+
+def _collect_limiter() -> None:
+    stats = limiter.stats()
+    BITRIX_QUEUE_DEPTH.set(stats["queue_depth"])
+    BITRIX_CONCURRENCY.set(stats["concurrency_limit"])
+
+
+on_collect(_collect_limiter)
+
+
+# --- Общая HTTP-сессия с пулом keep-alive соединений ---
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_lock = asyncio.Lock()
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Одна сессия на процесс: TCP+TLS до портала поднимается один раз и переиспользуется."""
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    async with _session_lock:
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=BITRIX_MAX_CONNECTIONS,
+                limit_per_host=BITRIX_MAX_CONNECTIONS,
+                keepalive_timeout=BITRIX_KEEPALIVE,
+            )
+            _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_bitrix_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _is_overload(status: int, data: Optional[Dict[str, Any]]) -> bool:
+    if status == 429 or status >= 500:
+        return True
+    return bool(data) and data.get("error") in _LIMIT_ERRORS
+
+
+def _iso(ts: float) -> str:
+    """Unix-время в ISO 8601 с часовым поясом — так его понимают фильтры REST."""
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds")
+
+
+def _outcome(status: int, data: Optional[Dict[str, Any]]) -> str:
+    """Метка результата для метрик: ok, код ошибки портала или HTTP-статус."""
+    if data and data.get("error"):
+        return str(data["error"])
+    if status >= 400 or data is None:
+        return f"http_{status}"
+    return "ok"
+
+
+async def _call(method: str, data: Dict[str, Any], timeout: float = 8) -> Optional[Dict[str, Any]]:
+    """
+    POST в REST-метод Bitrix24. Возвращает разобранный JSON или None при ошибке.
+    Все вызовы идут через общий лимитер; отказ «слишком часто» (запрос не выполнен)
+    повторяем до BITRIX_LIMIT_RETRIES раз.
+    """
+    session = await _get_session()
+    form = {k: str(v) for k, v in data.items()}
+
+    for attempt in range(BITRIX_LIMIT_RETRIES + 1):
+        await limiter.acquire()
+        status, body, overloaded = 0, None, True
+        started = time.perf_counter()
+        try:
+            async with session.post(
+                BITRIX_BASE + method,
+                data=form,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as resp:
+                status = resp.status
+                try:
+                    body = await resp.json(content_type=None)
+                except ValueError:
+                    body = None
+            overloaded = _is_overload(status, body)
+            BITRIX_REQUESTS.inc(method, _outcome(status, body))
+            # Отказ по лимиту — портал доступен, просто занят
+            limited = bool(body) and body.get("error") in _LIMIT_ERRORS
+            note_bitrix(status < 500 or limited, "" if status < 500 or limited else f"HTTP {status}")
+        except Exception as e:
+            BITRIX_REQUESTS.inc(method, "network")
+            note_bitrix(False, repr(e))
+            log.warning("Bitrix %s: %r", method, e)
+            return None
+        finally:
+            BITRIX_SECONDS.observe(time.perf_counter() - started, method)
+            limiter.release(overloaded)
+
+        retryable = status in (429, 503) or (bool(body) and body.get("error") in _LIMIT_ERRORS)
+        if not retryable:
+            if overloaded or body is None:
+                log.warning("Bitrix %s: HTTP %s %s", method, status, (body or {}).get("error", ""))
+            return body
+        log.warning("Bitrix %s: лимит запросов, повтор %d", method, attempt + 1)
+        await asyncio.sleep(0.5 * (attempt + 1))
+
+    return body
+
+
+async def bitrix_ping() -> bool:
+    """Лёгкий вызов для проверки доступности портала (/readyz)."""
+    data = await _call("server.time", {}, timeout=5)
+    return bool(data) and "result" in data
+
+
+async def bitrix_task_add(title: str, description: str, responsible_id: int) -> Optional[int]:
+    data = await _call("tasks.task.add", {
+        "fields[TITLE]": title,
+        "fields[DESCRIPTION]": description,
+        "fields[RESPONSIBLE_ID]": str(responsible_id),
+    })
     try:
-        resp = requests.post(url, data={
-            "fields[TITLE]": title,
-            "fields[DESCRIPTION]": description,
-            "fields[RESPONSIBLE_ID]": str(responsible_id),
-        }, timeout=8)
-        data = resp.json()
         # Ожидаемый ответ: {"result":{"task":{"id":"123", ...}}}
         task_id = int(data["result"]["task"]["id"])
         return task_id
     except Exception:
         return None
 
-def bitrix_task_update_status(task_id: int, status_code: int) -> bool:
-    url = BITRIX_BASE + "tasks.task.update"
-    try:
-        resp = requests.post(url, data={
-            "taskId": str(task_id),
-            "fields[STATUS]": str(status_code),  # 2 = в работе, 5 = закрыто (зависит от портала)
-        }, timeout=8)
-        data = resp.json()
-        return "result" in data
-    except Exception:
-        return False
+async def bitrix_task_update_status(task_id: int, status_code: int) -> bool:
+    data = await _call("tasks.task.update", {
+        "taskId": str(task_id),
+        "fields[STATUS]": str(status_code),  # 2 = в работе, 5 = закрыто (зависит от портала)
+    })
+    return bool(data) and "result" in data
 
-def bitrix_task_complete(task_id: int) -> bool:
-    url = BITRIX_BASE + "tasks.task.complete"
-    try:
-        resp = requests.post(url, data={"taskId": str(task_id)}, timeout=8)
-        data = resp.json()
-        return "result" in data
-    except Exception:
-        return False
+async def bitrix_task_complete(task_id: int) -> bool:
+    data = await _call("tasks.task.complete", {"taskId": str(task_id)})
+    return bool(data) and "result" in data
+
+async def bitrix_task_comment(task_id: int, message: str) -> bool:
+    data = await _call("task.commentitem.add", {
+        "fields[TASK_ID]": str(task_id),
+        "fields[POST_MESSAGE]": message,
+    })
+    return bool(data) and "result" in data
 
-def bitrix_task_comment(task_id: int, message: str) -> bool:
-    url = BITRIX_BASE + "task.commentitem.add"
+async def bitrix_task_find(title_part: str, created_after: Optional[float] = None) -> Optional[int]:
+    """
+    Найти задачу по подстроке в названии (внешний ID). Нужна для идемпотентных повторов.
+    created_after — unix-время: задачи, созданные раньше, не рассматриваются.
+    0 — задачи нет, None — запрос не удался.
+    """
+    params = {
+        "filter[%TITLE]": title_part,
+        "select[]": "ID",
+    }
+    if created_after is not None:
+        params["filter[>=CREATED_DATE]"] = _iso(created_after)
+    data = await _call("tasks.task.list", params)
     try:
-        resp = requests.post(url, data={
-            "fields[TASK_ID]": str(task_id),
-            "fields[POST_MESSAGE]": message,
-        }, timeout=8)
-        data = resp.json()
-        return "result" in data
+        tasks = data["result"]["tasks"]
+        return int(tasks[0]["id"]) if tasks else 0
     except Exception:
-        return False
+        return None
 
 # --- CRM Smart Process helpers ---
-def bitrix_crm_item_add(entity_type_id: int, fields: Dict[str, Any]) -> Optional[int]:
+async def bitrix_crm_item_add(entity_type_id: int, fields: Dict[str, Any]) -> Optional[int]:
     """
     Create Smart Process element.
     REST: crm.item.add
     """
-    url = BITRIX_BASE + "crm.item.add"
+    payload: Dict[str, Any] = {"entityTypeId": str(entity_type_id)}
+    for k, v in fields.items():
+        payload[f"fields[{k}]"] = v
+    data = await _call("crm.item.add", payload, timeout=10)
+    if data is None:
+        return None
+    item_id = (data.get("result") or {}).get("item", {}).get("id")
+    if not item_id:
+        log.error("[CRM ADD] Ошибка: %s", data.get("error_description") or data)
+        return None
+    return int(item_id)
+
+async def bitrix_crm_item_find(entity_type_id: int, title_part: str,
+                               created_after: Optional[float] = None) -> Optional[int]:
+    """
+    Find Smart Process element by title substring.
+    REST: crm.item.list
+    created_after: unix time, older elements are ignored.
+    Returns 0 if not found, None if the request failed.
+    """
+    params = {
+        "entityTypeId": str(entity_type_id),
+        "filter[%title]": title_part,
+        "select[]": "id",
+    }
+    if created_after is not None:
+        params["filter[>=createdTime]"] = _iso(created_after)
+    data = await _call("crm.item.list", params, timeout=10)
     try:
-        payload: Dict[str, Any] = {"entityTypeId": str(entity_type_id)}
-        for k, v in fields.items():
-            payload[f"fields[{k}]"] = v
-        resp = requests.post(url, data=payload, timeout=10)
-        data = resp.json()
-        item_id = (data.get("result") or {}).get("item", {}).get("id")
-        if not item_id:
-            # Не трогаем asyncio из рабочего потока: просто логируем.
-            try:
-                err = data.get("error_description") or str(data)
-                print(f"[CRM ADD] Ошибка: {err}", file=sys.stderr)
-            except Exception:
-                pass
-            return None
-        return int(item_id)
+        items = data["result"]["items"]
+        return int(items[0]["id"]) if items else 0
     except Exception:
         return None
 
-def bitrix_crm_item_update(entity_type_id: int, item_id: int, fields: Dict[str, Any]) -> bool:
+async def bitrix_crm_item_update(entity_type_id: int, item_id: int, fields: Dict[str, Any]) -> bool:
     """
     Update Smart Process element.
     REST: crm.item.update
     """
-    url = BITRIX_BASE + "crm.item.update"
-    try:
-        payload: Dict[str, Any] = {"entityTypeId": str(entity_type_id), "id": str(item_id)}
-        for k, v in fields.items():
-            payload[f"fields[{k}]"] = v
-        resp = requests.post(url, data=payload, timeout=10)
-        data = resp.json()
-        return "result" in data
-    except Exception:
-        return False
+    payload: Dict[str, Any] = {"entityTypeId": str(entity_type_id), "id": str(item_id)}
+    for k, v in fields.items():
+        payload[f"fields[{k}]"] = v
+    data = await _call("crm.item.update", payload, timeout=10)
+    return bool(data) and "result" in data
 
-def bitrix_crm_timeline_comment(entity_type_id: int, item_id: int, comment: str) -> bool:
+async def bitrix_crm_timeline_comment(entity_type_id: int, item_id: int, comment: str) -> bool:
     """
     Add timeline comment to Smart Process element.
     REST: crm.timeline.comment.add
     """
-    url = BITRIX_BASE + "crm.timeline.comment.add"
-    try:
-        resp = requests.post(url, data={
+    data = await _call("crm.timeline.comment.add", {
+        "fields[ENTITY_TYPE_ID]": str(entity_type_id),
+        "fields[ENTITY_ID]": str(item_id),
+        "fields[COMMENT]": comment
+    }, timeout=10)
+    return bool(data) and "result" in data
+
+
+# --- Batch API ---
+#
+# REST-метод batch принимает до 50 команд за один запрос. Команды внутри
+# пачки могут ссылаться на результаты предыдущих через $result[имя][...],
+# поэтому «создать элемент + написать комментарий» уходит одним запросом.
+# Кроме того, команды от параллельных заявок, пришедшие в течение
+# BITRIX_BATCH_WINDOW, склеиваются в одну пачку.
+
+BATCH_MAX_COMMANDS = 50
+
+# Команда: имя -> (REST-метод, параметры)
+BatchCommands = Dict[str, Tuple[str, Dict[str, Any]]]
+# Результат: (результаты по именам, ошибки по именам)
+BatchResult = Tuple[Dict[str, Any], Dict[str, Any]]
+
+_RESULT_REF_RE = re.compile(r"\$result\[([^\]]+)\]")
+
+
+class BitrixBatcher:
+    def __init__(self, window: float, max_commands: int = BATCH_MAX_COMMANDS):
+        self.window = window
+        self.max_commands = max_commands
+        self._seq = 0
+        self._pending: List[Tuple[str, BatchCommands, asyncio.Future]] = []
+        self._pending_count = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Ссылки на отправляемые пачки: иначе задачу может собрать сборщик мусора
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def run(self, commands: BatchCommands) -> BatchResult:
+        """Выполнить связанные команды одной пачкой (возможно, вместе с чужими)."""
+        if not commands:
+            return {}, {}
+        if len(commands) > self.max_commands:
+            raise ValueError(f"batch: не больше {self.max_commands} команд за раз")
+
+        if self._pending_count + len(commands) > self.max_commands:
+            self._flush()
+
+        loop = asyncio.get_running_loop()
+        self._seq += 1
+        fut: asyncio.Future = loop.create_future()
+        self._pending.append((f"q{self._seq}_", commands, fut))
+        self._pending_count += len(commands)
+
+        if self._pending_count >= self.max_commands:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        pending, self._pending, self._pending_count = self._pending, [], 0
+        task = asyncio.create_task(self._send(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, pending: List[Tuple[str, BatchCommands, asyncio.Future]]) -> None:
+        """Отправить пачку; при любом сбое ожидающие вызовы получают ошибку, а не висят."""
+        try:
+            await self._execute(pending)
+        except asyncio.CancelledError:
+            for _, _, fut in pending:
+                if not fut.done():
+                    fut.cancel()
+            raise
+        except Exception as e:
+            log.exception("Bitrix batch")
+            for _, _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    async def _execute(self, pending: List[Tuple[str, BatchCommands, asyncio.Future]]) -> None:
+        payload: Dict[str, Any] = {"halt": "0"}
+        for prefix, commands, _ in pending:
+            for name, (method, params) in commands.items():
+                query = urlencode({k: _prefix_refs(str(v), prefix) for k, v in params.items()})
+                payload[f"cmd[{prefix}{name}]"] = f"{method}?{query}" if query else method
+
+        data = await _call("batch", payload, timeout=15)
+        body = (data or {}).get("result") or {}
+        # Пустые словари Bitrix отдаёт как [], поэтому `or {}`
+        results = body.get("result") or {}
+        errors = body.get("result_error") or {}
+
+        for prefix, commands, fut in pending:
+            if fut.done():
+                continue
+            if data is None or "error" in data:
+                fut.set_result(({}, {name: (data or {}).get("error", "network") for name in commands}))
+                continue
+            fut.set_result((
+                {name: results[prefix + name] for name in commands if prefix + name in results},
+                {name: errors[prefix + name] for name in commands if prefix + name in errors},
+            ))
+
+
+def _prefix_refs(value: str, prefix: str) -> str:
+    if "$result[" not in value:
+        return value
+    return _RESULT_REF_RE.sub(lambda m: f"$result[{prefix}{m.group(1)}]", value)
+
+
+_batcher = BitrixBatcher(BITRIX_BATCH_WINDOW)
+
+
+async def bitrix_batch(commands: BatchCommands) -> BatchResult:
+    return await _batcher.run(commands)
+
+
+async def bitrix_crm_item_add_with_comment(
+    entity_type_id: int, fields: Dict[str, Any], comment: str
+) -> Optional[int]:
+    """
+    Create Smart Process element and add timeline comment in one request.
+    REST: batch(crm.item.add, crm.timeline.comment.add)
+    """
+    item_params: Dict[str, Any] = {"entityTypeId": str(entity_type_id)}
+    for k, v in fields.items():
+        item_params[f"fields[{k}]"] = v
+    results, errors = await bitrix_batch({
+        "item": ("crm.item.add", item_params),
+        "comment": ("crm.timeline.comment.add", {
             "fields[ENTITY_TYPE_ID]": str(entity_type_id),
-            "fields[ENTITY_ID]": str(item_id),
-            "fields[COMMENT]": comment
-        }, timeout=10)
-        data = resp.json()
-        return "result" in data
-    except Exception:
-        return False
+            "fields[ENTITY_ID]": "$result[item][item][id]",
+            "fields[COMMENT]": comment,
+        }),
+    })
+    item_id = ((results.get("item") or {}).get("item") or {}).get("id")
+    if not item_id:
+        log.error("[CRM ADD] Ошибка: %s", errors.get("item") or errors)
+        return None
+    if "comment" in errors:
+        log.warning("[CRM COMMENT] Ошибка: %s", errors["comment"])
+    return int(item_id)
+
+
+async def bitrix_task_comment_and_complete(task_id: int, message: str) -> bool:
+    """
+    Comment and close task in one request.
+    REST: batch(task.commentitem.add, tasks.task.complete)
+    """
+    results, errors = await bitrix_batch({
+        "comment": ("task.commentitem.add", {
+            "fields[TASK_ID]": str(task_id),
+            "fields[POST_MESSAGE]": message,
+        }),
+        "complete": ("tasks.task.complete", {"taskId": str(task_id)}),
+    })
+    if errors:
+        log.warning("[TASK CLOSE] %s: %s", task_id, errors)
+    return "complete" in results
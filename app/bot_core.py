@@ -1,11 +1,28 @@
-from collections import deque
-from typing import Deque, Dict, Any
-
 from aiogram import Bot, Dispatcher, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
 
-from .config import BOT_TOKEN, EXPORT_LOOKBACK
+from .config import (
+    BOT_TOKEN,
+    TELEGRAM_API_SERVER,
+    SUPPORT_CHAT_ID,
+    DB_PATH,
+    ID_PREFIX,
+    ID_BLOCK_SIZE,
+    ALBUM_LATENCY,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GROUP_RATE,
+)
+from .storage import TicketRepository, SqliteTicketRepository
+from .idgen import IdAllocator
+from .fsm_storage import build_fsm_storage
+from .middlewares import ChatEventIsolation, MediaGroupMiddleware
+from .send_queue import ReplyCredit, SendScheduler
+from .metrics import QUEUE_DEPTH, HandlerMetricsMiddleware, TelegramMetrics, on_collect
+from .health import TelegramHealth
 
 
 
@@ -13,24 +30,54 @@ from .config import BOT_TOKEN, EXPORT_LOOKBACK
 
 bot = Bot(
     BOT_TOKEN,
+    session=AiohttpSession(
+        api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else PRODUCTION
+    ),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
 
-dp = Dispatcher()
+# Все отправки идут через общую очередь с лимитами и повтором по RetryAfter
+send_scheduler = SendScheduler(
+    SUPPORT_CHAT_ID,
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    group_rate=TELEGRAM_GROUP_RATE,
+)
+bot.session.middleware(send_scheduler)
+# Метрики — после очереди: время и результат каждой попытки, без ожидания лимитов
+bot.session.middleware(TelegramMetrics())
+# Для /readyz: живой ли polling и не сыплются ли сетевые ошибки
+bot.session.middleware(TelegramHealth())
+
+
+def _collect_send_queue() -> None:
+    for priority, depth in send_scheduler.stats()["queue_depth"].items():
+        QUEUE_DEPTH.set(depth, priority)
+
+
+on_collect(_collect_send_queue)
+
+# FSM-middleware регистрируем сами: склейка альбомов должна идти до неё
+dp = Dispatcher(
+    storage=build_fsm_storage(),
+    events_isolation=ChatEventIsolation(),
+    disable_fsm=True,
+)
+dp.update.outer_middleware(MediaGroupMiddleware(ALBUM_LATENCY))
+# Ответ на сообщение пользователя не ждёт лимита личного чата (см. send_queue)
+dp.update.outer_middleware(ReplyCredit(send_scheduler))
+dp.update.outer_middleware(dp.fsm)
 router = Router()
 dp.include_router(router)
+# Время хендлеров и состояния формы (inner: хендлер уже выбран, состояние прочитано)
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
 
 
-# --- In-memory storage (без БД) ---
-
-# Счётчик внешних ID (используется в helpers.generate_external_id)
-ID_COUNTER = 0
+# --- Хранилище ---
 
-# История карточек для /stats и /export
-# Каждый элемент: dict(id, date, language, name, phone, category, status, text_len, attachments_count)
-HISTORY: Deque[Dict[str, Any]] = deque(maxlen=EXPORT_LOOKBACK)
+# Внешние ID резервируются блоками в базе (используется в helpers.generate_external_id)
+ids = IdAllocator(DB_PATH, ID_PREFIX, ID_BLOCK_SIZE)
 
-# Индекс по внешнему ID для админ-кнопок:
-# external_id -> {"task_id": Optional[int], "crm_item_id": Optional[int],
-#                 "channel_message_id": int, "status": str}
-TASK_INDEX: Dict[str, Dict[str, Any]] = {}
\ No newline at end of file
+# Заявки для админ-кнопок, /stats и /export (см. storage.py)
+tickets: TicketRepository = SqliteTicketRepository(DB_PATH)
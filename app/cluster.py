@@ -0,0 +1,240 @@
+"""
+Запуск в несколько процессов.
+
+Супервизор сам забирает апдейты из Telegram (getUpdates) и раздаёт их
+N воркерам. Номер воркера — chat_id (или user_id) по модулю N, поэтому все
+шаги формы одного сотрудника и все кнопки одной карточки попадают в один
+процесс и обрабатываются по порядку. Общее состояние (заявки, outbox,
+внешние ID, FSM при FSM_STORAGE=sqlite/redis) живёт в хранилище, а не в
+памяти процесса.
+
+Offset getUpdates супервизор сдвигает сразу после раздачи, а воркер
+подтверждает каждый обработанный апдейт через общую очередь acks. Пока
+подтверждения нет, апдейт хранится у супервизора: если воркер упал, новый
+процесс получает неподтверждённые апдейты заново (возможен повтор апдейта,
+который упавший воркер успел обработать, но не подтвердить). Потеряны могут
+быть только апдейты в памяти самого супервизора, если упал он.
+"""
+
+import asyncio
+import logging
+import multiprocessing as mp
+import queue as queue_module
+import signal
+from typing import Any, Dict, List, Optional, Set
+
+import aiohttp
+
+from .config import DROP_PENDING_UPDATES, HANDLER_CONCURRENCY
+
+log = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30
+
+
+def affinity_key(raw: Dict[str, Any]) -> int:
+    """chat_id события (или user_id, если чата нет)."""
+    for name, event in raw.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        user = event.get("from") or event.get("user")
+        if user:
+            return int(user["id"])
+    return int(raw.get("update_id", 0))
+
+
+# -------------------- Воркер --------------------
+
+
+def _worker_main(index: int, workers: int, queue: "mp.Queue", acks: "mp.Queue") -> None:
+    # Ctrl+C ловит супервизор и останавливает воркеров через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[w{index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_worker(index, workers, queue, acks))
+
+
+async def _worker(index: int, workers: int, queue: "mp.Queue", acks: "mp.Queue") -> None:
+    from .bot_core import bot, dp, send_scheduler
+    from . import handlers_user, handlers_admin  # noqa: F401  (регистрация хендлеров)
+    from .bitrix_api import close_bitrix_session
+    from .outbox import start_outbox_worker, stop_outbox_worker
+    from .localization import start_locales_watcher, stop_locales_watcher
+    from .metrics import start_metrics_server, stop_metrics_server
+    from .tracing import start_tracing, stop_tracing
+    from .health import (
+        set_mode,
+        start_health_monitor,
+        start_health_server,
+        stop_health_monitor,
+        stop_health_server,
+    )
+    from .middlewares import ConcurrencyLimitMiddleware
+
+    # Канал поддержки и общий лимит бота делят все воркеры
+    send_scheduler.share(workers)
+    if HANDLER_CONCURRENCY:
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(HANDLER_CONCURRENCY))
+    # Апдейты забирает супервизор: для /readyz воркера важен только запуск
+    set_mode("worker")
+    dp.startup.register(start_outbox_worker)
+    dp.startup.register(start_locales_watcher)
+    dp.startup.register(start_tracing)
+    dp.startup.register(start_health_monitor)
+    dp.shutdown.register(stop_outbox_worker)
+    dp.shutdown.register(stop_locales_watcher)
+    dp.shutdown.register(stop_tracing)
+    dp.shutdown.register(stop_health_monitor)
+    dp.shutdown.register(stop_metrics_server)
+    dp.shutdown.register(stop_health_server)
+    dp.shutdown.register(close_bitrix_session)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    # Каждый воркер отдаёт свои метрики и проверки на отдельном порту
+    await start_metrics_server(index)
+    await start_health_server(index)
+
+    # Порядок внутри чата обеспечивает ChatEventIsolation (см. bot_core)
+    tasks: Set[asyncio.Task] = set()
+
+    async def feed(raw: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            log.exception("update %s", raw.get("update_id"))
+        # Апдейт с ошибкой в хендлере тоже подтверждаем: повтор упадёт так же
+        acks.put((index, raw["update_id"]))
+
+    try:
+        while True:
+            raw = await asyncio.to_thread(queue.get)
+            if raw is None:
+                break
+            task = asyncio.create_task(feed(raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(list(tasks))
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+
+
+# -------------------- Супервизор --------------------
+
+
+class Supervisor:
+    def __init__(self, workers: int):
+        self.n = max(1, workers)
+        self._ctx = mp.get_context("spawn")
+        self.queues: List["mp.Queue"] = [self._ctx.Queue() for _ in range(self.n)]
+        self.acks: "mp.Queue" = self._ctx.Queue()
+        # Розданные, но ещё не подтверждённые апдейты каждого воркера (update_id -> апдейт)
+        self.pending: List[Dict[int, Dict[str, Any]]] = [{} for _ in range(self.n)]
+        self.procs: List[Optional[mp.Process]] = [None] * self.n
+        self._stop = asyncio.Event()
+
+    def _start_worker(self, i: int) -> None:
+        p = self._ctx.Process(target=_worker_main, args=(i, self.n, self.queues[i], self.acks),
+                              name=f"bot-worker-{i}")
+        p.start()
+        self.procs[i] = p
+        log.info("worker %d: pid %s", i, p.pid)
+
+    def _drain_acks(self) -> None:
+        while True:
+            try:
+                i, update_id = self.acks.get_nowait()
+            except queue_module.Empty:
+                return
+            self.pending[i].pop(update_id, None)
+
+    def _check_workers(self) -> None:
+        self._drain_acks()
+        for i, p in enumerate(self.procs):
+            if p is not None and not p.is_alive():
+                lost = self.pending[i]
+                log.warning("worker %d завершился (код %s), перезапускаю; повторно отдаю апдейтов: %d",
+                            i, p.exitcode, len(lost))
+                # Старая очередь могла остаться с захваченной блокировкой чтения:
+                # новому процессу — новая очередь и все неподтверждённые апдейты по порядку
+                self.queues[i] = self._ctx.Queue()
+                for raw in lost.values():
+                    self.queues[i].put(raw)
+                self._start_worker(i)
+
+    def route(self, raw: Dict[str, Any]) -> None:
+        i = affinity_key(raw) % self.n
+        self.pending[i][raw["update_id"]] = raw
+        self.queues[i].put(raw)
+
+    async def _poll(self) -> None:
+        from .bot_core import bot, dp
+        from . import handlers_user, handlers_admin  # noqa: F401
+
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        url = bot.session.api.api_url(bot.token, "getUpdates")
+        params: Dict[str, Any] = {
+            "timeout": POLL_TIMEOUT,
+            "allowed_updates": dp.resolve_used_update_types(),
+        }
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                await self._poll_loop(session, url, params)
+        finally:
+            await bot.session.close()
+
+    async def _poll_loop(self, session: aiohttp.ClientSession, url: str, params: Dict[str, Any]) -> None:
+        while not self._stop.is_set():
+            self._check_workers()
+            try:
+                async with session.post(
+                    url, json=params, timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+                ) as resp:
+                    data = await resp.json(content_type=None)
+            except Exception as e:
+                log.warning("getUpdates: %r", e)
+                await asyncio.sleep(1)
+                continue
+
+            if not data.get("ok"):
+                retry_after = (data.get("parameters") or {}).get("retry_after", 1)
+                log.warning("getUpdates: %s", data.get("description"))
+                await asyncio.sleep(retry_after)
+                continue
+
+            for raw in data["result"]:
+                params["offset"] = raw["update_id"] + 1
+                self.route(raw)
+
+    async def run(self) -> None:
+        for i in range(self.n):
+            self._start_worker(i)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        poller = asyncio.create_task(self._poll())
+        await self._stop.wait()
+        poller.cancel()
+        try:
+            await poller
+        except asyncio.CancelledError:
+            pass
+
+        for q in self.queues:
+            q.put(None)
+        for p in self.procs:
+            if p is not None:
+                await asyncio.to_thread(p.join, 30)
+
+
+async def run_cluster(workers: int) -> None:
+    await Supervisor(workers).run()
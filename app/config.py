@@ -17,15 +17,104 @@ if not BOT_TOKEN:
 
 SUPPORT_CHAT_ID = int(os.getenv("SUPPORT_CHAT_ID", "-1000000000000"))
 ADMIN_IDS = [int(x.strip()) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка для нагрузочных тестов)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "").strip().rstrip("/")
+
+# --- Приём апдейтов ---
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()  # polling, webhook or cluster
+# Число процессов-воркеров в режиме cluster
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0")) or os.cpu_count() or 1
+# Не выбрасывать апдейты, накопившиеся пока бот был выключен
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").strip().lower() in ("1", "true", "yes")
+# Сколько апдейтов обрабатывать одновременно (0 — без ограничения)
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", "100"))
+# Сколько ждать остальные сообщения альбома (сек), прежде чем обработать его целиком
+ALBUM_LATENCY = float(os.getenv("ALBUM_LATENCY", "0.3"))
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# --- Отправка в Telegram (лимиты flood control) ---
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # сообщений/сек на бота
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # сообщений/сек в личный чат
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))  # сообщений/мин в группу или канал
+
+# --- Метрики (Prometheus, GET /metrics) ---
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — выключено; в cluster воркер i слушает METRICS_PORT + i
+
+# --- Трассировка отправки заявки ---
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # доля заявок, 0 — выключено
+TRACE_FILE = os.getenv("TRACE_FILE", "").strip()  # JSONL, по спану на строку
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "").strip()  # например http://127.0.0.1:4318/v1/traces
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "support-bot").strip()
+
+# --- Монитор цикла событий и проверки /healthz, /readyz ---
+
+# Отдельный сервер проверок; 0 — только на сервере метрик (если METRICS_PORT задан).
+# В cluster воркер i слушает HEALTH_PORT + i
+HEALTH_HOST = os.getenv("HEALTH_HOST", "127.0.0.1").strip()
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "0"))
+
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.5"))  # сек, 0 — выключено
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "1"))  # сек: дольше — пишем стек в лог
+HEALTH_POLL_STALE = float(os.getenv("HEALTH_POLL_STALE", "60"))  # сек без успешного getUpdates — не готов
+HEALTH_BITRIX_PROBE_INTERVAL = float(os.getenv("HEALTH_BITRIX_PROBE_INTERVAL", "60"))
 
 ID_PREFIX = os.getenv("ID_PREFIX", "HR").strip()
+# Сколько внешних ID резервировать за одну запись в базу
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "50"))
+# Сколько последних заявок отдаёт /export без аргумента limit (0 — все)
 EXPORT_LOOKBACK = int(os.getenv("EXPORT_LOOKBACK", "200"))
 
+# Локальная SQLite-база (outbox и т.п.)
+DB_PATH = os.getenv("DB_PATH", "").strip() or str(BASE_DIR / "data" / "bot.sqlite3")
+# Сколько одна попытка записи ждёт чужую блокировку базы, держа цикл событий (сек)
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "1"))
+
+# Тексты и категории; файл перечитывается на лету (0 — не следить за изменениями)
+LOCALES_PATH = os.getenv("LOCALES_PATH", "").strip() or str(BASE_DIR / "locales.json")
+LOCALES_POLL_INTERVAL = float(os.getenv("LOCALES_POLL_INTERVAL", "5"))
+
+# Хранилище FSM: memory / sqlite / redis; брошенные формы живут FSM_TTL секунд (0 — вечно)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0").strip()
+
 # --- Bitrix base ---
 
 BITRIX_BASE = os.getenv("BITRIX_WEBHOOK_BASE", "").rstrip("/") + "/"
 BITRIX_RESPONSIBLE_ID = int(os.getenv("BITRIX_RESPONSIBLE_ID", "1"))
 
+# Пул keep-alive соединений к порталу (на один хост)
+BITRIX_MAX_CONNECTIONS = int(os.getenv("BITRIX_MAX_CONNECTIONS", "8"))
+BITRIX_KEEPALIVE = float(os.getenv("BITRIX_KEEPALIVE", "30"))
+
+# Лимиты исходящих вызовов: частота (token bucket) и параллельность (AIMD)
+BITRIX_RATE = float(os.getenv("BITRIX_RATE", "2"))
+BITRIX_BURST = int(os.getenv("BITRIX_BURST", "10"))
+BITRIX_MIN_CONCURRENCY = int(os.getenv("BITRIX_MIN_CONCURRENCY", "1"))
+BITRIX_MAX_CONCURRENCY = int(os.getenv("BITRIX_MAX_CONCURRENCY", str(BITRIX_MAX_CONNECTIONS)))
+BITRIX_LIMIT_RETRIES = int(os.getenv("BITRIX_LIMIT_RETRIES", "3"))
+
+# Окно (сек), в течение которого команды разных заявок склеиваются в один batch
+BITRIX_BATCH_WINDOW = float(os.getenv("BITRIX_BATCH_WINDOW", "0.05"))
+
+# Outbox: повторы записи в Bitrix с экспоненциальной задержкой
+OUTBOX_BASE_DELAY = float(os.getenv("OUTBOX_BASE_DELAY", "2"))
+OUTBOX_MAX_DELAY = float(os.getenv("OUTBOX_MAX_DELAY", "600"))
+OUTBOX_ALERT_ATTEMPTS = int(os.getenv("OUTBOX_ALERT_ATTEMPTS", "5"))
+# Сколько ждать создания сущности, чтобы опубликовать карточку сразу с её ID
+# (0 — публиковать сразу, ID допишется правкой сообщения)
+CARD_ID_WAIT = float(os.getenv("CARD_ID_WAIT", "3"))
+
 # --- Smart process / CRM mode ---
 
 BITRIX_MODE = os.getenv("BITRIX_MODE", "TASKS").upper()  # TASKS or CRM
@@ -0,0 +1,51 @@
+import asyncio
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from .config import DB_BUSY_TIMEOUT, DB_PATH
+
+T = TypeVar("T")
+
+# Сколько всего ждать освобождения базы в retry_locked, прежде чем сдаться
+LOCK_WAIT = 30
+LOCK_RETRY_DELAY = 0.05
+LOCK_RETRY_MAX_DELAY = 1.0
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Локальная SQLite-база бота.
+    WAL: читатели не блокируют писателя, несколько процессов могут работать с одним файлом.
+    Autocommit (isolation_level=None) — транзакции открываем явно через BEGIN IMMEDIATE.
+    Вызовы синхронные и идут прямо в цикле событий, поэтому ожидание чужой
+    блокировки ограничено DB_BUSY_TIMEOUT; дальше ждёт retry_locked, не держа цикл.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def is_locked(e: sqlite3.OperationalError) -> bool:
+    return "locked" in str(e)
+
+
+async def retry_locked(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Выполнить запись в базу; если её держит другой процесс (database is locked),
+    повторить после asyncio.sleep. Пока ждём, остальные апдейты обрабатываются.
+    """
+    deadline = time.monotonic() + LOCK_WAIT
+    delay = LOCK_RETRY_DELAY
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not is_locked(e) or time.monotonic() >= deadline:
+                raise
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LOCK_RETRY_MAX_DELAY)
@@ -0,0 +1,242 @@
+"""
+Выгрузка заявок (/export).
+
+Заявки читаются из хранилища страницами и сразу кодируются; готовые куски
+уходят в Telegram по мере формирования. Для csv и jsonl файл целиком не
+собирается ни в памяти, ни на диске, поэтому потребление памяти не зависит
+от размера выгрузки.
+
+Форматы:
+  csv     — как раньше, «;»-разделитель (с gz — сжатый gzip);
+  jsonl   — по объекту на строку, типизированные поля, всегда gzip;
+  parquet — колоночный формат для pandas/pyarrow: даты — timestamp,
+            числа — int, язык/категория/статус — словарные (category
+            в pandas). Нужен пакет pyarrow; файл собирается группами строк
+            в SpooledTemporaryFile (в памяти до SPOOL_MAX_SIZE, дальше на диске).
+
+Аргументы команды:
+  from=2025-01-01 to=2025-01-31 — период (включительно);
+  status=new|work|closed        — статус (можно через запятую);
+  category="..."                — категория, как в карточке;
+  limit=N                       — только последние N заявок (0 — все,
+                                  по умолчанию EXPORT_LOOKBACK);
+  format=csv|jsonl|parquet      — формат файла (по умолчанию csv);
+  gz                            — сжать gzip (для csv).
+"""
+
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import shlex
+import tempfile
+import zlib
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, Iterator, List, Optional
+
+from aiogram.types import InputFile
+
+from .config import EXPORT_LOOKBACK
+from .localization import STATUS_CODES
+from .storage import TICKET_FIELDS, TicketRepository
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+EXPORT_COLUMNS = (
+    "id",
+    "date",
+    "language",
+    "name",
+    "phone",
+    "category",
+    "status",
+    "text_len",
+    "attachments_count",
+)
+
+# Полная запись для jsonl/parquet — без текста обращения (как и в CSV)
+RECORD_FIELDS = tuple(f for f in TICKET_FIELDS if f != "text")
+
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+PAGE_SIZE = 1000
+ROW_GROUP_SIZE = 10000
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def parse_export_args(args: str) -> Dict[str, Any]:
+    """
+    Разобрать аргументы /export.
+    Возвращает {"query": {...} для iter_tickets, "format": ..., "gzip": bool}.
+    Ошибки формата — ValueError с понятным сообщением.
+    """
+    query: Dict[str, Any] = {"limit": EXPORT_LOOKBACK}
+    fmt = "csv"
+    gzip = False
+    try:
+        tokens = shlex.split(args or "")
+    except ValueError as e:
+        raise ValueError(f"не разобрать аргументы: {e}") from e
+
+    for token in tokens:
+        if token.lower() in ("gz", "gzip"):
+            gzip = True
+            continue
+        key, sep, value = token.partition("=")
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(f"непонятный аргумент: {token}")
+        if key in ("from", "to"):
+            try:
+                query["date_" + key] = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"дата должна быть в формате ГГГГ-ММ-ДД: {value}") from None
+        elif key == "status":
+            codes = [c.strip().lower() for c in value.split(",") if c.strip()]
+            unknown = [c for c in codes if c not in STATUS_CODES]
+            if unknown:
+                raise ValueError(f"неизвестный статус: {', '.join(unknown)}")
+            query["statuses"] = codes
+        elif key == "category":
+            query["category"] = value
+        elif key == "limit":
+            if not value.isdigit():
+                raise ValueError(f"limit должен быть числом: {value}")
+            query["limit"] = int(value)
+        elif key == "format":
+            fmt = value.lower()
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f"формат должен быть одним из: {', '.join(EXPORT_FORMATS)}")
+            if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+                raise ValueError("format=parquet: установите пакет pyarrow (pip install pyarrow)")
+        else:
+            raise ValueError(f"неизвестный параметр: {key}")
+
+    if fmt == "jsonl":
+        gzip = True
+    elif fmt == "parquet":
+        gzip = False  # parquet сжимается сам, постранично
+    return {"query": query, "format": fmt, "gzip": gzip}
+
+
+def _jsonable(rec: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: rec[k] for k in RECORD_FIELDS}
+    out["date"] = rec["date"].isoformat()
+    return out
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("id", pa.string()),
+        ("date", pa.timestamp("s", tz="UTC")),
+        ("language", category),
+        ("name", pa.string()),
+        ("phone", pa.string()),
+        ("category", category),
+        ("status", category),
+        ("text_len", pa.int32()),
+        ("attachments_count", pa.int16()),
+        ("task_id", pa.int64()),
+        ("crm_item_id", pa.int64()),
+        ("channel_message_id", pa.int64()),
+        ("status_code", category),
+    ])
+
+
+class TicketExportFile(InputFile):
+    """
+    Выгрузка, которая формируется во время отправки.
+    read() каждый раз заново читает хранилище, так что повтор отправки
+    (например, после RetryAfter) отдаёт файл целиком.
+    """
+
+    def __init__(self, repo: TicketRepository, query: Dict[str, Any], fmt: str = "csv", gzip: bool = False):
+        filename = f"export_{datetime.now():%Y%m%d_%H%M}.{fmt}" + (".gz" if gzip else "")
+        super().__init__(filename=filename)
+        self.repo = repo
+        self.query = query
+        self.format = fmt
+        self.gzip = gzip
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        return self.repo.iter_tickets(**self.query, page_size=PAGE_SIZE)
+
+    async def read(self, bot: "Bot") -> AsyncGenerator[bytes, None]:
+        if self.format == "parquet":
+            chunks = self._parquet_chunks()
+        else:
+            chunks = self._text_chunks()
+        async for chunk in chunks:
+            yield chunk
+
+    async def _text_chunks(self) -> AsyncGenerator[bytes, None]:
+        compressor = zlib.compressobj(wbits=31) if self.gzip else None  # 31 — формат gzip
+        buf = io.StringIO()
+        if self.format == "csv":
+            writer = csv.writer(buf, delimiter=";")
+            writer.writerow(EXPORT_COLUMNS)
+
+            def write(rec: Dict[str, Any]) -> None:
+                writer.writerow([rec[c] for c in EXPORT_COLUMNS])
+        else:
+            def write(rec: Dict[str, Any]) -> None:
+                buf.write(json.dumps(_jsonable(rec), ensure_ascii=False))
+                buf.write("\n")
+
+        def flush() -> bytes:
+            data = buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            return compressor.compress(data) if compressor else data
+
+        for rec in self.rows():
+            write(rec)
+            if buf.tell() >= self.chunk_size:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                # Даём поработать остальным обработчикам между страницами
+                await asyncio.sleep(0)
+
+        tail = flush()
+        if compressor:
+            tail += compressor.flush()
+        if tail:
+            yield tail
+
+    async def _parquet_chunks(self) -> AsyncGenerator[bytes, None]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = _arrow_schema()
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            # Группы строк по ROW_GROUP_SIZE: в памяти не больше одной группы
+            writer = pq.ParquetWriter(spool, schema, compression="zstd")
+            try:
+                page: List[Dict[str, Any]] = []
+                for rec in self.rows():
+                    page.append({k: rec[k] for k in RECORD_FIELDS})
+                    if len(page) >= ROW_GROUP_SIZE:
+                        writer.write_table(pa.Table.from_pylist(page, schema=schema))
+                        page = []
+                        await asyncio.sleep(0)
+                if page:
+                    writer.write_table(pa.Table.from_pylist(page, schema=schema))
+            finally:
+                writer.close()
+
+            spool.seek(0)
+            while True:
+                chunk = spool.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def first_ticket(repo: TicketRepository, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Есть ли что выгружать (берём одну запись, а не всю выборку)."""
+    return next(repo.iter_tickets(**{**query, "page_size": 1}), None)
@@ -0,0 +1,25 @@
+"""
+Фильтры aiogram поверх каталога локализации.
+
+Button("btn_done", "btn_skip") пропускает сообщение, если его текст — одна
+из этих кнопок на любом языке, и передаёт в хендлер button=<ключ>.
+Каталог берётся на момент вызова (плюс предыдущие версии, см.
+localization), поэтому новый язык или перезагруженные тексты не требуют
+правки фильтров.
+"""
+
+from typing import Any, Dict, Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import Message
+
+from . import localization
+
+
+class Button(BaseFilter):
+    def __init__(self, *keys: str):
+        self.keys = frozenset(keys)
+
+    async def __call__(self, message: Message) -> Union[bool, Dict[str, Any]]:
+        key = localization.match_button(message.text or "", self.keys)
+        return {"button": key} if key else False
@@ -0,0 +1,120 @@
+"""
+Хранилища состояния FSM (незаполненные формы).
+
+FSM_STORAGE:
+  memory — MemoryStorage aiogram (как раньше, теряется при рестарте);
+  sqlite — локальная SQLite-база бота, брошенные формы удаляются через FSM_TTL;
+  redis  — RedisStorage aiogram (нужен пакет redis), подходит любой сервер
+           с протоколом Redis; TTL ставится на ключи самим сервером.
+"""
+
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import DB_PATH, FSM_STORAGE, FSM_TTL, REDIS_URL
+from .db import connect, is_locked, retry_locked
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key        TEXT PRIMARY KEY,
+    state      TEXT,
+    data       TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_updated ON fsm(updated_at);
+"""
+
+
+class SqliteStorage(BaseStorage):
+    def __init__(self, path: str, ttl: float, purge_interval: float = 600):
+        self._db: sqlite3.Connection = connect(path)
+        self._db.executescript(_SCHEMA)
+        self._key_builder = DefaultKeyBuilder()
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def _purge(self, now: float) -> None:
+        """Удаляем брошенные и очищенные формы не чаще раза в purge_interval."""
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        try:
+            self._db.execute(
+                "DELETE FROM fsm WHERE updated_at < ? OR (state IS NULL AND data = '{}')",
+                (self._expired(now),),
+            )
+        except sqlite3.OperationalError as e:
+            # Базу держит другой процесс — почистим в следующий раз, форму не роняем
+            if not is_locked(e):
+                raise
+
+    def _expired(self, now: float) -> float:
+        """Записи с updated_at раньше этого момента брошены (0 — TTL выключен)."""
+        return now - self.ttl if self.ttl else 0
+
+    def _row(self, key: StorageKey) -> Optional[sqlite3.Row]:
+        row = self._db.execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?",
+            (self._key_builder.build(key),),
+        ).fetchone()
+        if row is None or row["updated_at"] < self._expired(time.time()):
+            return None
+        return row
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        now = time.time()
+        value = state.state if isinstance(state, State) else state
+        await retry_locked(
+            self._db.execute,
+            # Просроченная запись считается отсутствующей: её данные не воскрешаем
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, "
+            "data = CASE WHEN fsm.updated_at < ? THEN '{}' ELSE fsm.data END, "
+            "updated_at = excluded.updated_at",
+            (self._key_builder.build(key), value, now, self._expired(now)),
+        )
+        self._purge(now)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self._row(key)
+        return row["state"] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        now = time.time()
+        await retry_locked(
+            self._db.execute,
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET data = excluded.data, "
+            "state = CASE WHEN fsm.updated_at < ? THEN NULL ELSE fsm.state END, "
+            "updated_at = excluded.updated_at",
+            (self._key_builder.build(key), json.dumps(dict(data), ensure_ascii=False), now,
+             self._expired(now)),
+        )
+        self._purge(now)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self._row(key)
+        return json.loads(row["data"]) if row else {}
+
+    async def close(self) -> None:
+        self._db.close()
+
+
+def build_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "sqlite":
+        return SqliteStorage(DB_PATH, ttl=FSM_TTL)
+    if FSM_STORAGE == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis: установите пакет redis (pip install -r requirements-redis.txt)") from e
+        ttl = int(FSM_TTL) or None
+        return RedisStorage.from_url(REDIS_URL, state_ttl=ttl, data_ttl=ttl)
+    return MemoryStorage()
@@ -1,26 +1,18 @@
-import asyncio
-import csv
-import os
-import tempfile
 from collections import Counter
 from typing import Dict, Any
 
 from aiogram import F
-from aiogram.types import CallbackQuery, Message, FSInputFile
-
-from .bot_core import bot, router, HISTORY, TASK_INDEX
-from .config import (
-    SUPPORT_CHAT_ID,
-    BITRIX_MODE,
-    BITRIX_SMART_ENTITY_ID,
-)
-from .localization import t, TEXTS
-from .helpers import is_admin, replace_status_line
-from .bitrix_api import (
-    bitrix_task_comment,
-    bitrix_task_complete,
-    bitrix_crm_timeline_comment,
-)
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, Message
+
+from .bot_core import bot, router, tickets
+from .config import SUPPORT_CHAT_ID
+from .localization import t
+from .helpers import is_admin, render_card, replace_status_line
+from .keyboards import kb_admin_card
+from .db import retry_locked
+from .export import TicketExportFile, first_ticket, parse_export_args
+from . import outbox
 
 
 async def _ensure_admin(obj) -> bool:
@@ -38,6 +30,12 @@ async def _ensure_admin(obj) -> bool:
 
 # -------------------- Кнопки на карточке (В работу / Закрыть) --------------------
 
+# действие кнопки -> (код статуса, комментарий в Bitrix)
+_CARD_ACTIONS = {
+    "work": ("work", "Заявка взята в работу из Telegram"),
+    "close": ("closed", "Заявка закрыта из Telegram"),
+}
+
 
 @router.callback_query(F.data.startswith("adm:"))
 async def admin_card_action(callback: CallbackQuery):
@@ -50,71 +48,55 @@ async def admin_card_action(callback: CallbackQuery):
         return
 
     _, action, external_id = data
-    info: Dict[str, Any] | None = TASK_INDEX.get(external_id)
+    if action not in _CARD_ACTIONS:
+        await callback.answer("Неизвестное действие", show_alert=True)
+        return
 
-    if not info or not callback.message or not callback.message.text:
+    # Язык, поля и статус — из записи заявки; текст сообщения не разбираем
+    info: Dict[str, Any] | None = tickets.get(external_id)
+    if not info:
         await callback.answer("Карточка не найдена", show_alert=True)
         return
 
-    msg = callback.message
-    text = msg.text
-
-    # Пытаемся вытащить язык из второй строки "🌐 RU"
-    lang = "RU"
-    lines = text.splitlines()
-    if len(lines) >= 2 and "🌐" in lines[1]:
-        lang = lines[1].split("🌐", 1)[1].strip()
-
-    if action == "work":
-        new_status = t("card_status_work", lang)
-        bitrix_comment = "Заявка взята в работу из Telegram"
-    elif action == "close":
-        new_status = t("card_status_closed", lang)
-        bitrix_comment = "Заявка закрыта из Telegram"
-    else:
-        await callback.answer("Неизвестное действие", show_alert=True)
+    code, bitrix_comment = _CARD_ACTIONS[action]
+    if info["status_code"] == code:
+        await callback.answer("Статус обновлён")
         return
 
-    # Обновляем текст карточки
-    new_text = replace_status_line(text, new_status)
-    try:
-        await msg.edit_text(new_text, reply_markup=msg.reply_markup)
-    except Exception:
-        # если уже кто-то успел отредактировать — молча игнорируем
-        pass
-
-    # Обновляем наши структуры
-    info["status"] = new_status
-    task_id = info.get("task_id")
-    crm_item_id = info.get("crm_item_id")
-
-    for rec in reversed(HISTORY):
-        if rec["id"] == external_id:
-            rec["status"] = new_status
-            break
-
-    # Пишем комментарий в Bitrix
-    if action == "close":
-        if BITRIX_MODE == "CRM" and crm_item_id:
-            await asyncio.to_thread(
-                bitrix_crm_timeline_comment,
-                int(BITRIX_SMART_ENTITY_ID),
-                int(crm_item_id),
-                bitrix_comment,
-            )
-        elif task_id:
-            await asyncio.to_thread(bitrix_task_comment, int(task_id), bitrix_comment)
-            await asyncio.to_thread(bitrix_task_complete, int(task_id))
-    else:  # work
-        if BITRIX_MODE == "CRM" and crm_item_id:
-            await asyncio.to_thread(
-                bitrix_crm_timeline_comment,
-                int(BITRIX_SMART_ENTITY_ID),
-                int(crm_item_id),
-                bitrix_comment,
+    lang = info["language"]
+    await retry_locked(tickets.update, external_id, status=t(f"card_status_{code}", lang))
+    info = tickets.get(external_id)
+
+    if info.get("text") is not None:
+        new_text = render_card(info)
+    elif callback.message and callback.message.text:
+        # Заявка из базы до появления колонки text — правим строку статуса
+        new_text = replace_status_line(callback.message.text, info["status"])
+    else:
+        new_text = None
+
+    if new_text is not None:
+        # Сообщение с кнопкой может быть недоступно (старое) — тогда адрес из записи
+        msg = callback.message
+        chat_id = msg.chat.id if msg else SUPPORT_CHAT_ID
+        message_id = msg.message_id if msg else info["channel_message_id"]
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=new_text,
+                reply_markup=kb_admin_card(external_id, lang),
             )
-        elif task_id:
-            await asyncio.to_thread(bitrix_task_comment, int(task_id), bitrix_comment)
+        except Exception:
+            # если уже кто-то успел отредактировать — молча игнорируем
+            pass
+
+    # Комментарий (и закрытие) в Bitrix — через outbox, с повторами
+    await retry_locked(outbox.enqueue, external_id, action, {
+        "comment": bitrix_comment,
+        "task_id": info.get("task_id"),
+        "crm_item_id": info.get("crm_item_id"),
+    })
 
     await callback.answer("Статус обновлён")
 
@@ -140,24 +122,18 @@ async def cmd_stats(message: Message):
         return
 
     lang = "RU"
-    n = len(HISTORY)
-
-    status_new = t("card_status_new", lang)
-    status_work = t("card_status_work", lang)
-    status_closed = t("card_status_closed", lang)
+    counters = tickets.counters()
+    statuses = counters["status"]
+    n = sum(statuses.values())
 
-    new_count = sum(1 for r in HISTORY if r["status"] == status_new)
-    work_count = sum(1 for r in HISTORY if r["status"] == status_work)
-    closed_count = sum(1 for r in HISTORY if r["status"] == status_closed)
-
-    cats = Counter(r["category"] for r in HISTORY if r.get("category"))
+    cats = Counter(counters["category"])
     cats_str = ", ".join(f"{k}={v}" for k, v in cats.most_common()) or "нет данных"
 
     header = t("stats_header", lang).format(n=n)
     body = t("stats_line", lang).format(
-        new=new_count,
-        work=work_count,
-        closed=closed_count,
+        new=statuses.get("new", 0),
+        work=statuses.get("work", 0),
+        closed=statuses.get("closed", 0),
         cats=cats_str,
     )
 
@@ -166,53 +142,23 @@ async def cmd_stats(message: Message):
 # -------------------- /export --------------------
 
 
-@router.message(F.text == "/export")
-async def cmd_export(message: Message):
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
     if not await _ensure_admin(message):
         return
 
-    if not HISTORY:
-        await message.answer(t("export_empty", "RU"))
+    try:
+        params = parse_export_args(command.args or "")
+    except ValueError as e:
+        await message.answer(t("export_usage", "RU").format(error=e))
         return
 
-    fd, path = tempfile.mkstemp(prefix="export_", suffix=".csv")
-    os.close(fd)
+    if first_ticket(tickets, params["query"]) is None:
+        await message.answer(t("export_empty", "RU"))
+        return
 
-    try:
-        with open(path, "w", encoding="utf-8", newline="") as f:
-            writer = csv.writer(f, delimiter=";")
-            writer.writerow(
-                [
-                    "id",
-                    "date",
-                    "language",
-                    "name",
-                    "phone",
-                    "category",
-                    "status",
-                    "text_len",
-                    "attachments_count",
-                ]
-            )
-            for rec in HISTORY:
-                writer.writerow(
-                    [
-                        rec["id"],
-                        rec["date"],
-                        rec["language"],
-                        rec["name"],
-                        rec["phone"],
-                        rec["category"],
-                        rec["status"],
-                        rec["text_len"],
-                        rec["attachments_count"],
-                    ]
-                )
-
-        await message.answer_document(
-            FSInputFile(path),
-            caption=t("export_ready", "RU"),
-        )
-    finally:
-        if os.path.exists(path):
-            os.remove(path)
+    # Файл формируется по ходу загрузки — страницами из базы, без временного файла
+    await message.answer_document(
+        TicketExportFile(tickets, params["query"], fmt=params["format"], gzip=params["gzip"]),
+        caption=t("export_ready", "RU"),
+    )
@@ -1,12 +1,11 @@
 from typing import List, Dict, Any, Optional
-import asyncio
 
 from aiogram import F
 from aiogram.types import Message, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ContentType
 
-from .bot_core import bot, router, HISTORY, TASK_INDEX
+from .bot_core import bot, router, tickets
 from .config import (
     SUPPORT_CHAT_ID,
     BITRIX_MODE,
@@ -14,8 +13,11 @@ from .config import (
     BITRIX_SMART_CATEGORY_ID,
     BITRIX_SMART_STAGE_ID,
     BITRIX_RESPONSIBLE_ID,
+    CARD_ID_WAIT,
 )
-from .localization import t, TEXTS, CATEGORIES_BY_LANG
+from . import localization
+from .localization import t, is_category, match_button
+from .filters import Button
 from .states import Form
 from .keyboards import (
     kb_languages,
@@ -33,17 +35,17 @@ from .helpers import (
     truncate,
     generate_external_id,
     card_text,
+    entity_line,
     build_bitrix_description,
 )
-from .bitrix_api import (
-    bitrix_task_add,
-    bitrix_task_update_status,
-    bitrix_task_complete,
-    bitrix_task_comment,
-    bitrix_crm_item_add,
-    bitrix_crm_item_update,
-    bitrix_crm_timeline_comment,
-)
+from .attachments import send_attachments
+from .db import retry_locked
+from .metrics import TICKET_ATTACHMENTS
+from .tracing import span, tag, traced, context as trace_context
+from . import outbox
+
+# Сколько раз брать новый внешний ID, если выданный уже занят
+ID_ATTEMPTS = 3
 
 
 # -------------------- Старт и выбор языка --------------------
@@ -63,11 +65,17 @@ async def cmd_start(message: Message, state: FSMContext):
 async def set_lang(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in {"RU", "UZ", "EN"}:
-        await message.answer(TEXTS["RU"]["lang_prompt"], reply_markup=kb_languages())
+    if not localization.catalog.is_language(text):
+        await message.answer(t("lang_prompt", "RU"), reply_markup=kb_languages())
         return
 
-    await state.update_data(lang=text, attachments=[], category=None)
+    # Версия текстов, с которой начата форма (см. localization)
+    await state.update_data(
+        lang=text,
+        attachments=[],
+        category=None,
+        catalog_version=localization.catalog.version,
+    )
     await message.answer(
         t("consent_text", text),
         reply_markup=kb_consent(text),
@@ -139,7 +147,7 @@ async def category_step(message: Message, state: FSMContext):
     lang = data.get("lang", "RU")
     text = (message.text or "").strip()
 
-    if text not in CATEGORIES_BY_LANG.get(lang, []):
+    if not is_category(text, lang, data.get("catalog_version")):
         await message.answer(
             t("choose_category", lang),
             reply_markup=kb_categories(lang),
@@ -175,19 +183,7 @@ async def text_step(message: Message, state: FSMContext):
 # -------------------- Вложения --------------------
 
 
-@router.message(
-    Form.Attachments,
-    F.text.in_(
-        {
-            TEXTS["RU"]["btn_done"],
-            TEXTS["RU"]["btn_skip"],
-            TEXTS["UZ"]["btn_done"],
-            TEXTS["UZ"]["btn_skip"],
-            TEXTS["EN"]["btn_done"],
-            TEXTS["EN"]["btn_skip"],
-        }
-    ),
-)
+@router.message(Form.Attachments, Button("btn_done", "btn_skip"))
 async def attachments_done(message: Message, state: FSMContext):
     data = await state.get_data()
     lang = data.get("lang", "RU")
@@ -222,41 +218,41 @@ async def attachments_done(message: Message, state: FSMContext):
         }
     ),
 )
-async def attachments_collect(message: Message, state: FSMContext):
+async def attachments_collect(
+    message: Message,
+    state: FSMContext,
+    album: Optional[List[Message]] = None,
+):
+    # Альбом приходит одним вызовом (см. MediaGroupMiddleware)
     data = await state.get_data()
     lang = data.get("lang", "RU")
     attachments: List[Dict[str, str]] = data.get("attachments", [])
 
-    if len(attachments) >= 10:
-        await message.answer(t("too_many_attachments", lang))
-        return
-
-    if message.content_type == ContentType.PHOTO:
-        file_id = message.photo[-1].file_id
-        attachments.append({"type": "photo", "file_id": file_id})
-    elif message.content_type == ContentType.DOCUMENT:
-        attachments.append({"type": "document", "file_id": message.document.file_id})
-    elif message.content_type == ContentType.VIDEO:
-        attachments.append({"type": "video", "file_id": message.video.file_id})
-    elif message.content_type == ContentType.VOICE:
-        attachments.append({"type": "voice", "file_id": message.voice.file_id})
+    rejected = False
+    for m in album or [message]:
+        if len(attachments) >= 10:
+            rejected = True
+            break
+        if m.content_type == ContentType.PHOTO:
+            file_id = m.photo[-1].file_id
+            attachments.append({"type": "photo", "file_id": file_id})
+        elif m.content_type == ContentType.DOCUMENT:
+            attachments.append({"type": "document", "file_id": m.document.file_id})
+        elif m.content_type == ContentType.VIDEO:
+            attachments.append({"type": "video", "file_id": m.video.file_id})
+        elif m.content_type == ContentType.VOICE:
+            attachments.append({"type": "voice", "file_id": m.voice.file_id})
 
     await state.update_data(attachments=attachments)
 
+    if rejected:
+        await message.answer(t("too_many_attachments", lang))
+
 
 # -------------------- Обзор и правки --------------------
 
 
-@router.message(
-    Form.Review,
-    F.text.in_(
-        {
-            TEXTS["RU"]["btn_edit"],
-            TEXTS["UZ"]["btn_edit"],
-            TEXTS["EN"]["btn_edit"],
-        }
-    ),
-)
+@router.message(Form.Review, Button("btn_edit"))
 async def review_edit(message: Message, state: FSMContext):
     data = await state.get_data()
     lang = data.get("lang", "RU")
@@ -268,73 +264,63 @@ async def review_edit(message: Message, state: FSMContext):
     )
 
 
+# Кнопка меню правок -> (состояние, ключ подсказки)
+_EDIT_TARGETS = {
+    "edit_name": (Form.Name, "ask_name"),
+    "edit_phone": (Form.Phone, "ask_phone"),
+    "edit_category": (Form.Category, "choose_category"),
+    "edit_text": (Form.Text, "ask_text"),
+    "edit_attachments": (Form.Attachments, "attachments_hint"),
+}
+
+
 @router.message(Form.EditChoice)
 async def edit_choice(message: Message, state: FSMContext):
     data = await state.get_data()
     lang = data.get("lang", "RU")
     txt = (message.text or "").strip()
 
-    mapping = {
-        t("edit_name", lang): ("Name", t("ask_name", lang)),
-        t("edit_phone", lang): ("Phone", t("ask_phone", lang)),
-        t("edit_category", lang): ("Category", t("choose_category", lang)),
-        t("edit_text", lang): ("Text", t("ask_text", lang)),
-        t("edit_attachments", lang): ("Attachments", t("attachments_hint", lang)),
-    }
-
-    if txt not in mapping:
+    key = match_button(txt, _EDIT_TARGETS.keys(), lang)
+    if key is None:
         await message.answer(
             t("edit_what", lang),
             reply_markup=kb_edit_menu(lang),
         )
         return
 
-    target_state, prompt = mapping[txt]
+    target_state, prompt_key = _EDIT_TARGETS[key]
 
     await message.answer(
         t("review_back", lang).format(what=txt),
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    if target_state == "Name":
-        await state.set_state(Form.Name)
-        await message.answer(prompt)
-    elif target_state == "Phone":
-        await state.set_state(Form.Phone)
-        await message.answer(prompt)
-    elif target_state == "Category":
+    if target_state == Form.Category:
         await state.set_state(Form.Category)
         await message.answer(
-            prompt,
+            t(prompt_key, lang),
             reply_markup=kb_categories(lang),
         )
-    elif target_state == "Text":
-        await state.set_state(Form.Text)
-        await message.answer(prompt)
-    elif target_state == "Attachments":
+    elif target_state == Form.Attachments:
         await state.update_data(attachments=[])
         await state.set_state(Form.Attachments)
         await message.answer(
-            prompt,
+            t(prompt_key, lang),
             reply_markup=kb_attachments(lang),
         )
+    else:
+        await state.set_state(target_state)
+        await message.answer(t(prompt_key, lang))
 
 
 # -------------------- Отправка заявки --------------------
 
 
-@router.message(
-    Form.Review,
-    F.text.in_(
-        {
-            TEXTS["RU"]["btn_send"],
-            TEXTS["UZ"]["btn_send"],
-            TEXTS["EN"]["btn_send"],
-        }
-    ),
-)
+@router.message(Form.Review, Button("btn_send"))
+@traced("review_send")
 async def review_send(message: Message, state: FSMContext):
-    data = await state.get_data()
+    with span("fsm.get_data"):
+        data = await state.get_data()
     lang = data.get("lang", "RU")
 
     name = (data.get("name") or "").strip()
@@ -343,69 +329,82 @@ async def review_send(message: Message, state: FSMContext):
     text = (data.get("text") or "").strip()
     attachments: List[Dict[str, str]] = data.get("attachments", [])
 
-    external_id = generate_external_id()
     status_new = t("card_status_new", lang)
+    card = {
+        "lang": lang,
+        "name": name,
+        "phone": phone,
+        "category": category,
+        "text": text,
+        "status": status_new,
+    }
+
+    # 1) Заявка и задание на создание сущности в Bitrix24 (через outbox,
+    #    пользователь не ждёт портал) — одной транзакцией
+    for _ in range(ID_ATTEMPTS):
+        external_id = await retry_locked(generate_external_id)
+        tag(external_id=external_id, lang=lang, attachments=len(attachments))
+        ticket = {
+            "id": external_id,
+            "date": message.date,
+            "language": lang,
+            "name": name,
+            "phone": phone,
+            "category": category,
+            "status": status_new,
+            "text_len": len(text),
+            "attachments_count": len(attachments),
+            "task_id": None,
+            "crm_item_id": None,
+            "channel_message_id": None,
+            "text": text,
+        }
+        bitrix_job = _bitrix_job(external_id, card, attachments)
+        with span("tickets.create"):
+            if await retry_locked(outbox.create_ticket, ticket, bitrix_job):
+                break
+    else:
+        raise RuntimeError(f"не удалось выдать свободный внешний ID за {ID_ATTEMPTS} попытки")
+    TICKET_ATTACHMENTS.observe(len(attachments))
+
+    # 2) Ответ пользователю и предложение создать ещё одну заявку
+    with span("reply.submitted"):
+        await message.answer(
+            t("submitted", lang).format(eid=external_id),
+            reply_markup=ReplyKeyboardRemove(),
+        )
+    with span("reply.prompt"):
+        await message.answer(
+            t("after_submit_prompt", lang),
+            reply_markup=kb_after_submit(lang),
+        )
+    with span("fsm.clear"):
+        await state.clear()
+
+    # 3) Карточка и вложения — в фоне: хендлер не держит блокировку чата и
+    #    слот HANDLER_CONCURRENCY, пока канал ждёт своей очереди в лимите групп
+    outbox.spawn(_publish_card(external_id, card, attachments))
 
-    # 1) Карточка в служебный канал
-    msg = await bot.send_message(
-        chat_id=SUPPORT_CHAT_ID,
-        text=card_text(lang, external_id, name, phone, category, text, status_new),
-        reply_markup=kb_admin_card(external_id, lang),
-    )
 
-    # 2) Вложения отдельными сообщениями
-    send_tasks = []
-    for a in attachments:
-        if a["type"] == "photo":
-            send_tasks.append(
-                bot.send_photo(
-                    SUPPORT_CHAT_ID,
-                    a["file_id"],
-                    reply_to_message_id=msg.message_id,
-                )
-            )
-        elif a["type"] == "document":
-            send_tasks.append(
-                bot.send_document(
-                    SUPPORT_CHAT_ID,
-                    a["file_id"],
-                    reply_to_message_id=msg.message_id,
-                )
-            )
-        elif a["type"] == "video":
-            send_tasks.append(
-                bot.send_video(
-                    SUPPORT_CHAT_ID,
-                    a["file_id"],
-                    reply_to_message_id=msg.message_id,
-                )
-            )
-        elif a["type"] == "voice":
-            send_tasks.append(
-                bot.send_voice(
-                    SUPPORT_CHAT_ID,
-                    a["file_id"],
-                    reply_to_message_id=msg.message_id,
-                )
-            )
-
-    if send_tasks:
-        await asyncio.gather(*send_tasks)
-
-    # 3) Создаём сущность в Bitrix24
+def _bitrix_job(external_id: str, card: Dict[str, Any], attachments: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Задание outbox на создание задачи (или элемента CRM) по заявке."""
     description = build_bitrix_description(
-        lang,
-        name,
-        phone,
-        category,
-        text,
+        card["lang"],
+        card["name"],
+        card["phone"],
+        card["category"],
+        card["text"],
         attachments,
         external_id,
     )
-    title = f"Жалоба {name} ({phone}) — {external_id}"
-
-    task_id: Optional[int] = None
-    crm_item_id: Optional[int] = None
+    title = f"Жалоба {card['name']} ({card['phone']}) — {external_id}"
+    bitrix_job: Dict[str, Any] = {
+        "mode": "TASKS",
+        "title": title,
+        "description": description,
+        "responsible_id": BITRIX_RESPONSIBLE_ID,
+        "card": card,
+    }
 
     if BITRIX_MODE == "CRM" and BITRIX_SMART_ENTITY_ID:
         crm_fields: Dict[str, Any] = {
@@ -422,95 +421,51 @@ async def review_send(message: Message, state: FSMContext):
         if BITRIX_SMART_STAGE_ID:
             crm_fields["stageId"] = BITRIX_SMART_STAGE_ID
 
-        crm_item_id = await asyncio.to_thread(
-            bitrix_crm_item_add,
-            int(BITRIX_SMART_ENTITY_ID),
-            crm_fields,
+        bitrix_job["mode"] = "CRM"
+        bitrix_job["crm_fields"] = crm_fields
+
+    # Спаны outbox (создание сущности, правка карточки) попадут в эту же трассу
+    trace = trace_context()
+    if trace:
+        bitrix_job["trace"] = trace
+    return bitrix_job
+
+
+async def _publish_card(external_id: str, card: Dict[str, Any], attachments: List[Dict[str, str]]) -> None:
+    """
+    Карточка в служебный канал. Ждём Bitrix до CARD_ID_WAIT сек, чтобы
+    ID сущности попал в карточку сразу, без отдельной правки сообщения.
+    """
+    lang = card["lang"]
+    with span("bitrix.wait_created", timeout=CARD_ID_WAIT) as sp:
+        created = await outbox.wait_created(external_id, CARD_ID_WAIT)
+        sp.set("created", bool(created))
+    extra_line = entity_line(created["task_id"], created["crm_item_id"]) if created else ""
+    with span("card.send"):
+        msg = await bot.send_message(
+            chat_id=SUPPORT_CHAT_ID,
+            text=card_text(lang, external_id, card["name"], card["phone"], card["category"],
+                           card["text"], card["status"]) + extra_line,
+            reply_markup=kb_admin_card(external_id, lang),
         )
+    with span("tickets.update"):
+        await retry_locked(tickets.update, external_id, channel_message_id=msg.message_id)
 
-        if crm_item_id:
-            await asyncio.to_thread(
-                bitrix_crm_timeline_comment,
-                int(BITRIX_SMART_ENTITY_ID),
-                int(crm_item_id),
-                description,
-            )
-        else:
-            await bot.send_message(SUPPORT_CHAT_ID, t("bitrix_error", lang))
-    else:
-        task_id = await asyncio.to_thread(
-            bitrix_task_add,
-            title,
-            description,
-            BITRIX_RESPONSIBLE_ID,
-        )
-        if task_id is None:
-            await bot.send_message(SUPPORT_CHAT_ID, t("bitrix_error", lang))
-
-    # 3.1) Добавляем в карточку ID сущности
-    extra_line = ""
-    if crm_item_id:
-        extra_line = f"\n🧩 CRM item: {crm_item_id}"
-    elif task_id:
-        extra_line = f"\n🧩 Task ID: {task_id}"
-
-    if extra_line:
-        try:
-            await bot.edit_message_text(
-                chat_id=SUPPORT_CHAT_ID,
-                message_id=msg.message_id,
-                text=msg.text + extra_line,
-                reply_markup=msg.reply_markup,
-            )
-        except Exception:
-            pass
-
-    # 4) Обновляем индексы
-    TASK_INDEX[external_id] = {
-        "task_id": task_id,
-        "crm_item_id": crm_item_id,
-        "channel_message_id": msg.message_id,
-        "status": status_new,
-    }
+    # Портал ответил уже после дедлайна: outbox карточку ещё не видел — дописываем ID правкой
+    if not created:
+        with span("card.patch"):
+            await outbox.patch_card(external_id, card)
 
-    HISTORY.append(
-        {
-            "id": external_id,
-            "date": msg.date,
-            "language": lang,
-            "name": name,
-            "phone": phone,
-            "category": category,
-            "status": status_new,
-            "text_len": len(text),
-            "attachments_count": len(attachments),
-        }
-    )
-
-    # 5) Ответ пользователю и предложение создать ещё одну заявку
-    await message.answer(
-        t("submitted", lang).format(eid=external_id),
-        reply_markup=ReplyKeyboardRemove(),
-    )
-    await message.answer(
-        t("after_submit_prompt", lang),
-        reply_markup=kb_after_submit(lang),
-    )
-    await state.clear()
+    # Вложения — альбомами ответом на карточку
+    if attachments:
+        with span("attachments.send", count=len(attachments)):
+            await send_attachments(bot, SUPPORT_CHAT_ID, attachments, msg.message_id)
 
 
 # -------------------- Шорткат "новая заявка" --------------------
 
 
-@router.message(
-    F.text.in_(
-        {
-            TEXTS["RU"]["btn_new_request"],
-            TEXTS["UZ"]["btn_new_request"],
-            TEXTS["EN"]["btn_new_request"],
-        }
-    )
-)
+@router.message(Button("btn_new_request"))
 async def new_request_shortcut(message: Message, state: FSMContext):
     await state.clear()
     await state.set_state(Form.Lang)
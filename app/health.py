@@ -0,0 +1,312 @@
+"""
+Монитор цикла событий и проверки здоровья.
+
+Все сотрудники обслуживаются одним циклом событий: любой блокирующий вызов
+в нём задерживает ответы всем сразу. Монитор:
+  — раз в LOOP_MONITOR_INTERVAL мерит, насколько опоздал таймер цикла
+    (event_loop_lag_seconds);
+  — сторожевым потоком замечает, что цикл не отвечает дольше
+    LOOP_STALL_THRESHOLD, и пишет в лог стек кода, который его держит;
+  — мерит, сколько пустая задача ждёт потока в пуле по умолчанию
+    (asyncio.to_thread / run_in_executor), и глубину очереди пула.
+
+Служебный сервер (metrics.py, METRICS_PORT) дополнительно отдаёт:
+  /healthz — процесс жив, цикл событий отвечает;
+  /readyz  — бот получает апдейты и Bitrix24 доступен (503, если нет).
+При HEALTH_PORT проверки отдаёт ещё и отдельный сервер — без метрик.
+
+Готовность по Telegram зависит от режима: polling — успешный getUpdates не
+старше HEALTH_POLL_STALE; webhook — вебхук установлен; worker (cluster) —
+апдейты раздаёт супервизор, проверяем только запуск. Во всех режимах
+несколько подряд сетевых ошибок Bot API означают «не готов». Bitrix24
+считается доступным, если портал отвечает (в том числе отказом по лимиту);
+при простое раз в HEALTH_BITRIX_PROBE_INTERVAL вызывается server.time.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, Optional, Set
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import GetUpdates, SetWebhook, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiohttp import web
+
+from .config import (
+    BITRIX_BASE,
+    HEALTH_BITRIX_PROBE_INTERVAL,
+    HEALTH_HOST,
+    HEALTH_PORT,
+    HEALTH_POLL_STALE,
+    LOOP_MONITOR_INTERVAL,
+    LOOP_STALL_THRESHOLD,
+)
+from .metrics import (
+    LOOP_LAG,
+    LOOP_STALLS,
+    THREAD_POOL_QUEUE,
+    THREAD_POOL_THREADS,
+    THREAD_POOL_WAIT,
+    add_route,
+    on_collect,
+    serve,
+)
+
+log = logging.getLogger(__name__)
+
+# Столько сетевых ошибок / 5xx Bot API подряд — Telegram считаем недоступным
+TELEGRAM_FAILURES_UNREADY = 3
+
+
+class _State:
+    def __init__(self) -> None:
+        self.mode = "polling"
+        self.started = False
+        self.heartbeat = time.monotonic()
+        self.lag = 0.0
+        self.stalled_since: Optional[float] = None
+        self.last_poll: Optional[float] = None
+        self.webhook_set = False
+        self.telegram_failures = 0
+        self.telegram_error = ""
+        self.bitrix_last: Optional[float] = None
+        self.bitrix_ok: Optional[bool] = None
+        self.bitrix_error = ""
+
+
+_state = _State()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_tasks: Set[asyncio.Task] = set()
+_watchdog: Optional[threading.Thread] = None
+_stop = threading.Event()
+_runner: Optional[web.AppRunner] = None
+
+
+def set_mode(mode: str) -> None:
+    """polling, webhook или worker — от режима зависит проверка Telegram в /readyz."""
+    _state.mode = mode
+
+
+# -------------------- Внешние сервисы --------------------
+
+
+class TelegramHealth(BaseRequestMiddleware):
+    """Request-middleware сессии: успешные getUpdates / setWebhook и ошибки Bot API подряд."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        try:
+            response = await make_request(bot, method)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            _state.telegram_failures += 1
+            _state.telegram_error = f"{type(method).__name__}: {e!r}"
+            raise
+        _state.telegram_failures = 0
+        if isinstance(method, GetUpdates):
+            _state.last_poll = time.monotonic()
+        elif isinstance(method, SetWebhook):
+            _state.webhook_set = True
+        return response
+
+
+def note_bitrix(reachable: bool, error: str = "") -> None:
+    """Результат вызова портала (из bitrix_api._call): ответил ли он вообще."""
+    _state.bitrix_last = time.monotonic()
+    _state.bitrix_ok = reachable
+    _state.bitrix_error = error
+
+
+def _bitrix_configured() -> bool:
+    return BITRIX_BASE != "/"
+
+
+# -------------------- Монитор цикла событий --------------------
+
+
+async def _lag_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_MONITOR_INTERVAL
+        await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        _state.lag = lag
+        _state.heartbeat = time.monotonic()
+        LOOP_LAG.observe(lag)
+        if lag >= LOOP_STALL_THRESHOLD and _state.stalled_since is None:
+            # Сторожевой поток этот случай не застал — хотя бы отметим в логе
+            log.warning("Цикл событий опоздал на %.2f с", lag)
+
+
+def _noop() -> None:
+    pass
+
+
+async def _pool_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+        started = time.perf_counter()
+        await loop.run_in_executor(None, _noop)
+        THREAD_POOL_WAIT.observe(time.perf_counter() - started)
+
+
+async def _bitrix_loop() -> None:
+    from .bitrix_api import bitrix_ping
+
+    while True:
+        idle = HEALTH_BITRIX_PROBE_INTERVAL
+        if _state.bitrix_last is not None:
+            idle = time.monotonic() - _state.bitrix_last
+        if idle >= HEALTH_BITRIX_PROBE_INTERVAL:
+            await bitrix_ping()
+            idle = 0.0
+        await asyncio.sleep(HEALTH_BITRIX_PROBE_INTERVAL - idle)
+
+
+def _watch(loop_thread_id: int) -> None:
+    """Сторожевой поток: цикл событий давно не обновлял heartbeat — пишем его стек."""
+    limit = LOOP_MONITOR_INTERVAL + LOOP_STALL_THRESHOLD
+    while not _stop.wait(LOOP_MONITOR_INTERVAL / 2):
+        silent = time.monotonic() - _state.heartbeat
+        if silent < limit:
+            if _state.stalled_since is not None:
+                log.warning("Цикл событий снова отвечает, простой %.2f с",
+                            time.monotonic() - _state.stalled_since)
+                _state.stalled_since = None
+            continue
+        if _state.stalled_since is not None:
+            continue
+        _state.stalled_since = _state.heartbeat + LOOP_MONITOR_INTERVAL
+        LOOP_STALLS.inc()
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(стек недоступен)\n"
+        log.warning("Цикл событий не отвечает %.2f с. Сейчас выполняется:\n%s", silent, stack.rstrip())
+
+
+def _collect_pool() -> None:
+    executor = getattr(_loop, "_default_executor", None)
+    if not isinstance(executor, concurrent.futures.ThreadPoolExecutor):
+        return
+    # Внутренние поля ThreadPoolExecutor: публичного способа узнать загрузку нет
+    THREAD_POOL_QUEUE.set(executor._work_queue.qsize())
+    THREAD_POOL_THREADS.set(len(executor._threads), "running")
+    THREAD_POOL_THREADS.set(executor._max_workers, "max")
+
+
+on_collect(_collect_pool)
+
+
+async def start_health_monitor() -> None:
+    global _loop, _watchdog
+    _state.started = True
+    _loop = asyncio.get_running_loop()
+    if _bitrix_configured():
+        _spawn(_bitrix_loop())
+    if LOOP_MONITOR_INTERVAL <= 0 or _watchdog is not None:
+        return
+    _state.heartbeat = time.monotonic()
+    _spawn(_lag_loop())
+    _spawn(_pool_loop())
+    _stop.clear()
+    _watchdog = threading.Thread(target=_watch, args=(threading.get_ident(),),
+                                 name="loop-watchdog", daemon=True)
+    _watchdog.start()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def stop_health_monitor() -> None:
+    global _watchdog
+    _state.started = False
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    if _watchdog is not None:
+        _stop.set()
+        _watchdog.join(timeout=1)
+        _watchdog = None
+
+
+# -------------------- /healthz и /readyz --------------------
+
+
+def _ago(moment: Optional[float]) -> Optional[float]:
+    return None if moment is None else round(time.monotonic() - moment, 1)
+
+
+def _telegram_check() -> Dict[str, Any]:
+    check: Dict[str, Any] = {"mode": _state.mode, "failures": _state.telegram_failures}
+    ok = _state.started and _state.telegram_failures < TELEGRAM_FAILURES_UNREADY
+    if _state.mode == "polling":
+        check["last_poll_ago"] = _ago(_state.last_poll)
+        ok = ok and _state.last_poll is not None and time.monotonic() - _state.last_poll <= HEALTH_POLL_STALE
+    elif _state.mode == "webhook":
+        check["webhook_set"] = _state.webhook_set
+        ok = ok and _state.webhook_set
+    if _state.telegram_failures:
+        check["error"] = _state.telegram_error
+    check["ok"] = ok
+    return check
+
+
+def _bitrix_check() -> Dict[str, Any]:
+    if not _bitrix_configured():
+        return {"ok": True, "configured": False}
+    check: Dict[str, Any] = {"ok": bool(_state.bitrix_ok), "last_call_ago": _ago(_state.bitrix_last)}
+    if _state.bitrix_error:
+        check["error"] = _state.bitrix_error
+    return check
+
+
+async def _handle_healthz(request: web.Request) -> web.Response:
+    # Раз обработчик выполнился, цикл событий жив; в ответе — последняя задержка
+    return web.json_response({
+        "status": "ok",
+        "loop_lag": round(_state.lag, 4),
+        "loop_stalls": LOOP_STALLS.value(),
+    })
+
+
+async def _handle_readyz(request: web.Request) -> web.Response:
+    checks = {"telegram": _telegram_check(), "bitrix": _bitrix_check()}
+    ready = all(c["ok"] for c in checks.values())
+    return web.json_response({"ready": ready, "checks": checks}, status=200 if ready else 503)
+
+
+add_route("/healthz", _handle_healthz)
+add_route("/readyz", _handle_readyz)
+
+
+async def start_health_server(port_offset: int = 0) -> None:
+    """Отдельный сервер проверок (HEALTH_PORT=0 — выключен). port_offset — номер воркера в режиме cluster."""
+    global _runner
+    if not HEALTH_PORT or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/healthz", _handle_healthz)
+    app.router.add_get("/readyz", _handle_readyz)
+    port = HEALTH_PORT + port_offset
+    _runner = await serve(app, HEALTH_HOST, port, "Проверки здоровья")
+    if _runner is not None:
+        log.info("Проверки здоровья: http://%s:%s/healthz, /readyz", HEALTH_HOST, port)
+
+
+async def stop_health_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
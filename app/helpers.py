@@ -1,9 +1,9 @@
 import re
-from datetime import datetime
 from typing import Dict, Any, List
 
-from .config import ADMIN_IDS, ID_PREFIX
-import app.bot_core as core  # чтобы менять core.ID_COUNTER, а не копию
+from .config import ADMIN_IDS
+from .localization import STATUS_CODES, t
+import app.bot_core as core
 
 
 # --- Права и валидация ввода ---
@@ -30,8 +30,7 @@ def truncate(s: str, n: int = 140) -> str:
     return s if len(s) <= n else s[:n - 1] + "…"
 
 def generate_external_id() -> str:
-    core.ID_COUNTER += 1
-    return f"{ID_PREFIX}-{datetime.utcnow().year}-{core.ID_COUNTER:06d}"
+    return core.ids.next_id()
 
 
 def card_text(lang: str, external_id: str, name: str, phone: str,
@@ -46,8 +45,32 @@ def card_text(lang: str, external_id: str, name: str, phone: str,
         f"{text}"
     )
 
+def entity_line(task_id: Any, crm_item_id: Any) -> str:
+    """Строка с ID сущности Bitrix24 для карточки (пустая, если сущности ещё нет)."""
+    if crm_item_id:
+        return f"\n🧩 CRM item: {crm_item_id}"
+    if task_id:
+        return f"\n🧩 Task ID: {task_id}"
+    return ""
+
+def render_card(ticket: Dict[str, Any]) -> str:
+    """
+    Карточка заявки по записи из хранилища: язык, поля и статус берутся из
+    записи, текст статуса — из текущего каталога по status_code.
+    """
+    lang = ticket["language"]
+    code = ticket.get("status_code")
+    status = t(f"card_status_{code}", lang) if code in STATUS_CODES else ticket["status"]
+    return card_text(
+        lang, ticket["id"], ticket["name"], ticket["phone"], ticket["category"],
+        ticket.get("text") or "", status,
+    ) + entity_line(ticket.get("task_id"), ticket.get("crm_item_id"))
+
+_STATUS_LINE_RE = re.compile(r"(🔧 Статус:[^\S\n]*).*")
+
 def replace_status_line(txt: str, new_status: str) -> str:
-    return re.sub(r"(🔧 Статус:\s*)(.*)", rf"\1{new_status}", txt)
+    # Функция вместо шаблона замены: «\» и «\1» в статусе не разбираются как ссылки
+    return _STATUS_LINE_RE.sub(lambda m: m.group(1) + new_status, txt, count=1)
 
 def build_bitrix_description(lang: str, name: str, phone: str,
                              category: str, text: str,
@@ -0,0 +1,83 @@
+"""
+Выдача внешних ID заявок: {ID_PREFIX}-{год}-{n:06d}.
+
+Номера резервируются блоками в SQLite: одна запись на диск на block_size
+заявок. Резервирование идёт в транзакции BEGIN IMMEDIATE, поэтому
+несколько процессов бота на одном файле получают непересекающиеся блоки.
+Номера из недоиспользованного блока после рестарта пропускаются — это
+допустимо, повторов не бывает. Нумерация начинается заново каждый год.
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Optional
+
+from .db import connect
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS id_blocks (
+    prefix     TEXT    NOT NULL,
+    year       INTEGER NOT NULL,
+    next_value INTEGER NOT NULL,
+    PRIMARY KEY (prefix, year)
+);
+"""
+
+
+class IdAllocator:
+    def __init__(self, path: str, prefix: str, block_size: int = 50):
+        self.path = path
+        self.prefix = prefix
+        self.block_size = max(1, block_size)
+        self._db: Optional[sqlite3.Connection] = None
+        self._year = 0
+        self._next = 0
+        self._end = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = connect(self.path)
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def _max_issued(self, db: sqlite3.Connection, year: int) -> int:
+        """Максимальный уже выданный номер за год — на случай базы, заполненной до появления блоков."""
+        head = f"{self.prefix}-{year}-"
+        try:
+            row = db.execute(
+                "SELECT MAX(CAST(substr(id, ?) AS INTEGER)) FROM tickets WHERE id LIKE ?",
+                (len(head) + 1, head + "%"),
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] or 0
+
+    def _reserve(self, year: int) -> None:
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT next_value FROM id_blocks WHERE prefix = ? AND year = ?",
+                (self.prefix, year),
+            ).fetchone()
+            start = row[0] if row else self._max_issued(db, year) + 1
+            db.execute(
+                "INSERT INTO id_blocks (prefix, year, next_value) VALUES (?, ?, ?) "
+                "ON CONFLICT (prefix, year) DO UPDATE SET next_value = excluded.next_value",
+                (self.prefix, year, start + self.block_size),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._year = year
+        self._next = start
+        self._end = start + self.block_size
+
+    def next_id(self) -> str:
+        year = datetime.utcnow().year
+        if year != self._year or self._next >= self._end:
+            self._reserve(year)
+        n = self._next
+        self._next += 1
+        return f"{self.prefix}-{year}-{n:06d}"
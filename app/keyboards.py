@@ -1,45 +1,109 @@
-from aiogram.types import ReplyKeyboardMarkup, InlineKeyboardMarkup
-from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+"""
+Клавиатуры бота.
 
-from .localization import TEXTS, CATEGORIES_BY_LANG, t
+Все reply-клавиатуры зависят только от языка, поэтому строятся один раз при
+импорте (и после перезагрузки текстов) — по экземпляру на (клавиатура,
+язык) — и дальше отдаются готовыми. Клавиатура карточки зависит от
+external_id и кешируется последними CARD_CACHE_SIZE заявками.
 
+Модели клавиатур aiogram изменяемые (MutableTelegramObject), а кешированный
+экземпляр общий для всех сообщений. Поэтому в кеше лежат их неизменяемые
+подклассы: поля нельзя присвоить (frozen), ряды кнопок — кортежи.
+"""
 
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-def kb_languages() -> ReplyKeyboardMarkup:
+import aiogram.types
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from pydantic import ConfigDict, field_serializer
+
+from . import localization
+from .localization import t
+
+CARD_CACHE_SIZE = 1024
+
+
+# -------------------- Неизменяемые модели --------------------
+
+
+class FrozenKeyboardButton(KeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenReplyKeyboard(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+    keyboard: Tuple[Tuple[FrozenKeyboardButton, ...], ...]
+
+    @field_serializer("keyboard")
+    def _rows(self, rows: Tuple[Tuple[FrozenKeyboardButton, ...], ...]) -> List[List[Any]]:
+        # Сессия aiogram разбирает при отправке только списки
+        return [list(row) for row in rows]
+
+
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenInlineKeyboard(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+    inline_keyboard: Tuple[Tuple[FrozenInlineKeyboardButton, ...], ...]
+
+    @field_serializer("inline_keyboard")
+    def _rows(self, rows: Tuple[Tuple[FrozenInlineKeyboardButton, ...], ...]) -> List[List[Any]]:
+        return [list(row) for row in rows]
+
+
+# Аннотации полей aiogram — строки; разрешаем их так же, как aiogram.types для своих моделей
+for _model in (FrozenKeyboardButton, FrozenReplyKeyboard, FrozenInlineKeyboardButton, FrozenInlineKeyboard):
+    _model.model_rebuild(_types_namespace=vars(aiogram.types))
+
+
+def _freeze(markup: ReplyKeyboardMarkup) -> FrozenReplyKeyboard:
+    return FrozenReplyKeyboard.model_validate(markup.model_dump(exclude_none=True))
+
+
+# -------------------- Клавиатуры --------------------
+
+
+def _build_languages(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
-    b.button(text=TEXTS["RU"]["lang_ru"])
-    b.button(text=TEXTS["UZ"]["lang_uz"])
-    b.button(text=TEXTS["EN"]["lang_en"])
-    b.adjust(3)
+    codes = localization.catalog.languages
+    for code in codes:
+        b.button(text=t(f"lang_{code.lower()}", code))
+    b.adjust(len(codes))
     return b.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-def kb_consent(lang: str) -> ReplyKeyboardMarkup:
+def _build_consent(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
     b.button(text=t("consent_agree", lang))
     return b.as_markup(resize_keyboard=True)
 
-def kb_categories(lang: str) -> ReplyKeyboardMarkup:
+def _build_categories(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
-    for cat in CATEGORIES_BY_LANG[lang]:
+    for cat in localization.catalog.categories[lang]:
         b.button(text=cat)
     b.adjust(2)
     return b.as_markup(resize_keyboard=True)
 
-def kb_attachments(lang: str) -> ReplyKeyboardMarkup:
+def _build_attachments(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
     b.button(text=t("btn_done", lang))
     b.button(text=t("btn_skip", lang))
     b.adjust(2)
     return b.as_markup(resize_keyboard=True)
 
-def kb_review(lang: str) -> ReplyKeyboardMarkup:
+def _build_review(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
     b.button(text=t("btn_edit", lang))
     b.button(text=t("btn_send", lang))
     b.adjust(2)
     return b.as_markup(resize_keyboard=True)
 
-def kb_edit_menu(lang: str) -> ReplyKeyboardMarkup:
+def _build_edit_menu(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
     b.button(text=t("edit_name", lang))
     b.button(text=t("edit_phone", lang))
@@ -49,16 +113,69 @@ def kb_edit_menu(lang: str) -> ReplyKeyboardMarkup:
     b.adjust(2, 2, 1)
     return b.as_markup(resize_keyboard=True)
 
-
-def kb_admin_card(external_id: str, lang: str) -> InlineKeyboardMarkup:
-    ib = InlineKeyboardBuilder()
-    ib.button(text="🛠 В работу", callback_data=f"adm:work:{external_id}")
-    ib.button(text="✅ Закрыть", callback_data=f"adm:close:{external_id}")
-    return ib.as_markup()
-
 # Post-submit keyboard
-def kb_after_submit(lang: str) -> ReplyKeyboardMarkup:
+def _build_after_submit(lang: str) -> ReplyKeyboardMarkup:
     b = ReplyKeyboardBuilder()
     b.button(text=t("btn_new_request", lang))
     b.adjust(1)
-    return b.as_markup(resize_keyboard=True)
\ No newline at end of file
+    return b.as_markup(resize_keyboard=True)
+
+
+_BUILDERS: Dict[str, Callable[[str], ReplyKeyboardMarkup]] = {
+    "languages": _build_languages,
+    "consent": _build_consent,
+    "categories": _build_categories,
+    "attachments": _build_attachments,
+    "review": _build_review,
+    "edit_menu": _build_edit_menu,
+    "after_submit": _build_after_submit,
+}
+
+KEYBOARDS: Dict[Tuple[str, str], FrozenReplyKeyboard] = {}
+
+
+def build_keyboards(catalog: Optional[localization.Catalog] = None) -> None:
+    """(Пере)собрать все клавиатуры для всех языков каталога и подменить разом."""
+    global KEYBOARDS
+    languages = (catalog or localization.catalog).languages
+    KEYBOARDS = {(name, lang): _freeze(build(lang)) for name, build in _BUILDERS.items() for lang in languages}
+
+
+def _kb(name: str, lang: str) -> ReplyKeyboardMarkup:
+    # Незнакомый язык — как в t(): русский вариант
+    return KEYBOARDS.get((name, lang)) or KEYBOARDS[(name, "RU")]
+
+
+build_keyboards()
+localization.on_reload(build_keyboards)
+
+
+def kb_languages() -> ReplyKeyboardMarkup:
+    return _kb("languages", "RU")
+
+def kb_consent(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("consent", lang)
+
+def kb_categories(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("categories", lang)
+
+def kb_attachments(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("attachments", lang)
+
+def kb_review(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("review", lang)
+
+def kb_edit_menu(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("edit_menu", lang)
+
+
+@lru_cache(maxsize=CARD_CACHE_SIZE)
+def kb_admin_card(external_id: str, lang: str) -> InlineKeyboardMarkup:
+    # Две кнопки без builder-а: карточка строится на каждую заявку и каждую её правку
+    return FrozenInlineKeyboard(inline_keyboard=((
+        FrozenInlineKeyboardButton(text="🛠 В работу", callback_data=f"adm:work:{external_id}"),
+        FrozenInlineKeyboardButton(text="✅ Закрыть", callback_data=f"adm:close:{external_id}"),
+    ),))
+
+def kb_after_submit(lang: str) -> ReplyKeyboardMarkup:
+    return _kb("after_submit", lang)
@@ -1,158 +1,312 @@
-from typing import Dict
-
-# Все текстовые константы бота
-TEXTS: Dict[str, Dict[str, str]] = {
-    "RU": {
-        "lang_prompt": "Выберите язык / Tilni tanlang / Choose language",
-        "consent_text": (
-            "<b>Согласие на обработку данных</b>\n\n🔒 Нажмите «✅ Да, согласен», если разрешаете использовать ваше имя и телефон для связи по вашему обращению. Будьте уверены — каждое заявление обязательно будет рассмотрено и останется строго конфиденциальным."
-        ),
-        "consent_agree": "✅ Да, согласен",
-        "ask_name": "👤 Как к вам обращаться? Укажите <b>имя и фамилию</b> (например: Иван Петров).",
-        "ask_phone": "📞 Напишите номер телефона. Пример: +998 90 123-45-67. Главное: должно быть не меньше 7 цифр.",
-        "invalid_name": "⚠️ Имя и фамилия: от 2 до 120 символов. Пример: Иван Петров.",
-        "invalid_phone": "⚠️ Не похоже на номер. Нужно хотя бы 7 цифр. Примеры: +998901234567, 90 123-45-67. Попробуйте ещё раз.",
-        "choose_category": "📂 Выберите <b>категорию</b> обращения:",
-        "ask_text": "📝 Опишите ситуацию. Минимум 15 символов. Пишите по делу, без личных данных третьих лиц.",
-        "text_too_short": "Слишком коротко. Нужен осмысленный текст от 15 символов.",
-        "attachments_hint": "📎 Пришлите вложения (фото/видео/документы/голосовые), максимум 10. Когда закончите — нажмите «Готово».",
-        "btn_done": "Готово",
-        "btn_skip": "Пропустить",
-        "too_many_attachments": "Превышен лимит: максимум 10 вложений. Лишние не приняты.",
-        "review_title": "🔍 <b>Финальная проверка</b>",
-        "review_fields": "🌐 Язык: {lang}\n👤 Имя: {name}\n📞 Телефон: {phone}\n📂 Категория: {cat}\n📝 Текст: {text_sample}\n📎 Вложений: {n}",
-        "btn_edit": "✏️ Изменить",
-        "btn_send": "📨 Отправить",
-        "edit_what": "Что хотите изменить?",
-        "edit_name": "Имя",
-        "edit_phone": "Телефон",
-        "edit_category": "Категорию",
-        "edit_text": "Текст",
-        "edit_attachments": "Вложения",
-        "review_back": "Вернулся к этапу: {what}. Продолжайте.",
-        "submitted": "✅ Готово. Ваше обращение зарегистрировано с ID <b>{eid}</b>.\nМы свяжемся по указанному телефону.",
-        "card_status_new": "новое",
-        "card_status_work": "в работе",
-        "card_status_closed": "закрыто",
-        "admin_no_access": "Нет доступа",
-        "stats_header": "<b>Статистика по последним {n} карточкам</b>",
-        "stats_line": "Статусы: новое={new}, в работе={work}, закрыто={closed}\nКатегории: {cats}",
-        "whereami": "chat_id: <code>{cid}</code>",
-        "export_ready": "Экспорт готов. Отправляю CSV.",
-        "export_empty": "Нет данных для экспорта.",
-        "bitrix_error": "Внимание: Bitrix24 временно недоступен. Карточка создана, но задача не обновлена.",
-        "categories": "Угрозы, Вымогательство, Шантаж, Препятствие работе, Незаконные действия, Унижение/оскорбления, Коррупция, Злоупотребление полномочиями, Другое",
-        "lang_ru": "RU",
-        "lang_uz": "UZ",
-        "lang_en": "EN",
-        "after_submit_prompt": "Создать ещё одну заявку?",
-        "btn_new_request": "🆕 Создать заявку",
-    },
-
-    "UZ":{
-        "lang_prompt": "Tilni tanlang / Выберите язык / Choose language",
-        "consent_text": (
-            "<b>Shaxsiy ma'lumotlarga rozilik</b>\n\n🔒 «✅ Roziman» ni bossangiz, murojaat bo‘yicha aloqa uchun ismingiz va telefoningizdan foydalanishga rozilik berasiz. Ishoning: har bir murojaat albatta ko‘rib chiqiladi va qat’iy maxfiy saqlanadi."
-        ),
-        "consent_agree": "✅ Roziman",
-        "ask_name": "👤 Qanday murojaat qilamiz? <b>Ism va familiyangizni</b> kiriting (masalan: Ali Valiyev).",
-        "ask_phone": "📞 Telefon raqamingizni yozing. Misol: +998 90 123‑45‑67. Eng asosiysi: kamida 7 ta raqam bo‘lsin.",
-        "invalid_name": "⚠️ Ism va familiya: 2–120 belgi. Misol: Ali Valiyev.",
-        "invalid_phone": "⚠️ Telefon to‘g‘ri emas. Kamida 7 ta raqam kerak. Misollar: +998901234567, 90 123‑45‑67. Qayta kiriting.",
-        "choose_category": "📂 <b>Murojaat turini</b> tanlang:",
-        "ask_text": "📝 Vaziyatni batafsil yozing. Kamida 15 ta belgi. Ortiqcha shaxsiy ma'lumotlarsiz.",
-        "text_too_short": "Matn juda qisqa. Kamida 15 ta belgi kerak.",
-        "attachments_hint": "📎 Ilovalarni yuboring (foto/video/hujjat/ovozli), maksimal 10 ta. Tugatgach «Tayyor»ni bosing.",
-        "btn_done": "Tayyor",
-        "btn_skip": "O‘tkazib yuborish",
-        "too_many_attachments": "Limit oshib ketdi: maksimal 10 ta ilova.",
-        "review_title": "🔍 <b>Yakuniy tekshiruv</b>",
-        "review_fields": "🌐 Til: {lang}\n👤 Ism: {name}\n📞 Telefon: {phone}\n📂 Tur: {cat}\n📝 Matn: {text_sample}\n📎 Ilovalar: {n}",
-        "btn_edit": "✏️ Tuzatish",
-        "btn_send": "📨 Yuborish",
-        "edit_what": "Nimani tuzatamiz?",
-        "edit_name": "Ism",
-        "edit_phone": "Telefon",
-        "edit_category": "Tur",
-        "edit_text": "Matn",
-        "edit_attachments": "Ilovalar",
-        "review_back": "Bosqichga qaytdik: {what}. Davom eting.",
-        "submitted": "✅ Qabul qilindi. Sizning ID: <b>{eid}</b>.",
-        "card_status_new": "yangi",
-        "card_status_work": "jarayonda",
-        "card_status_closed": "yopildi",
-        "admin_no_access": "Ruxsat yo‘q",
-        "stats_header": "<b>Oxirgi {n} karta bo‘yicha statistika</b>",
-        "stats_line": "Holatlar: yangi={new}, jarayonda={work}, yopildi={closed}\nTurlar: {cats}",
-        "whereami": "chat_id: <code>{cid}</code>",
-        "export_ready": "Eksport tayyor. CSV yuborilmoqda.",
-        "export_empty": "Eksport uchun ma'lumot yo‘q.",
-        "bitrix_error": "Diqqat: Bitrix24 vaqtincha ishlamayapti. Karta yaratildi, lekin vazifa yangilanmadi.",
-        "categories": "Tahdidlar, Talab (vymogatelstvo), Shantaj, Ishga xalaqit, Qonunga zid harakatlar, Tahqirlash, Korrupsiya, Vakolatdan suiiste'mol, Boshqa",
-        "lang_ru": "RU",
-        "lang_uz": "UZ",
-        "lang_en": "EN",
-        # Post-submit
-        "after_submit_prompt": "Yana bir murojaat yuborasizmi?",
-        "btn_new_request": "🆕 Yangi murojaat",
-    },
-
-    "EN": {
-        "lang_prompt": "Choose language / Выберите язык / Tilni tanlang",
-        "consent_text": (
-            "<b>Consent</b>\n\n🔒 Tap “✅ I agree” to allow us to use your name and phone to contact you about this case. Rest assured: every submission will be reviewed and kept strictly confidential."
-        ),
-        "consent_agree": "✅ I agree",
-        "ask_name": "👤 How should we address you? Enter your <b>first and last name</b> (e.g., John Smith).",
-        "ask_phone": "📞 Type your phone number. Example: +998 90 123‑45‑67. It just needs at least 7 digits.",
-        "invalid_name": "⚠️ Name and surname: 2–120 characters. Example: John Smith.",
-        "invalid_phone": "⚠️ That doesn’t look like a phone number. Need at least 7 digits. Examples: +998901234567, 90 123‑45‑67. Try again.",
-        "choose_category": "📂 Choose the <b>category</b>:",
-        "ask_text": "📝 Describe the case. Minimum 15 characters. Keep it factual, no third‑party personal data.",
-        "text_too_short": "Too short. Need at least 15 characters.",
-        "attachments_hint": "📎 Send attachments (photo/video/document/voice), up to 10. Press “Done” when finished.",
-        "btn_done": "Done",
-        "btn_skip": "Skip",
-        "too_many_attachments": "Limit exceeded: maximum 10 attachments.",
-        "review_title": "🔍 <b>Final review</b>",
-        "review_fields": "🌐 Language: {lang}\n👤 Name: {name}\n📞 Phone: {phone}\n📂 Category: {cat}\n📝 Text: {text_sample}\n📎 Attachments: {n}",
-        "btn_edit": "✏️ Edit",
-        "btn_send": "📨 Submit",
-        "edit_what": "What do you want to edit?",
-        "edit_name": "Name",
-        "edit_phone": "Phone",
-        "edit_category": "Category",
-        "edit_text": "Text",
-        "edit_attachments": "Attachments",
-        "review_back": "Back to: {what}. Continue.",
-        "submitted": "✅ Done. Your ID is <b>{eid}</b>.",
-        "card_status_new": "new",
-        "card_status_work": "in progress",
-        "card_status_closed": "closed",
-        "admin_no_access": "No access",
-        "stats_header": "<b>Stats for last {n} cards</b>",
-        "stats_line": "Statuses: new={new}, in progress={work}, closed={closed}\nCategories: {cats}",
-        "whereami": "chat_id: <code>{cid}</code>",
-        "export_ready": "Export ready. Sending CSV.",
-        "export_empty": "Nothing to export.",
-        "bitrix_error": "Warning: Bitrix24 is unavailable. Card created, but task update failed.",
-        "categories": "Threats, Extortion, Blackmail, Work obstruction, Illegal actions, Insult/abuse, Corruption, Abuse of power, Other",
-        "lang_ru": "RU",
-        "lang_uz": "UZ",
-        "lang_en": "EN",
-        # Post-submit
-        "after_submit_prompt": "Do you want to send another request?",
-        "btn_new_request": "🆕 New request",
-    }
-}
-
-CATEGORIES_BY_LANG = {
-    "RU": [s.strip() for s in TEXTS["RU"]["categories"].split(",")],
-    "UZ": [s.strip() for s in TEXTS["UZ"]["categories"].split(",")],
-    "EN": [s.strip() for s in TEXTS["EN"]["categories"].split(",")],
-}
+"""
+Тексты бота и категории обращений.
+
+Тексты лежат в JSON-файле (LOCALES_PATH, по умолчанию app/locales.json):
+{"RU": {"ключ": "текст", ..., "categories": ["...", ...]}, "UZ": {...}, ...}
+
+Файл проверяется и компилируется в неизменяемый Catalog. Фоновый watcher
+раз в LOCALES_POLL_INTERVAL секунд сравнивает mtime/размер файла и при
+изменении атомарно подменяет каталог — без перезапуска бота. Файл с ошибкой
+не применяется: в лог пишется причина, работает прежний каталог.
+
+У каждого каталога есть номер версии. Форма запоминает версию, с которой
+начата (catalog_version в FSM), а несколько предыдущих версий хранятся в
+памяти: кнопки и категории со старой клавиатуры продолжают распознаваться,
+даже если тексты успели поменяться, пока сотрудник заполнял форму.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import string
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .config import LOCALES_PATH, LOCALES_POLL_INTERVAL
+
+log = logging.getLogger(__name__)
+
+STATUS_CODES = ("new", "work", "closed")
+DEFAULT_LANG = "RU"
+KEEP_VERSIONS = 5
+
+
+class LocaleError(ValueError):
+    """Файл локализации не прошёл проверку."""
+
+
+class Catalog:
+    """
+    Скомпилированный каталог текстов: неизменяемые словари, обратный индекс
+    «текст кнопки -> (язык, ключ)» и множества категорий по языкам.
+    Строится один раз; каждое сравнение ввода с кнопками — один поиск в словаре.
+    """
+
+    def __init__(self, texts: Dict[str, Dict[str, Any]], version: int = 1, default_lang: str = DEFAULT_LANG):
+        self.version = version
+        self.default_lang = default_lang
+        self.texts: Mapping[str, Mapping[str, str]] = MappingProxyType({
+            lang: MappingProxyType({k: v for k, v in entries.items() if k != "categories"})
+            for lang, entries in texts.items()
+        })
+        self.languages: Tuple[str, ...] = tuple(texts)
+        self._language_set = frozenset(texts)
+        self.categories: Mapping[str, Tuple[str, ...]] = MappingProxyType({
+            lang: tuple(entries.get("categories", ())) for lang, entries in texts.items()
+        })
+        self._category_sets = {lang: frozenset(cats) for lang, cats in self.categories.items()}
+
+        reverse: Dict[str, Set[Tuple[str, str]]] = {}
+        for lang, entries in self.texts.items():
+            for key, text in entries.items():
+                reverse.setdefault(text, set()).add((lang, key))
+        self._reverse: Mapping[str, FrozenSet[Tuple[str, str]]] = MappingProxyType(
+            {text: frozenset(pairs) for text, pairs in reverse.items()}
+        )
+
+        self._status_by_text = MappingProxyType({
+            entries[f"card_status_{code}"]: code
+            for entries in self.texts.values()
+            for code in STATUS_CODES
+            if f"card_status_{code}" in entries
+        })
+
+    def t(self, key: str, lang: str) -> str:
+        d = self.texts.get(lang) or self.texts[self.default_lang]
+        return d.get(key, key)
+
+    def lookup(self, text: str) -> FrozenSet[Tuple[str, str]]:
+        """Все (язык, ключ), которым соответствует текст."""
+        return self._reverse.get(text, frozenset())
+
+    def match(self, text: str, keys: AbstractSet[str], lang: Optional[str] = None) -> Optional[str]:
+        """Ключ из keys, текст которого равен text (на языке lang или на любом)."""
+        for text_lang, key in self._reverse.get(text, ()):
+            if key in keys and (lang is None or text_lang == lang):
+                return key
+        return None
+
+    def texts_of(self, key: str) -> FrozenSet[str]:
+        """Текст ключа на всех языках."""
+        return frozenset(entries[key] for entries in self.texts.values() if key in entries)
+
+    def is_language(self, code: str) -> bool:
+        return code in self._language_set
+
+    def is_category(self, text: str, lang: str) -> bool:
+        return text in self._category_sets.get(lang, ())
+
+    def status_code(self, status: str) -> str:
+        return self._status_by_text.get(status, status)
+
+
+# -------------------- Загрузка и проверка --------------------
+
+
+def _placeholders(text: str) -> FrozenSet[str]:
+    try:
+        return frozenset(name for _, name, _, _ in string.Formatter().parse(text) if name)
+    except ValueError as e:
+        raise LocaleError(f"ошибка в шаблоне {text!r}: {e}") from None
+
+
+def validate(texts: Any, required_keys: AbstractSet[str] = frozenset()) -> None:
+    """
+    Проверить содержимое файла локализации:
+      - есть язык по умолчанию, у всех языков одинаковый набор ключей;
+      - не пропал ни один ключ, который был в работающем каталоге;
+      - плейсхолдеры {…} одинаковы во всех языках;
+      - категории — непустой список уникальных строк;
+      - статусы карточки различимы (один текст — один статус).
+    """
+    if not isinstance(texts, dict) or DEFAULT_LANG not in texts:
+        raise LocaleError(f"нужен объект с языками, включая {DEFAULT_LANG}")
+    base = texts[DEFAULT_LANG]
+    if not isinstance(base, dict):
+        raise LocaleError(f"{DEFAULT_LANG}: ожидается объект ключ -> текст")
+
+    missing = set(required_keys) - set(base)
+    if missing:
+        raise LocaleError(f"{DEFAULT_LANG}: пропали ключи {', '.join(sorted(missing))}")
+
+    status_owner: Dict[str, str] = {}
+    for lang, entries in texts.items():
+        if not isinstance(entries, dict):
+            raise LocaleError(f"{lang}: ожидается объект ключ -> текст")
+        diff = set(base) ^ set(entries)
+        if diff:
+            raise LocaleError(f"{lang}: ключи не совпадают с {DEFAULT_LANG}: {', '.join(sorted(diff))}")
+
+        for key, value in entries.items():
+            if key == "categories":
+                if (
+                    not isinstance(value, list)
+                    or not value
+                    or not all(isinstance(c, str) and c.strip() for c in value)
+                ):
+                    raise LocaleError(f"{lang}.categories: нужен непустой список строк")
+                if len(set(value)) != len(value):
+                    raise LocaleError(f"{lang}.categories: категории повторяются")
+                continue
+            if not isinstance(value, str):
+                raise LocaleError(f"{lang}.{key}: ожидается строка")
+            if _placeholders(value) != _placeholders(base[key]):
+                raise LocaleError(f"{lang}.{key}: плейсхолдеры не совпадают с {DEFAULT_LANG}")
+
+        for code in STATUS_CODES:
+            text = entries.get(f"card_status_{code}")
+            if text is None:
+                continue
+            if status_owner.setdefault(text, code) != code:
+                raise LocaleError(f"{lang}: текст статуса {text!r} используется для двух статусов")
+
+
+def load_texts(path: str, required_keys: AbstractSet[str] = frozenset()) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            texts = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise LocaleError(f"{path}: {e}") from e
+    validate(texts, required_keys)
+    return texts
+
+
+# -------------------- Текущий каталог и версии --------------------
+
+
+catalog = Catalog(load_texts(LOCALES_PATH))
+_versions: "OrderedDict[int, Catalog]" = OrderedDict({catalog.version: catalog})
+_listeners: List[Callable[[Catalog], None]] = []
+_stamp: Optional[Tuple[int, int]] = None
+_watcher: Optional[asyncio.Task] = None
+
+
+def get_catalog(version: Optional[int] = None) -> Catalog:
+    """Каталог нужной версии, если он ещё хранится; иначе текущий."""
+    if version is None:
+        return catalog
+    return _versions.get(version, catalog)
+
+
+def catalogs() -> Tuple[Catalog, ...]:
+    """Хранимые версии каталога, от новой к старой."""
+    return tuple(reversed(_versions.values()))
+
+
+def on_reload(callback: Callable[[Catalog], None]) -> None:
+    """Вызвать callback(новый_каталог) после каждой успешной подмены."""
+    _listeners.append(callback)
+
+
+def install(texts: Dict[str, Dict[str, Any]]) -> Catalog:
+    """Проверить тексты и сделать их текущим каталогом."""
+    global catalog
+    validate(texts, required_keys=set(catalog.texts[DEFAULT_LANG]) | {"categories"})
+    new = Catalog(texts, version=catalog.version + 1)
+    _versions[new.version] = new
+    while len(_versions) > KEEP_VERSIONS:
+        _versions.popitem(last=False)
+    catalog = new
+    for callback in _listeners:
+        callback(new)
+    return new
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def reload_if_changed(path: str = LOCALES_PATH) -> bool:
+    """Перечитать файл, если он изменился. True — каталог подменён."""
+    global _stamp
+    stamp = _file_stamp(path)
+    if stamp is None or stamp == _stamp:
+        return False
+    # Запоминаем сразу: файл с ошибкой не перечитываем, пока его не поправят
+    _stamp = stamp
+    try:
+        with open(path, encoding="utf-8") as f:
+            texts = json.load(f)
+        new = install(texts)
+    except (OSError, ValueError) as e:
+        log.error("Локализация %s не применена: %s", path, e)
+        return False
+    log.info("Локализация перезагружена: версия %d", new.version)
+    return True
+
+
+async def watch_locales(path: str = LOCALES_PATH, interval: float = LOCALES_POLL_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            reload_if_changed(path)
+        except Exception:
+            log.exception("watch_locales")
+
+
+async def start_locales_watcher() -> None:
+    global _watcher, _stamp
+    if LOCALES_POLL_INTERVAL <= 0:
+        return
+    if _stamp is None:
+        _stamp = _file_stamp(LOCALES_PATH)
+    if _watcher is None or _watcher.done():
+        _watcher = asyncio.create_task(watch_locales())
+
+
+async def stop_locales_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
+
+
+# -------------------- Доступ к текстам --------------------
+
+
+def status_code(status: str) -> str:
+    """Код статуса (new/work/closed) по его тексту; незнакомый текст возвращается как есть."""
+    for c in catalogs():
+        code = c.status_code(status)
+        if code != status:
+            return code
+    return status
+
+
+def match_button(text: str, keys: AbstractSet[str], lang: Optional[str] = None) -> Optional[str]:
+    """Как Catalog.match, но с учётом предыдущих версий (кнопки со старой клавиатуры)."""
+    for c in catalogs():
+        key = c.match(text, keys, lang)
+        if key is not None:
+            return key
+    return None
+
+
+def is_category(text: str, lang: str, version: Optional[int] = None) -> bool:
+    """Категория текущего каталога или той версии, с которой начата форма."""
+    return catalog.is_category(text, lang) or get_catalog(version).is_category(text, lang)
 
 
 def t(key: str, lang: str) -> str:
-    d = TEXTS.get(lang, TEXTS["RU"])
-    return d.get(key, key)
+    return catalog.t(key, lang)
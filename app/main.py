@@ -1,17 +1,113 @@
+import argparse
 import asyncio
 import logging
+import sys
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from app.bot_core import bot, dp
 from app import handlers_user, handlers_admin
+from app.bitrix_api import close_bitrix_session
+from app.outbox import start_outbox_worker, stop_outbox_worker
+from app.localization import start_locales_watcher, stop_locales_watcher
+from app.metrics import start_metrics_server, stop_metrics_server
+from app.tracing import start_tracing, stop_tracing
+from app.health import (
+    set_mode,
+    start_health_monitor,
+    start_health_server,
+    stop_health_monitor,
+    stop_health_server,
+)
+from app.middlewares import ConcurrencyLimitMiddleware
+from app.cluster import run_cluster
+from app.config import (
+    BOT_MODE,
+    CLUSTER_WORKERS,
+    DROP_PENDING_UPDATES,
+    HANDLER_CONCURRENCY,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+)
+
+
+async def run_polling():
+    # Вебхук и long polling несовместимы — снимаем вебхук, накопившиеся апдейты сохраняем
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    await dp.start_polling(bot, tasks_concurrency_limit=HANDLER_CONCURRENCY or None)
+
+
+async def on_webhook_startup():
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        drop_pending_updates=DROP_PENDING_UPDATES,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+
+async def run_webhook():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        print("ERROR: webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET", file=sys.stderr)
+        sys.exit(1)
+
+    if HANDLER_CONCURRENCY:
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(HANDLER_CONCURRENCY))
+    dp.startup.register(on_webhook_startup)
+    dp.shutdown.register(bot.session.close)
+
+    app = web.Application()
+    # Заголовок X-Telegram-Bot-Api-Secret-Token проверяется внутри обработчика
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logging.info("Webhook: слушаю %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
+    parser = argparse.ArgumentParser(description="Internal support bot")
+    parser.add_argument("--mode", choices=("polling", "webhook", "cluster"), default=BOT_MODE)
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS,
+                        help="число процессов-воркеров для --mode cluster")
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
-    # На всякий случай — убираем вебхук и старые апдейты
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    if args.mode == "cluster":
+        # Супервизор только раздаёт апдейты; outbox и обработчики живут в воркерах
+        await run_cluster(args.workers)
+        return
+
+    dp.startup.register(start_outbox_worker)
+    dp.startup.register(start_locales_watcher)
+    dp.startup.register(start_tracing)
+    dp.startup.register(start_health_monitor)
+    dp.startup.register(start_metrics_server)
+    dp.startup.register(start_health_server)
+    dp.shutdown.register(stop_outbox_worker)
+    dp.shutdown.register(stop_locales_watcher)
+    dp.shutdown.register(stop_tracing)
+    dp.shutdown.register(stop_health_monitor)
+    dp.shutdown.register(stop_metrics_server)
+    dp.shutdown.register(stop_health_server)
+    dp.shutdown.register(close_bitrix_session)
+
+    set_mode(args.mode)
+    if args.mode == "webhook":
+        await run_webhook()
+    else:
+        await run_polling()
 
 
 if __name__ == "__main__":
     asyncio.run(main())
-
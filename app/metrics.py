@@ -0,0 +1,320 @@
+"""
+Метрики бота в формате Prometheus.
+
+Небольшой реестр без внешних зависимостей: счётчики, гистограммы и
+gauge-и с метками. Значения обновляются прямо в горячем пути (несколько
+операций со словарём), а текст для Prometheus собирается только при
+запросе GET /metrics на METRICS_HOST:METRICS_PORT.
+
+Что собирается:
+  bot_handler_seconds / bot_handler_errors_total — время и ошибки по хендлерам;
+  bot_fsm_updates_total          — апдейты по состоянию формы на входе;
+  telegram_request_seconds / telegram_requests_total — вызовы Bot API
+                                   (каждая попытка, с результатом);
+  bitrix_request_seconds / bitrix_requests_total — вызовы Bitrix24 с кодом
+                                   ошибки (QUERY_LIMIT_EXCEEDED, HTTP 503, network...);
+  outbox_jobs_total              — выполненные и отложенные задания outbox;
+  bot_ticket_attachments         — число вложений в отправленных заявках;
+  *_queue_depth, outbox_pending  — очереди, считаются в момент запроса;
+  event_loop_*, thread_pool_*    — задержка цикла событий и загрузка пула потоков.
+
+В режиме cluster каждый воркер отдаёт свои метрики на METRICS_PORT + номер воркера.
+Тот же служебный сервер отдаёт /healthz и /readyz (см. health.py).
+"""
+
+import bisect
+import logging
+from abc import ABC, abstractmethod
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from .config import METRICS_HOST, METRICS_PORT
+
+log = logging.getLogger(__name__)
+
+# Секунды: от быстрых хендлеров до ожидания портала с повторами
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ATTACHMENT_BUCKETS = (0, 1, 2, 3, 5, 10)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (без +Inf), сумма, количество]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, (counts, total, n) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            inf = _labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {n}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+# Вызываются перед каждой выдачей /metrics — обновляют gauge-и очередей
+_collectors: List[Callable[[], None]] = []
+
+
+def on_collect(callback: Callable[[], None]) -> None:
+    _collectors.append(callback)
+
+
+def render() -> str:
+    for callback in _collectors:
+        try:
+            callback()
+        except Exception:
+            log.exception("metrics collector")
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------- Метрики --------------------
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler", "error"))
+FSM_UPDATES = Counter("bot_fsm_updates_total", "Апдейты по состоянию формы на входе", ("state",))
+
+TELEGRAM_SECONDS = Histogram("telegram_request_seconds", "Время вызова Bot API (одна попытка)", ("method",))
+TELEGRAM_REQUESTS = Counter("telegram_requests_total", "Вызовы Bot API по результату", ("method", "result"))
+
+BITRIX_SECONDS = Histogram("bitrix_request_seconds", "Время вызова Bitrix24 (одна попытка)", ("method",))
+BITRIX_REQUESTS = Counter("bitrix_requests_total", "Вызовы Bitrix24 по результату", ("method", "result"))
+
+OUTBOX_JOBS = Counter("outbox_jobs_total", "Задания outbox: выполнено / отложено до повтора", ("kind", "result"))
+TICKET_ATTACHMENTS = Histogram("bot_ticket_attachments", "Вложений в отправленной заявке",
+                               buckets=ATTACHMENT_BUCKETS)
+
+QUEUE_DEPTH = Gauge("telegram_queue_depth", "Ожидают отправки в Telegram, по приоритету", ("priority",))
+BITRIX_QUEUE_DEPTH = Gauge("bitrix_queue_depth", "Ожидают слота лимитера Bitrix24")
+BITRIX_CONCURRENCY = Gauge("bitrix_concurrency_limit", "Текущий предел параллельных вызовов Bitrix24")
+OUTBOX_PENDING = Gauge("outbox_pending", "Невыполненные задания outbox")
+
+# Заполняются монитором цикла событий (health.py)
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Опоздание таймера цикла событий", buckets=LAG_BUCKETS)
+LOOP_STALLS = Counter("event_loop_stalls_total", "Зависания цикла событий дольше LOOP_STALL_THRESHOLD")
+THREAD_POOL_WAIT = Histogram("thread_pool_wait_seconds", "Ожидание свободного потока в пуле по умолчанию",
+                             buckets=LAG_BUCKETS)
+THREAD_POOL_QUEUE = Gauge("thread_pool_queue_depth", "Задачи, ждущие поток в пуле по умолчанию")
+THREAD_POOL_THREADS = Gauge("thread_pool_threads", "Потоки пула по умолчанию: запущено / предел", ("kind",))
+
+
+# -------------------- Сбор в хендлерах и сессии --------------------
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware роутера: время хендлера и состояние формы на входе.
+    Ставится на router.message и router.callback_query.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        FSM_UPDATES.inc(data.get("raw_state") or "none")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Request-middleware сессии: время и результат каждой попытки вызова Bot API."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            result = "retry_after"
+            raise
+        except TelegramServerError:
+            result = "server_error"
+            raise
+        except TelegramNetworkError:
+            result = "network"
+            raise
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, name)
+            TELEGRAM_REQUESTS.inc(name, result)
+
+
+# -------------------- HTTP-сервер --------------------
+
+_runner: Optional[web.AppRunner] = None
+# Дополнительные GET-маршруты служебного сервера (например, /healthz из health.py)
+_routes: Dict[str, Callable[[web.Request], Awaitable[web.StreamResponse]]] = {}
+
+
+def add_route(path: str, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) -> None:
+    _routes[path] = handler
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+def build_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    for path, handler in _routes.items():
+        app.router.add_get(path, handler)
+    return app
+
+
+async def serve(app: web.Application, host: str, port: int, what: str) -> Optional[web.AppRunner]:
+    """Запустить служебный HTTP-сервер; None, если порт занят (бот при этом работает дальше)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        log.error("%s: не удалось занять %s:%s: %s", what, host, port, e)
+        await runner.cleanup()
+        return None
+    return runner
+
+
+async def start_metrics_server(port_offset: int = 0) -> None:
+    """Поднять служебный сервер (METRICS_PORT=0 — выключено). port_offset — номер воркера в режиме cluster."""
+    global _runner
+    if not METRICS_PORT or _runner is not None:
+        return
+    port = METRICS_PORT + port_offset
+    _runner = await serve(build_app(), METRICS_HOST, port, "Метрики")
+    if _runner is not None:
+        log.info("Метрики: http://%s:%s/metrics", METRICS_HOST, port)
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
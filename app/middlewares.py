@@ -0,0 +1,92 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import Message, TelegramObject
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Не больше limit апдейтов обрабатываются одновременно (остальные ждут своей очереди)."""
+
+    def __init__(self, limit: int):
+        self._sem = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self._sem:
+            return await handler(event, data)
+
+
+class ChatEventIsolation(BaseEventIsolation):
+    """
+    Апдейты одного чата обрабатываются строго по очереди, разных чатов — параллельно.
+    Блокировка берётся до чтения состояния FSM, поэтому read-modify-write в
+    хендлерах (get_data → update_data) не теряет данные. Неиспользуемые
+    блокировки удаляются, словарь не растёт с числом пользователей.
+    """
+
+    def __init__(self) -> None:
+        # key -> [lock, сколько апдейтов держат или ждут lock]
+        self._locks: Dict[Hashable, List[Any]] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            # После close() под ключом может не быть записи или быть уже новая
+            if entry[1] == 0 and self._locks.get(key) is entry:
+                del self._locks[key]
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """
+    Склеивает альбом (сообщения с одним media_group_id) в один апдейт.
+    Первое сообщение альбома ждёт latency секунд, собирает остальные и
+    уходит в хендлер с data["album"]; остальные сообщения дальше не идут.
+    Должен стоять до FSM-middleware, иначе сообщения альбома встанут в
+    очередь за блокировкой чата и не успеют собраться.
+    """
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+        self._groups: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = getattr(event, "message", None)
+        if message is None or not message.media_group_id:
+            return await handler(event, data)
+
+        key = (message.chat.id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(message)
+            return None
+
+        self._groups[key] = group = [message]
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            del self._groups[key]
+        data["album"] = sorted(group, key=lambda m: m.message_id)
+        return await handler(event, data)
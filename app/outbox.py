@@ -0,0 +1,451 @@
+"""
+Outbox для записей в Bitrix24.
+
+Обработчики не ходят в Bitrix напрямую: они кладут задание в локальную
+SQLite-таблицу и сразу отвечают пользователю. Фоновый воркер разбирает
+очередь, повторяет неудачные вызовы с экспоненциальной задержкой и после
+создания сущности сообщает об этом ожидающему обработчику (wait_created),
+а если карточка уже опубликована — дописывает в неё ID.
+
+Отправки в Telegram, которые не должны задерживать ни хендлер, ни воркер
+(публикация карточки, правка карточки), запускаются через spawn: задача
+хранится до завершения, ошибки пишутся в лог, при остановке ждём их до
+SHUTDOWN_GRACE секунд.
+
+Виды заданий:
+  create — создать задачу / элемент CRM (одно на external_id);
+  work, close — комментарий (и закрытие) по уже созданной сущности.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from typing import Any, Coroutine, Dict, Optional, Set
+
+from .bot_core import bot, tickets
+from .config import (
+    SUPPORT_CHAT_ID,
+    BITRIX_SMART_ENTITY_ID,
+    OUTBOX_BASE_DELAY,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_ALERT_ATTEMPTS,
+)
+from .db import connect, is_locked, retry_locked
+from .helpers import card_text, entity_line, render_card
+from .keyboards import kb_admin_card
+from .localization import t
+from .metrics import OUTBOX_JOBS, OUTBOX_PENDING, on_collect
+from .tracing import resume, span
+from .bitrix_api import (
+    bitrix_task_add,
+    bitrix_task_find,
+    bitrix_task_comment,
+    bitrix_task_comment_and_complete,
+    bitrix_crm_item_add_with_comment,
+    bitrix_crm_item_find,
+    bitrix_crm_timeline_comment,
+)
+
+log = logging.getLogger(__name__)
+
+# Сколько заданий берём за один проход и на сколько «арендуем» их
+BATCH_SIZE = 50
+LEASE_SECONDS = 120
+POLL_INTERVAL = 5.0
+WAIT_POLL_INTERVAL = 0.25
+# Запас на расхождение часов бота и портала при поиске уже созданной сущности
+LOOKUP_CLOCK_SKEW = 300
+# Сколько при остановке ждать фоновые отправки в Telegram
+SHUTDOWN_GRACE = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    external_id     TEXT    NOT NULL,
+    kind            TEXT    NOT NULL,
+    payload         TEXT    NOT NULL,
+    status          TEXT    NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL    NOT NULL,
+    locked_until    REAL    NOT NULL DEFAULT 0,
+    result          TEXT,
+    last_error      TEXT,
+    created_at      REAL    NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS outbox_create_uq ON outbox(external_id) WHERE kind = 'create';
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(status, id);
+CREATE INDEX IF NOT EXISTS outbox_pending_heads ON outbox(status, external_id, id);
+"""
+
+# Первое незавершённое задание каждой заявки
+_HEADS = "SELECT MIN(id) FROM outbox WHERE status = 'pending' GROUP BY external_id"
+
+_db: Optional[sqlite3.Connection] = None
+_wakeup: Optional[asyncio.Event] = None
+_worker: Optional[asyncio.Task] = None
+# Кто ждёт создания сущности в этом процессе (см. wait_created)
+_created: Dict[str, asyncio.Event] = {}
+# Фоновые отправки в Telegram (см. spawn)
+_background: Set[asyncio.Task] = set()
+
+
+def _conn() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = connect()
+        _db.executescript(_SCHEMA)
+    return _db
+
+
+# -------------------- Постановка в очередь --------------------
+
+
+def enqueue(
+    external_id: str,
+    kind: str,
+    payload: Dict[str, Any],
+    db: Optional[sqlite3.Connection] = None,
+) -> bool:
+    """
+    Сохранить задание на диск. Повторный create для того же external_id не
+    добавляется (False) — это значит, что внешний ID выдан второй раз.
+    db — соединение с открытой транзакцией (tickets.transaction()): задание
+    запишется вместе с ней, а будить воркер (kick) вызывающий должен сам,
+    после фиксации.
+    """
+    now = time.time()
+    own = db is None
+    cur = (_conn() if own else db).execute(
+        "INSERT OR IGNORE INTO outbox (external_id, kind, payload, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (external_id, kind, json.dumps(payload, ensure_ascii=False), now, now),
+    )
+    if cur.rowcount == 0:
+        log.error("outbox %s/%s: задание уже есть, новое не добавлено (повтор внешнего ID?)", external_id, kind)
+        return False
+    if own:
+        kick()
+    return True
+
+
+def create_ticket(ticket: Dict[str, Any], payload: Dict[str, Any]) -> bool:
+    """
+    Сохранить заявку и задание create для неё одной транзакцией: после сбоя
+    не остаётся заявки без задания (сущность в Bitrix так и не создалась бы)
+    и задания без заявки. False — external_id уже занят, не записано ничего.
+    """
+    _conn()  # схема outbox — до транзакции, executescript в ней не выполнить
+    with tickets.transaction() as db:
+        if not enqueue(ticket["id"], "create", payload, db=db):
+            return False
+        tickets.add(ticket)
+    kick()
+    return True
+
+
+def kick() -> None:
+    """Разбудить воркер, не дожидаясь очередного опроса."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def created_entity(external_id: str) -> Optional[Dict[str, Any]]:
+    """Результат create-задания: {"task_id": ..., "crm_item_id": ...} или None, если ещё не создано."""
+    row = _conn().execute(
+        "SELECT result FROM outbox WHERE external_id = ? AND kind = 'create' AND status = 'done'",
+        (external_id,),
+    ).fetchone()
+    return json.loads(row["result"]) if row and row["result"] else None
+
+
+async def wait_created(external_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """
+    Дождаться создания сущности, но не дольше timeout секунд.
+    Своя задача будит ожидание сразу; задание, выполненное другим процессом,
+    замечаем по базе раз в WAIT_POLL_INTERVAL.
+    """
+    deadline = time.monotonic() + timeout
+    event = _created.setdefault(external_id, asyncio.Event())
+    try:
+        while True:
+            result = created_entity(external_id)
+            remaining = deadline - time.monotonic()
+            if result is not None or remaining <= 0:
+                return result
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(remaining, WAIT_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _created.pop(external_id, None)
+
+
+# -------------------- Фоновые отправки --------------------
+
+
+def spawn(coro: Coroutine[Any, Any, Any]) -> None:
+    """Запустить отправку в фоне: вызывающий не ждёт Telegram и его лимитов."""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background_done)
+
+
+def _background_done(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Фоновая отправка не удалась", exc_info=task.exception())
+
+
+async def wait_background(timeout: Optional[float] = None) -> None:
+    """Дождаться фоновых отправок; не успевшие за timeout отменяются."""
+    if not _background:
+        return
+    _, pending = await asyncio.wait(list(_background), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+# -------------------- Выполнение заданий --------------------
+
+
+async def _run_create(external_id: str, payload: Dict[str, Any], attempts: int,
+                      created_at: float) -> Dict[str, Any]:
+    crm = payload["mode"] == "CRM"
+    entity_type_id = int(BITRIX_SMART_ENTITY_ID) if crm else 0
+
+    # Повтор: возможно, прошлая попытка создала сущность, но ответ до нас не дошёл.
+    # Ищем только созданные после постановки задания: сущность с тем же внешним ID
+    # от другой заявки (например, до сброса базы) не подходит.
+    found: Optional[int] = 0
+    if attempts > 0:
+        since = created_at - LOOKUP_CLOCK_SKEW
+        with span("bitrix.find"):
+            if crm:
+                found = await bitrix_crm_item_find(entity_type_id, external_id, created_after=since)
+            else:
+                found = await bitrix_task_find(external_id, created_after=since)
+        if found is None:
+            raise RuntimeError("lookup failed")
+
+    if crm:
+        item_id = found
+        if not item_id:
+            with span("bitrix.crm_item_add_with_comment"):
+                item_id = await bitrix_crm_item_add_with_comment(
+                    entity_type_id, payload["crm_fields"], payload["description"]
+                )
+        if not item_id:
+            raise RuntimeError("crm.item.add failed")
+        return {"task_id": None, "crm_item_id": item_id}
+
+    task_id = found
+    if not task_id:
+        with span("bitrix.task_add"):
+            task_id = await bitrix_task_add(
+                payload["title"], payload["description"], payload["responsible_id"]
+            )
+    if not task_id:
+        raise RuntimeError("tasks.task.add failed")
+    return {"task_id": task_id, "crm_item_id": None}
+
+
+async def _run_status(external_id: str, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    entity = created_entity(external_id) or payload
+    task_id = entity.get("task_id")
+    crm_item_id = entity.get("crm_item_id")
+
+    if not task_id and not crm_item_id:
+        # create для этой заявки всегда выполняется раньше (см. _claim_due);
+        # сюда попадаем только для карточек старше outbox — писать некуда
+        return {"skipped": True}
+
+    comment = payload["comment"]
+    if crm_item_id:
+        ok = await bitrix_crm_timeline_comment(int(BITRIX_SMART_ENTITY_ID), int(crm_item_id), comment)
+    elif kind == "close":
+        ok = await bitrix_task_comment_and_complete(int(task_id), comment)
+    else:
+        ok = await bitrix_task_comment(int(task_id), comment)
+    if not ok:
+        raise RuntimeError(f"{kind} comment failed")
+    return {}
+
+
+async def patch_card(external_id: str, card: Dict[str, Any]) -> None:
+    """
+    Дописать в уже опубликованную карточку ID сущности Bitrix24.
+    Если карточка ещё не отправлена, ничего не делаем — её опубликуют сразу с ID.
+    """
+    info = tickets.get(external_id)
+    if not info or not info.get("channel_message_id"):
+        return
+    extra_line = entity_line(info["task_id"], info["crm_item_id"])
+    if not extra_line:
+        return
+
+    if info.get("text") is not None:
+        text = render_card(info)
+    else:
+        # Заявка из базы до появления колонки text — берём поля из задания
+        text = card_text(card["lang"], external_id, card["name"], card["phone"],
+                         card["category"], card["text"], info.get("status") or card["status"]) + extra_line
+    try:
+        await bot.edit_message_text(
+            chat_id=SUPPORT_CHAT_ID,
+            message_id=info["channel_message_id"],
+            text=text,
+            reply_markup=kb_admin_card(external_id, info["language"]),
+        )
+    except Exception:
+        pass
+
+
+async def _patch_card_traced(trace: Optional[Dict[str, str]], external_id: str, card: Dict[str, Any]) -> None:
+    with resume(trace, "outbox.patch_card", external_id=external_id):
+        await patch_card(external_id, card)
+
+
+async def _process(row: sqlite3.Row) -> None:
+    external_id, kind = row["external_id"], row["kind"]
+    payload = json.loads(row["payload"])
+    attempts = row["attempts"]
+    db = _conn()
+    # Задание из трассируемой заявки продолжает её трассу (см. tracing.py)
+    trace = payload.get("trace")
+
+    try:
+        with resume(trace, "outbox." + kind, external_id=external_id, attempt=attempts + 1):
+            if kind == "create":
+                result = await _run_create(external_id, payload, attempts, row["created_at"])
+            else:
+                result = await _run_status(external_id, kind, payload)
+    except Exception as e:
+        attempts += 1
+        delay = min(OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY * 2 ** (attempts - 1))
+        delay *= random.uniform(0.9, 1.1)
+        await retry_locked(
+            db.execute,
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, locked_until = 0, last_error = ? "
+            "WHERE id = ?",
+            (attempts, time.time() + delay, repr(e), row["id"]),
+        )
+        OUTBOX_JOBS.inc(kind, "retry")
+        log.warning("outbox %s/%s: попытка %d не удалась: %r", external_id, kind, attempts, e)
+        if attempts == OUTBOX_ALERT_ATTEMPTS:
+            lang = payload.get("card", {}).get("lang", "RU")
+            try:
+                await bot.send_message(SUPPORT_CHAT_ID, f"{external_id}: {t('bitrix_error', lang)}")
+            except Exception:
+                pass
+        return
+
+    await retry_locked(
+        db.execute,
+        "UPDATE outbox SET status = 'done', attempts = ?, result = ?, locked_until = 0 WHERE id = ?",
+        (attempts + 1, json.dumps(result), row["id"]),
+    )
+    OUTBOX_JOBS.inc(kind, "done")
+    if kind == "create":
+        await retry_locked(tickets.update, external_id,
+                           task_id=result["task_id"], crm_item_id=result["crm_item_id"])
+        event = _created.get(external_id)
+        if event is not None:
+            event.set()
+        # Правка карточки — самый низкий приоритет очереди Telegram: воркер её не ждёт
+        spawn(_patch_card_traced(trace, external_id, payload["card"]))
+
+
+def _claim_due() -> list:
+    """
+    Забрать готовые к выполнению задания.
+    Для одного external_id берём только самое раннее незавершённое — порядок
+    create → work → close сохраняется. «Аренда» через locked_until позволяет
+    нескольким процессам разбирать одну таблицу.
+    """
+    db = _conn()
+    now = time.time()
+    # Фильтр по сроку — в SQL: задания в backoff не занимают место в выборке
+    rows = db.execute(
+        "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? AND locked_until <= ? "
+        f"AND id IN ({_HEADS}) ORDER BY id LIMIT ?",
+        (now, now, BATCH_SIZE),
+    ).fetchall()
+
+    claimed = []
+    for row in rows:
+        try:
+            cur = db.execute(
+                "UPDATE outbox SET locked_until = ? WHERE id = ? AND status = 'pending' AND locked_until <= ?",
+                (now + LEASE_SECONDS, row["id"], now),
+            )
+        except sqlite3.OperationalError as e:
+            # Базу держит другой процесс: берём, что успели, остальное — в следующий проход
+            if claimed and is_locked(e):
+                break
+            raise
+        if cur.rowcount == 1:
+            claimed.append(row)
+    return claimed
+
+
+def _next_due_in() -> float:
+    # Только первые задания заявок: следующие ждут их и сроком не считаются
+    row = _conn().execute(
+        f"SELECT MIN(MAX(next_attempt_at, locked_until)) AS due FROM outbox WHERE id IN ({_HEADS})"
+    ).fetchone()
+    if row is None or row["due"] is None:
+        return POLL_INTERVAL
+    return max(0.0, min(POLL_INTERVAL, row["due"] - time.time()))
+
+
+def _collect_pending() -> None:
+    row = _conn().execute("SELECT COUNT(*) AS n FROM outbox WHERE status = 'pending'").fetchone()
+    OUTBOX_PENDING.set(row["n"])
+
+
+on_collect(_collect_pending)
+
+
+async def outbox_worker() -> None:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        _wakeup.clear()
+        try:
+            rows = await retry_locked(_claim_due)
+            if rows:
+                # Параллельно: вызовы разных заявок склеятся в общий batch
+                await asyncio.gather(*(_process(r) for r in rows))
+                continue
+            timeout = _next_due_in()
+        except Exception:
+            log.exception("outbox worker")
+            timeout = POLL_INTERVAL
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start_outbox_worker() -> None:
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(outbox_worker())
+
+
+async def stop_outbox_worker() -> None:
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
+    # Карточки и правки, начатые до остановки, даём дослать
+    await wait_background(SHUTDOWN_GRACE)
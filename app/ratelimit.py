@@ -0,0 +1,237 @@
+"""
+Ограничение исходящих вызовов: token bucket по частоте и AIMD по параллельности.
+
+TokenBucket держит среднюю частоту (rate запросов/сек) с допустимым всплеском burst.
+PriorityTokenBucket — то же, но очередь ожидающих упорядочена по приоритету.
+AdaptiveLimiter ограничивает число одновременных запросов: при успехах
+предел медленно растёт (+1 за «окно» из limit успешных ответов), при
+перегрузке портала — уменьшается вдвое (не чаще раза в cooldown секунд).
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Дождаться токена. Возвращает время ожидания в секундах. Порядок — FIFO."""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    self._refill()
+                self._tokens -= 1
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - started
+
+    def drain(self) -> None:
+        """Портал сказал «слишком часто» — обнуляем накопленный всплеск."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+
+class PriorityTokenBucket:
+    """
+    Token bucket, где ожидающие обслуживаются по приоритету (0 — самый высокий),
+    внутри одного приоритета — по очереди. cost — сколько токенов берёт запрос.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._seq = itertools.count()
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def waiting_by_priority(self) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for prio, _, _, fut in self._waiters:
+            if not fut.done():
+                counts[prio] = counts.get(prio, 0) + 1
+        return counts
+
+    @property
+    def idle(self) -> bool:
+        """Бакет полон и никто не ждёт — его можно выбросить без потери состояния."""
+        self._refill()
+        return not self._waiters and self._tokens >= self.burst
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        # Токены сверх burst бывают только после credit() — их не срезаем
+        self._tokens = max(self._tokens, min(self.burst, self._tokens + (now - self._updated) * self.rate))
+        self._updated = now
+
+    def credit(self, tokens: float = 1) -> None:
+        """Выдать tokens сверх обычного пополнения (но не больше burst + tokens в запасе)."""
+        self._refill()
+        self._tokens = min(self._tokens + tokens, self.burst + tokens)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+
+    async def acquire(self, priority: int = 0, cost: float = 1) -> None:
+        cost = min(cost, self.burst)
+        self._refill()
+        if not self._waiters and self._tokens >= cost:
+            self._tokens -= cost
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), cost, fut))
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._tokens += cost
+            raise
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, cost, fut = self._waiters[0]
+            if fut.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < cost:
+                break
+            heapq.heappop(self._waiters)
+            self._tokens -= cost
+            fut.set_result(None)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        cost = self._waiters[0][2]
+        delay = max(0.0, (cost - self._tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def drain(self, pause: float = 0.0) -> None:
+        """Обнулить всплеск и (если задано) запретить выдачу токенов ещё pause секунд."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - pause * self.rate
+
+
+class AdaptiveLimiter:
+    def __init__(self, min_limit: int, max_limit: int, cooldown: float = 1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(self.max_limit)
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже выдан — возвращаем его
+                self.in_flight -= 1
+                self._wake()
+            elif fut in self._waiters:
+                # _wake() мог уже вынуть отменённый future из очереди
+                self._waiters.remove(fut)
+            raise
+
+    def release(self, overloaded: bool = False) -> None:
+        self.in_flight -= 1
+        if overloaded:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(float(self.min_limit), self.limit / 2)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+
+class OutboundLimiter:
+    """Token bucket + AIMD перед каждым вызовом, плюс счётчики для мониторинга."""
+
+    def __init__(self, rate: float, burst: int, min_concurrency: int, max_concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveLimiter(min_concurrency, max_concurrency)
+        self.calls = 0
+        self.overloads = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_last = 0.0
+
+    async def acquire(self) -> None:
+        started = time.monotonic()
+        await self.concurrency.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.concurrency.release()
+            raise
+        waited = time.monotonic() - started
+        self.calls += 1
+        self.wait_total += waited
+        self.wait_last = waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def release(self, overloaded: bool = False) -> None:
+        if overloaded:
+            self.overloads += 1
+            self.bucket.drain()
+        self.concurrency.release(overloaded)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.concurrency.waiting + self.bucket.waiting,
+            "in_flight": self.concurrency.in_flight,
+            "concurrency_limit": int(self.concurrency.limit),
+            "calls": self.calls,
+            "overloads": self.overloads,
+            "wait_avg": self.wait_total / self.calls if self.calls else 0.0,
+            "wait_max": self.wait_max,
+            "wait_last": self.wait_last,
+        }
@@ -0,0 +1,166 @@
+"""
+Общая очередь исходящих запросов к Telegram.
+
+Все вызовы bot.* с chat_id проходят через SendScheduler (request-middleware
+сессии aiogram):
+  - бакет на каждый чат: личные чаты — TELEGRAM_CHAT_RATE сообщений/сек,
+    группы и каналы — TELEGRAM_GROUP_RATE сообщений/мин;
+  - входящее сообщение или нажатие кнопки в личном чате (ReplyCredit) даёт
+    чату токен сверх лимита: ответ на действие пользователя не ждёт, лимит
+    чата сдерживает только то, что бот шлёт сверх этого;
+  - общий бакет TELEGRAM_GLOBAL_RATE сообщений/сек на бота;
+  - приоритеты: ответы сотрудникам, затем карточки в канал, затем правки
+    карточек — при всплеске ответы не стоят в очереди за каналом;
+  - TelegramRetryAfter: чат «замораживается» на retry_after, запрос
+    повторяется без ограничения числа попыток, так что карточки не теряются.
+
+Лимиты считаются в пределах процесса. В режиме cluster общий бакет и лимит
+групп делятся поровну между воркерами (share): служебный канал пишут все.
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, Union
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, SendMediaGroup, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+
+from .ratelimit import PriorityTokenBucket
+
+log = logging.getLogger(__name__)
+
+# Классы приоритета (меньше — раньше)
+PRIORITY_REPLY = 0
+PRIORITY_CARD = 1
+PRIORITY_EDIT = 2
+PRIORITY_NAMES = {PRIORITY_REPLY: "reply", PRIORITY_CARD: "card", PRIORITY_EDIT: "edit"}
+
+CHAT_BURST = 3
+GROUP_BURST = 10  # один полный альбом
+PRUNE_EVERY = 1000  # раз в сколько запросов выбрасывать простаивающие бакеты
+
+# Только эти вызовы создают сообщения и попадают под flood control
+_SCHEDULED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, support_chat_id: int, global_rate: float, chat_rate: float, group_rate: float):
+        self.support_chat_id = support_chat_id
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate / 60
+        self.global_bucket = PriorityTokenBucket(global_rate, max(1.0, global_rate))
+        self._chats: Dict[Union[int, str], PriorityTokenBucket] = {}
+        self._since_prune = 0
+        self.sent = 0
+        self.retry_after = 0
+
+    def share(self, workers: int) -> None:
+        """
+        Режим cluster: лимиты на бота и на группы — общие для всех процессов,
+        поэтому каждый воркер получает 1/workers от них. Личный чат всегда
+        обслуживает один воркер, его лимит не делится.
+        """
+        workers = max(1, workers)
+        self.group_rate /= workers
+        rate = self.global_bucket.rate / workers
+        self.global_bucket = PriorityTokenBucket(rate, max(1.0, rate))
+        self._chats.clear()
+
+    def _priority(self, method: TelegramMethod[Any], chat_id: Union[int, str]) -> int:
+        if chat_id != self.support_chat_id:
+            return PRIORITY_REPLY
+        if type(method).__name__.startswith("Edit"):
+            return PRIORITY_EDIT
+        return PRIORITY_CARD
+
+    def _bucket(self, chat_id: Union[int, str]) -> PriorityTokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username — группы и каналы
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = PriorityTokenBucket(self.group_rate, GROUP_BURST)
+            else:
+                bucket = PriorityTokenBucket(self.chat_rate, CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def incoming(self, chat_id: int) -> None:
+        """Пользователь написал боту: один ответ в этот чат не расходует лимит чата."""
+        if chat_id > 0:
+            self._bucket(chat_id).credit()
+
+    def _prune(self) -> None:
+        self._since_prune += 1
+        if self._since_prune < PRUNE_EVERY:
+            return
+        self._since_prune = 0
+        for chat_id in [c for c, b in self._chats.items() if b.idle]:
+            del self._chats[chat_id]
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if (
+            chat_id is None
+            or isinstance(method, SendChatAction)
+            or not type(method).__name__.startswith(_SCHEDULED_PREFIXES)
+        ):
+            return await make_request(bot, method)
+
+        priority = self._priority(method, chat_id)
+        cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        self._prune()
+        bucket = self._bucket(chat_id)
+        while True:
+            await bucket.acquire(priority, cost)
+            await self.global_bucket.acquire(priority, cost)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                log.warning("Flood control в чате %s: пауза %s сек", chat_id, e.retry_after)
+                bucket.drain(pause=e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for bucket in (self.global_bucket, *self._chats.values()):
+            for prio, n in bucket.waiting_by_priority().items():
+                depth[PRIORITY_NAMES[prio]] += n
+        return {
+            "queue_depth": depth,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+        }
+
+
+class ReplyCredit(BaseMiddleware):
+    """
+    Outer-middleware апдейтов: сообщает планировщику о входящем событии в
+    личном чате. Ставится после склейки альбомов — альбом считается одним
+    сообщением.
+    """
+
+    def __init__(self, scheduler: SendScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is not None and chat.type == "private":
+            self.scheduler.incoming(chat.id)
+        return await handler(event, data)
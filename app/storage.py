@@ -0,0 +1,338 @@
+"""
+Хранилище заявок.
+
+Обработчики работают через TicketRepository, не трогая глобальные
+структуры. Реализация по умолчанию — SQLite (тот же файл, что и outbox),
+поэтому после рестарта кнопки на старых карточках продолжают работать.
+
+Для /stats рядом ведутся счётчики по статусу, категории, языку и дню:
+они обновляются в той же транзакции, что и сама заявка, так что статистика
+не требует прохода по истории.
+
+Запись заявки — dict с ключами:
+  id, date, language, name, phone, category, status, text_len,
+  attachments_count, task_id, crm_item_id, channel_message_id,
+  text, status_code
+Текст обращения и код статуса (new/work/closed) хранятся, чтобы карточку
+можно было перерисовать по шаблону, не разбирая текст сообщения. Код статуса
+хранилище вычисляет само из status.
+"""
+
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .db import connect
+from .localization import status_code
+
+
+TICKET_FIELDS = (
+    "id",
+    "date",
+    "language",
+    "name",
+    "phone",
+    "category",
+    "status",
+    "text_len",
+    "attachments_count",
+    "task_id",
+    "crm_item_id",
+    "channel_message_id",
+    "text",
+    "status_code",
+)
+
+
+class TicketRepository(ABC):
+    @abstractmethod
+    def add(self, ticket: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, external_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def transaction(self) -> ContextManager[Any]:
+        """
+        Общая транзакция: записи хранилища внутри неё (и записи через отданное
+        соединение) фиксируются вместе или не фиксируются вовсе.
+        """
+        ...
+
+    @abstractmethod
+    def update(self, external_id: str, **fields: Any) -> None:
+        ...
+
+    @abstractmethod
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """Последние limit заявок, от старых к новым."""
+        ...
+
+    @abstractmethod
+    def iter_tickets(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        statuses: Optional[Sequence[str]] = None,
+        category: Optional[str] = None,
+        limit: int = 0,
+        page_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Заявки от старых к новым, с фильтрами по дате (включительно), кодам
+        статуса и категории. limit > 0 — только последние limit подходящих.
+        Читает страницами по page_size, так что память не зависит от объёма.
+        """
+        ...
+
+    @abstractmethod
+    def counters(self) -> Dict[str, Dict[str, int]]:
+        """
+        Число заявок в разрезах: {"status": {"new": 3, ...}, "category": {...},
+        "language": {...}, "day": {"2025-01-31": ...}}. Статус — код (new/work/closed).
+        """
+        ...
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id                 TEXT PRIMARY KEY,
+    date               TEXT NOT NULL,
+    language           TEXT NOT NULL,
+    name               TEXT NOT NULL,
+    phone              TEXT NOT NULL,
+    category           TEXT NOT NULL,
+    status             TEXT NOT NULL,
+    text_len           INTEGER NOT NULL,
+    attachments_count  INTEGER NOT NULL,
+    task_id            INTEGER,
+    crm_item_id        INTEGER,
+    channel_message_id INTEGER,
+    text               TEXT,
+    status_code        TEXT
+);
+CREATE INDEX IF NOT EXISTS tickets_status ON tickets(status);
+CREATE INDEX IF NOT EXISTS tickets_category ON tickets(category);
+CREATE INDEX IF NOT EXISTS tickets_date ON tickets(date);
+CREATE TABLE IF NOT EXISTS ticket_counters (
+    dimension TEXT    NOT NULL,
+    value     TEXT    NOT NULL,
+    count     INTEGER NOT NULL,
+    PRIMARY KEY (dimension, value)
+);
+"""
+
+# Колонки, добавленные после первой версии таблицы
+_ADDED_COLUMNS = {"text": "TEXT", "status_code": "TEXT"}
+
+COUNTER_DIMENSIONS = ("status", "category", "language", "day")
+
+_UPDATABLE = {"status", "task_id", "crm_item_id", "channel_message_id"}
+
+
+class SqliteTicketRepository(TicketRepository):
+    def __init__(self, path: str):
+        self._path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = connect(self._path)
+            self._db.executescript(_SCHEMA)
+            self._migrate()
+            self._backfill_counters()
+        return self._db
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def transaction(self) -> ContextManager[sqlite3.Connection]:
+        """Отдаёт соединение хранилища: outbox пишет задание в ту же транзакцию."""
+        return self._transaction()
+
+    def _migrate(self) -> None:
+        """Старые базы: добавить новые колонки и заполнить status_code по тексту статуса."""
+        db = self._db
+        with _Transaction(db):
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(tickets)")}
+            for name, decl in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    db.execute(f"ALTER TABLE tickets ADD COLUMN {name} {decl}")
+            for row in db.execute(
+                "SELECT DISTINCT status FROM tickets WHERE status_code IS NULL"
+            ).fetchall():
+                db.execute(
+                    "UPDATE tickets SET status_code = ? WHERE status = ? AND status_code IS NULL",
+                    (status_code(row["status"]), row["status"]),
+                )
+        db.execute("CREATE INDEX IF NOT EXISTS tickets_status_code ON tickets(status_code)")
+
+    @staticmethod
+    def _dims(code: str, category: str, language: str, date: str) -> List[Tuple[str, str]]:
+        return [
+            ("status", code),
+            ("category", category),
+            ("language", language),
+            ("day", date[:10]),
+        ]
+
+    def _bump(self, dims: List[Tuple[str, str]], delta: int) -> None:
+        self._db.executemany(
+            "INSERT INTO ticket_counters (dimension, value, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count",
+            [(dim, value, delta) for dim, value in dims],
+        )
+
+    def _backfill_counters(self) -> None:
+        """Счётчики появились позже заявок — один раз пересчитываем их по таблице."""
+        db = self._db
+        with _Transaction(db):
+            if db.execute("SELECT 1 FROM ticket_counters LIMIT 1").fetchone():
+                return
+            for row in db.execute("SELECT status_code, category, language, date FROM tickets"):
+                self._bump(self._dims(row["status_code"], row["category"], row["language"], row["date"]), 1)
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        rec = dict(row)
+        rec["date"] = datetime.fromisoformat(rec["date"])
+        return rec
+
+    def add(self, ticket: Dict[str, Any]) -> None:
+        values = {k: ticket.get(k) for k in TICKET_FIELDS}
+        if isinstance(values["date"], datetime):
+            values["date"] = values["date"].isoformat()
+        values["status_code"] = status_code(values["status"])
+        with self._transaction() as db:
+            old = db.execute(
+                "SELECT status_code, category, language, date FROM tickets WHERE id = ?", (values["id"],)
+            ).fetchone()
+            if old:
+                self._bump(self._dims(old["status_code"], old["category"], old["language"], old["date"]), -1)
+            db.execute(
+                f"INSERT OR REPLACE INTO tickets ({', '.join(TICKET_FIELDS)}) "
+                f"VALUES ({', '.join(':' + k for k in TICKET_FIELDS)})",
+                values,
+            )
+            self._bump(self._dims(values["status_code"], values["category"], values["language"], values["date"]), 1)
+
+    def get(self, external_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM tickets WHERE id = ?", (external_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def update(self, external_id: str, **fields: Any) -> None:
+        unknown = set(fields) - _UPDATABLE
+        if unknown:
+            raise ValueError(f"нельзя обновить поля: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+        if "status" in fields:
+            fields["status_code"] = status_code(fields["status"])
+        assignments = ", ".join(f"{k} = :{k}" for k in fields)
+        if "status" not in fields:
+            self._conn().execute(
+                f"UPDATE tickets SET {assignments} WHERE id = :id",
+                {**fields, "id": external_id},
+            )
+            return
+
+        # Смена статуса переносит заявку между счётчиками
+        with self._transaction() as db:
+            old = db.execute("SELECT status_code FROM tickets WHERE id = ?", (external_id,)).fetchone()
+            if old is None:
+                return
+            db.execute(
+                f"UPDATE tickets SET {assignments} WHERE id = :id",
+                {**fields, "id": external_id},
+            )
+            if old["status_code"] != fields["status_code"]:
+                self._bump([("status", old["status_code"])], -1)
+                self._bump([("status", fields["status_code"])], 1)
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM tickets ORDER BY rowid DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._row(r) for r in reversed(rows)]
+
+    def iter_tickets(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        statuses: Optional[Sequence[str]] = None,
+        category: Optional[str] = None,
+        limit: int = 0,
+        page_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        where: List[str] = []
+        params: List[Any] = []
+        if date_from:
+            where.append("date >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append("date < ?")
+            params.append((date_to + timedelta(days=1)).isoformat())
+        if statuses:
+            where.append(f"status_code IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if category:
+            where.append("category = ?")
+            params.append(category)
+        cond = " AND ".join(where) or "1"
+        db = self._conn()
+
+        # Keyset-пагинация по rowid: каждая страница — короткий запрос, курсор между страницами не держим
+        after = 0
+        if limit:
+            row = db.execute(
+                f"SELECT rowid FROM tickets WHERE {cond} ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (*params, limit - 1),
+            ).fetchone()
+            if row is not None:
+                after = row["rowid"] - 1
+
+        while True:
+            rows = db.execute(
+                f"SELECT rowid AS _rowid, * FROM tickets WHERE rowid > ? AND {cond} ORDER BY rowid LIMIT ?",
+                (after, *params, page_size),
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                rec = self._row(row)
+                del rec["_rowid"]
+                yield rec
+            after = rows[-1]["_rowid"]
+
+    def counters(self) -> Dict[str, Dict[str, int]]:
+        result: Dict[str, Dict[str, int]] = {dim: {} for dim in COUNTER_DIMENSIONS}
+        rows = self._conn().execute(
+            "SELECT dimension, value, count FROM ticket_counters WHERE count > 0"
+        )
+        for row in rows:
+            result.setdefault(row["dimension"], {})[row["value"]] = row["count"]
+        return result
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE … COMMIT, при исключении — ROLLBACK. Внутри уже открытой
+    транзакции ничего не делает: запись становится частью внешней.
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+        self._outer = False
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._outer = not self._db.in_transaction
+        if self._outer:
+            self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._outer:
+            self._db.execute("ROLLBACK" if exc_type else "COMMIT")
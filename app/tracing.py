@@ -0,0 +1,263 @@
+"""
+Трассировка отправки заявки.
+
+review_send — длинная цепочка: запись заявки, ответы сотруднику, ожидание
+Bitrix24, карточка в канал, вложения. Трасса разбивает её на спаны, чтобы
+было видно, какой шаг занял время. Создание сущности и правка карточки
+выполняются в outbox — их спаны попадают в ту же трассу: контекст трассы
+сохраняется в задании (см. context / resume).
+
+Каждый спан помечен тегами трассы (external_id заявки). Готовые спаны
+копятся в памяти и раз в FLUSH_INTERVAL уходят:
+  TRACE_FILE          — в JSONL-файл, по спану на строку;
+  TRACE_OTLP_ENDPOINT — в OTLP/HTTP-коллектор (JSON), например
+                        http://127.0.0.1:4318/v1/traces.
+
+TRACE_SAMPLE_RATE — доля трассируемых заявок (0 — выключено). Для заявок вне
+выборки span() возвращает общий пустой объект, так что накладные расходы —
+одно чтение contextvar.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import aiohttp
+
+from .config import TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SAMPLE_RATE, TRACE_SERVICE_NAME
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+MAX_BUFFER = 10000
+OTLP_TIMEOUT = 5
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+_finished: Deque["Span"] = deque(maxlen=MAX_BUFFER)
+_enabled = False
+_flusher: Optional[asyncio.Task] = None
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "tags", "attrs", "start_ns", "end_ns",
+                 "error", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str],
+                 tags: Dict[str, Any], attrs: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        # Теги общие для всей трассы: external_id может появиться уже после начала спана
+        self.tags = tags
+        self.attrs = attrs
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = repr(exc)
+        _current.reset(self._token)
+        _finished.append(self)
+
+    def record(self) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attrs": {**self.tags, **self.attrs},
+        }
+        if self.error:
+            rec["error"] = self.error
+        return rec
+
+
+class _NoopSpan:
+    """Спан вне выборки: ничего не записывает."""
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """Дочерний спан текущей трассы (или пустой, если трассы нет)."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(name, parent.trace_id, parent.span_id, parent.tags, attrs)
+
+
+def tag(**tags: Any) -> None:
+    """Добавить теги ко всем спанам текущей трассы."""
+    current = _current.get()
+    if current is not None:
+        current.tags.update(tags)
+
+
+def context() -> Optional[Dict[str, str]]:
+    """Контекст текущего спана для передачи в другую задачу (None — трассы нет)."""
+    current = _current.get()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
+
+
+def resume(ctx: Optional[Dict[str, str]], name: str, **attrs: Any):
+    """
+    Продолжить трассу из сохранённого context() — например, в воркере outbox.
+    attrs становятся тегами: их получат и вложенные спаны.
+    """
+    if not ctx or not _enabled:
+        return _NOOP
+    return Span(name, ctx["trace_id"], ctx["span_id"], attrs, {})
+
+
+def traced(name: str) -> Callable:
+    """
+    Декоратор корневого спана обработчика с выборкой по TRACE_SAMPLE_RATE.
+    Сигнатура сохраняется (functools.wraps), так что aiogram передаёт те же аргументы.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled or random.random() >= TRACE_SAMPLE_RATE:
+                return await func(*args, **kwargs)
+            with Span(name, f"{random.getrandbits(128):032x}", None, {}, {}):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# -------------------- Экспорт --------------------
+
+
+def _write_jsonl(records: List[Dict[str, Any]]) -> None:
+    data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    # Пачка пишется одним блоком в конец файла — воркеры cluster могут писать в один файл
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        f.write(data)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    out = []
+    for s in spans:
+        item: Dict[str, Any] = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in {**s.tags, **s.attrs}.items()],
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        if s.error:
+            item["status"] = {"code": 2, "message": s.error}  # STATUS_CODE_ERROR
+        out.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": out}],
+        }]
+    }
+
+
+async def _export(session: Optional[aiohttp.ClientSession]) -> None:
+    spans = list(_finished)
+    _finished.clear()
+    if not spans:
+        return
+    if TRACE_FILE:
+        try:
+            await asyncio.to_thread(_write_jsonl, [s.record() for s in spans])
+        except OSError as e:
+            log.warning("Трассировка: не записать %s: %s", TRACE_FILE, e)
+    if session is not None:
+        try:
+            async with session.post(TRACE_OTLP_ENDPOINT, json=_otlp_payload(spans)) as resp:
+                if resp.status >= 400:
+                    log.warning("Трассировка: коллектор ответил HTTP %s", resp.status)
+        except Exception as e:
+            log.warning("Трассировка: коллектор недоступен: %r", e)
+
+
+async def _flush_loop() -> None:
+    session = None
+    if TRACE_OTLP_ENDPOINT:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=OTLP_TIMEOUT))
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await _export(session)
+    finally:
+        # Остановка: дописываем то, что успело накопиться
+        await _export(session)
+        if session is not None:
+            await session.close()
+
+
+async def start_tracing() -> None:
+    global _enabled, _flusher
+    if TRACE_SAMPLE_RATE <= 0:
+        return
+    if not TRACE_FILE and not TRACE_OTLP_ENDPOINT:
+        log.warning("Трассировка: TRACE_SAMPLE_RATE задан, но нет TRACE_FILE или TRACE_OTLP_ENDPOINT")
+        return
+    _enabled = True
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop_tracing() -> None:
+    global _enabled, _flusher
+    _enabled = False
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
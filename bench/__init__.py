@@ -0,0 +1,8 @@
+"""
+Замеры производительности бота.
+
+  python -m bench.load  — нагрузочный тест всего пути заявки на локальных
+                          заглушках Bot API и Bitrix24 (см. load.py);
+  python -m bench.micro — стоимость CPU и памяти на апдейт по обработчикам
+                          и горячим функциям, с базовой линией (см. micro.py).
+"""
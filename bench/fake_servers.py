@@ -0,0 +1,263 @@
+"""
+Заглушки Telegram Bot API и Bitrix24 REST для нагрузочных тестов.
+
+Обе заглушки — aiohttp-приложения, которые отвечают правдоподобными
+ответами и умеют портить жизнь боту:
+  latency / jitter — задержка ответа (сек), равномерно в latency ± jitter;
+  error_rate       — доля ответов 500;
+  Telegram: flood_rate — доля ответов 429 (retry_after = flood_retry_after);
+  Bitrix:   limit_rate — доля ответов QUERY_LIMIT_EXCEEDED (HTTP 503).
+
+Каждая заглушка считает вызовы по методам и отданные ошибки. Служебные
+методы Telegram (getMe, getUpdates, setWebhook, deleteWebhook) идут без
+задержки и ошибок.
+
+Входящие апдейты отдаются боту через getUpdates (режимы polling и
+cluster); для режима webhook их отправляет сам драйвер.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+_CONTROL_METHODS = {"getme", "getupdates", "setwebhook", "deletewebhook", "close", "logout"}
+
+MAX_UPDATES = 100
+
+
+async def start_site(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Запустить приложение; порт 0 — свободный порт (см. bound_port)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def bound_port(runner: web.AppRunner) -> int:
+    return runner.addresses[0][1]
+
+
+class _Faults:
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: Optional[int]):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    async def delay(self) -> None:
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def roll(self, rate: float) -> bool:
+        return rate > 0 and self.rng.random() < rate
+
+
+# -------------------- Telegram Bot API --------------------
+
+
+class FakeTelegram(_Faults):
+    """
+    POST /bot<token>/<method>. on_message(chat_id, method, params) вызывается
+    на каждое созданное или изменённое сообщение (send*, copyMessage, editMessage*).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        flood_rate: float = 0.0,
+        flood_retry_after: int = 1,
+        seed: Optional[int] = None,
+        on_message: Optional[Callable[[int, str, Dict[str, Any]], None]] = None,
+    ):
+        super().__init__(latency, jitter, error_rate, seed)
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.on_message = on_message
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self.polled = asyncio.Event()
+        self.webhook_set = asyncio.Event()
+        self._updates: List[Dict[str, Any]] = []
+        self._updates_ready = asyncio.Event()
+        self._message_ids: Counter = Counter()
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+
+    # --- входящие апдейты для getUpdates ---
+
+    def push_update(self, update: Dict[str, Any]) -> None:
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:MAX_UPDATES]
+
+    # --- обработчик ---
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    def _message(self, chat_id: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        if "message_id" in params:  # правка существующего сообщения
+            message_id = int(params["message_id"])
+        else:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        name = method.lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if name == "getupdates":
+            return _ok(await self._get_updates(params))
+        if name in ("setwebhook", "deletewebhook"):
+            if name == "setwebhook":
+                self.webhook_set.set()
+            return _ok(True)
+        if name == "getme":
+            return _ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if name in _CONTROL_METHODS:
+            return _ok(True)
+
+        await self.delay()
+        if self.roll(self.flood_rate):
+            self.injected["429"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.flood_retry_after}",
+                "parameters": {"retry_after": self.flood_retry_after},
+            }, status=429)
+        if self.roll(self.error_rate):
+            self.injected["500"] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+            )
+
+        if "chat_id" not in params:
+            return _ok(True)
+        chat_id = int(params["chat_id"])
+        if self.on_message and name.startswith(("send", "edit", "copy", "forward")):
+            self.on_message(chat_id, method, params)
+
+        if name == "sendmediagroup":
+            media = params.get("media") or "[]"
+            count = len(json.loads(media) if isinstance(media, str) else media)
+            return _ok([self._message(chat_id, {}) for _ in range(count)])
+        if name == "copymessage":
+            return _ok({"message_id": self._message(chat_id, {})["message_id"]})
+        if name.startswith(("send", "edit", "forward")):
+            return _ok(self._message(chat_id, params))
+        return _ok(True)
+
+
+def _ok(result: Any) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
+
+
+# -------------------- Bitrix24 REST --------------------
+
+
+class FakeBitrix(_Faults):
+    """
+    POST <любой путь>/<method>. Создаёт задачи и элементы смарт-процесса
+    с растущими ID, понимает batch (команды считаются как batch:<метод>).
+    on_create(method, params) вызывается на каждое созданное tasks.task.add / crm.item.add.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        limit_rate: float = 0.0,
+        seed: Optional[int] = None,
+        on_create: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ):
+        super().__init__(latency, jitter, error_rate, seed)
+        self.limit_rate = limit_rate
+        self.on_create = on_create
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self._next_id = 0
+
+        self.app = web.Application()
+        self.app.router.add_post("/{path:.*}", self._handle)
+
+    def _execute(self, method: str, params: Dict[str, Any]) -> Any:
+        if method in ("tasks.task.add", "crm.item.add"):
+            self._next_id += 1
+            if self.on_create:
+                self.on_create(method, params)
+            if method == "tasks.task.add":
+                return {"task": {"id": str(self._next_id)}}
+            return {"item": {"id": self._next_id}}
+        if method == "tasks.task.list":
+            return {"tasks": []}
+        if method == "crm.item.list":
+            return {"items": []}
+        return True
+
+    def _batch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        for key, command in params.items():
+            if not (key.startswith("cmd[") and key.endswith("]")):
+                continue
+            method, _, query = command.partition("?")
+            self.calls["batch:" + method] += 1
+            # Ссылки $result[...] не разворачиваем: заглушке они не нужны
+            results[key[4:-1]] = self._execute(method, dict(parse_qsl(query, keep_blank_values=True)))
+        return {"result": results, "result_error": []}
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["path"].rsplit("/", 1)[-1]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        await self.delay()
+        if self.roll(self.limit_rate):
+            self.injected["QUERY_LIMIT_EXCEEDED"] += 1
+            return web.json_response(
+                {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}, status=503
+            )
+        if self.roll(self.error_rate):
+            self.injected["500"] += 1
+            return web.json_response(
+                {"error": "INTERNAL_SERVER_ERROR", "error_description": "Internal server error"}, status=500
+            )
+
+        if method == "batch":
+            return web.json_response({"result": self._batch(params)})
+        return web.json_response({"result": self._execute(method, params)})
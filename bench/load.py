@@ -0,0 +1,422 @@
+"""
+Нагрузочный тест всего пути заявки: от /start до карточки в канале и
+сущности в Bitrix24.
+
+Драйвер поднимает заглушки Bot API и Bitrix24 (fake_servers.py), запускает
+бота отдельным процессом (python -m app.main) с TELEGRAM_API_SERVER и
+BITRIX_WEBHOOK_BASE, указывающими на заглушки, и прогоняет через форму
+--employees сотрудников, по --concurrency одновременно. Каждый сотрудник —
+отдельный личный чат; следующий шаг он делает, только получив ответ бота.
+
+Шаг меряется от отправки апдейта до последнего ответа бота на него.
+Дополнительно:
+  card   — от «Отправить» до карточки в служебном канале;
+  entity — от «Отправить» до создания задачи/элемента в Bitrix24.
+
+Пример:
+  python -m bench.load --employees 2000 --concurrency 200 \\
+      --tg-latency 0.05 --bx-latency 0.3 --bx-limit-rate 0.05 --json baseline.json
+
+По умолчанию у бота действуют рабочие лимиты Telegram (TELEGRAM_*_RATE) и
+Bitrix (BITRIX_RATE), то есть меряется реальная пропускная способность
+конфигурации. --no-limits снимает лимиты, чтобы мерить сам код.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .fake_servers import FakeBitrix, FakeTelegram, bound_port, start_site
+
+ROOT = Path(__file__).resolve().parent.parent
+LOCALES_PATH = ROOT / "app" / "locales.json"
+
+BOT_TOKEN = "123456:bench"
+SUPPORT_CHAT_ID = -1001000000000
+WEBHOOK_SECRET = "bench"
+FIRST_USER_ID = 10_000_000
+
+REQUEST_TEXT = "Нагрузочный тест: подробное описание обращения сотрудника."
+PHONE_RE = re.compile(r"📞 (\+\d+)")
+
+# Лимиты, которые снимает --no-limits
+NO_LIMITS_ENV = {
+    "TELEGRAM_GLOBAL_RATE": "1000000",
+    "TELEGRAM_CHAT_RATE": "1000000",
+    "TELEGRAM_GROUP_RATE": "60000000",
+    "BITRIX_RATE": "1000000",
+    "BITRIX_BURST": "1000000",
+}
+
+EXTRA_STEPS = ("card", "entity")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (values отсортированы)."""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        texts = json.loads(LOCALES_PATH.read_text(encoding="utf-8"))[args.lang]
+        self.texts = texts
+        self.categories: List[str] = texts["categories"]
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failed: Dict[str, int] = defaultdict(int)
+        self.completed = 0
+        self._inbox: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._sent_at: Dict[str, float] = {}  # телефон -> момент «Отправить»
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._update_id = 0
+        self._message_id = 0
+
+        self.telegram = FakeTelegram(
+            latency=args.tg_latency,
+            jitter=args.tg_jitter,
+            error_rate=args.tg_error_rate,
+            flood_rate=args.tg_flood_rate,
+            seed=args.seed,
+            on_message=self._on_message,
+        )
+        self.bitrix = FakeBitrix(
+            latency=args.bx_latency,
+            jitter=args.bx_jitter,
+            error_rate=args.bx_error_rate,
+            limit_rate=args.bx_limit_rate,
+            seed=args.seed,
+            on_create=self._on_create,
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._webhook_url = ""
+
+    # -------------------- События заглушек --------------------
+
+    def _on_message(self, chat_id: int, method: str, params: Dict[str, Any]) -> None:
+        if chat_id == SUPPORT_CHAT_ID:
+            if method == "sendMessage":
+                m = PHONE_RE.search(params.get("text", ""))
+                if m:
+                    self._resolve("card", m.group(1))
+            return
+        if method.startswith("send"):
+            self._inbox[chat_id].put_nowait(params.get("text", ""))
+
+    def _on_create(self, method: str, params: Dict[str, Any]) -> None:
+        title = params.get("fields[TITLE]") or params.get("fields[title]") or ""
+        m = re.search(r"\((\+\d+)\)", title)
+        if m:
+            self._resolve("entity", m.group(1))
+
+    def _resolve(self, step: str, phone: str) -> None:
+        sent_at = self._sent_at.get(phone)
+        if sent_at is None:
+            return
+        self.latencies[step].append(time.monotonic() - sent_at)
+        fut = self._pending.pop((step, phone), None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    # -------------------- Входящие апдейты --------------------
+
+    def _update(self, user_id: int, **message: Any) -> Dict[str, Any]:
+        self._update_id += 1
+        self._message_id += 1
+        payload = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        }
+        payload.update(message)
+        return {"update_id": self._update_id, "message": payload}
+
+    async def _deliver(self, update: Dict[str, Any]) -> None:
+        if self.args.mode != "webhook":
+            self.telegram.push_update(update)
+            return
+        async with self._session.post(
+            self._webhook_url,
+            json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+        ) as resp:
+            resp.raise_for_status()
+
+    # -------------------- Сотрудник --------------------
+
+    def _script(self, index: int, phone: str) -> List[Tuple[str, Optional[str], int]]:
+        """Шаги формы: (имя шага, текст, сколько ответов ждать)."""
+        t = self.texts
+        return [
+            ("start", "/start", 1),
+            ("lang", self.args.lang, 1),
+            ("consent", t["consent_agree"], 1),
+            ("name", f"Сотрудник {index}", 1),
+            ("phone", phone, 1),
+            ("category", self.categories[index % len(self.categories)], 1),
+            ("text", REQUEST_TEXT, 1),
+            ("attachments", None, 0),
+            ("done", t["btn_done"], 1),
+            ("send", t["btn_send"], 2),
+        ]
+
+    async def _employee(self, index: int) -> None:
+        user_id = FIRST_USER_ID + index
+        phone = f"+99890{index:07d}"
+        inbox = self._inbox[user_id]
+        loop = asyncio.get_running_loop()
+        waits = []
+
+        for step, text, replies in self._script(index, phone):
+            if text is None:
+                # Альбом фото: бот на него не отвечает. Как и живой сотрудник,
+                # жмём «Готово», когда альбом загружен (бот склеивает его ALBUM_LATENCY)
+                if self.args.attachments:
+                    group = f"g{user_id}"
+                    for i in range(self.args.attachments):
+                        await self._deliver(self._update(user_id, media_group_id=group, photo=[
+                            {"file_id": f"photo{user_id}_{i}", "file_unique_id": f"u{i}", "width": 1, "height": 1},
+                        ]))
+                    await asyncio.sleep(self.args.album_pause)
+                continue
+
+            if step == "send":
+                self._sent_at[phone] = time.monotonic()
+                for extra in EXTRA_STEPS:
+                    fut = loop.create_future()
+                    self._pending[(extra, phone)] = fut
+                    waits.append((extra, fut))
+
+            started = time.monotonic()
+            await self._deliver(self._update(user_id, text=text))
+            try:
+                for _ in range(replies):
+                    await asyncio.wait_for(inbox.get(), self.args.step_timeout)
+            except asyncio.TimeoutError:
+                self.failed[step] += 1
+                return
+            self.latencies[step].append(time.monotonic() - started)
+
+        self.completed += 1
+        for extra, fut in waits:
+            try:
+                await asyncio.wait_for(fut, self.args.drain_timeout)
+            except asyncio.TimeoutError:
+                self.failed[extra] += 1
+
+    # -------------------- Бот --------------------
+
+    def _bot_env(self, tmp: str, tg_port: int, bx_port: int, webhook_port: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "TELEGRAM_API_SERVER": f"http://127.0.0.1:{tg_port}",
+            "BITRIX_WEBHOOK_BASE": f"http://127.0.0.1:{bx_port}/rest/1/bench/",
+            "BITRIX_MODE": self.args.bitrix_mode,
+            "BITRIX_SMART_ENTITY_ID": "1032" if self.args.bitrix_mode == "CRM" else "",
+            "SUPPORT_CHAT_ID": str(SUPPORT_CHAT_ID),
+            "ADMIN_IDS": "",
+            "DB_PATH": os.path.join(tmp, "bot.sqlite3"),
+            "FSM_STORAGE": self.args.fsm_storage,
+            "LOCALES_POLL_INTERVAL": "0",
+            "BOT_MODE": self.args.mode,
+            "CLUSTER_WORKERS": str(self.args.workers),
+            "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(webhook_port),
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "PYTHONUNBUFFERED": "1",
+        })
+        if self.args.no_limits:
+            env.update(NO_LIMITS_ENV)
+        for item in self.args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        return env
+
+    async def _wait_ready(self, proc: subprocess.Popen) -> None:
+        deadline = time.monotonic() + self.args.startup_timeout
+        ready = self.telegram.webhook_set if self.args.mode == "webhook" else self.telegram.polled
+        while not ready.is_set():
+            if proc.poll() is not None:
+                raise RuntimeError(f"бот завершился при запуске (код {proc.returncode})")
+            if time.monotonic() > deadline:
+                raise RuntimeError("бот не запустился вовремя")
+            await asyncio.sleep(0.1)
+        if self.args.mode != "webhook":
+            return
+        # setWebhook уходит до того, как сервер начал слушать порт
+        while True:
+            try:
+                async with self._session.post(self._webhook_url, json={"update_id": 0}) as resp:
+                    await resp.read()
+                return
+            except aiohttp.ClientConnectionError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("webhook-сервер бота не поднялся") from None
+                await asyncio.sleep(0.1)
+
+    async def _warmup(self) -> None:
+        """По /start от служебных чатов — на каждый воркер, чтобы не мерить их запуск."""
+        users = range(FIRST_USER_ID - 1, FIRST_USER_ID - 1 - max(1, self.args.workers), -1)
+        for user_id in users:
+            await self._deliver(self._update(user_id, text="/start"))
+        for user_id in users:
+            await asyncio.wait_for(self._inbox[user_id].get(), self.args.startup_timeout)
+
+    # -------------------- Прогон --------------------
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        tg_runner = await start_site(self.telegram.app)
+        bx_runner = await start_site(self.bitrix.app)
+        self._session = aiohttp.ClientSession()
+        webhook_port = _free_port()
+        self._webhook_url = f"http://127.0.0.1:{webhook_port}/webhook"
+
+        tmp = tempfile.mkdtemp(prefix="bench-load-")
+        log_path = os.path.join(tmp, "bot.log")
+        env = self._bot_env(tmp, bound_port(tg_runner), bound_port(bx_runner), webhook_port)
+        with open(log_path, "wb") as log_file:
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "app.main", "--mode", args.mode],
+                cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+            )
+        print(f"бот: pid {proc.pid}, лог {log_path}", file=sys.stderr)
+
+        try:
+            await self._wait_ready(proc)
+            await self._warmup()
+            sem = asyncio.Semaphore(args.concurrency)
+
+            async def limited(i: int) -> None:
+                async with sem:
+                    await self._employee(i)
+
+            started = time.monotonic()
+            await asyncio.gather(*(limited(i) for i in range(args.employees)))
+            elapsed = time.monotonic() - started
+        finally:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.to_thread(proc.wait, 30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            await self._session.close()
+            await tg_runner.cleanup()
+            await bx_runner.cleanup()
+
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        steps = {}
+        names = [s for s, text, _ in self._script(0, "") if text is not None] + list(EXTRA_STEPS)
+        for name in names:
+            values = sorted(self.latencies.get(name, []))
+            steps[name] = {
+                "n": len(values),
+                "failed": self.failed.get(name, 0),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else 0.0,
+            }
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k != "json"},
+            "elapsed": elapsed,
+            "completed": self.completed,
+            "throughput": self.completed / elapsed if elapsed else 0.0,
+            "steps": steps,
+            "telegram_calls": dict(self.telegram.calls),
+            "telegram_injected": dict(self.telegram.injected),
+            "bitrix_calls": dict(self.bitrix.calls),
+            "bitrix_injected": dict(self.bitrix.injected),
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    cfg = report["config"]
+    print(f"\nрежим {cfg['mode']}, сотрудников {cfg['employees']}, одновременно {cfg['concurrency']}")
+    print(f"заявок: {report['completed']} за {report['elapsed']:.2f} с — {report['throughput']:.1f} заявок/с\n")
+    print(f"{'шаг':<12}{'n':>7}{'ошибок':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}   (мс)")
+    for name, s in report["steps"].items():
+        print(
+            f"{name:<12}{s['n']:>7}{s['failed']:>8}"
+            f"{s['p50'] * 1000:>9.1f}{s['p95'] * 1000:>9.1f}{s['p99'] * 1000:>9.1f}{s['max'] * 1000:>9.1f}"
+        )
+    for title, key in (("Telegram", "telegram"), ("Bitrix24", "bitrix")):
+        calls = ", ".join(f"{m}={n}" for m, n in sorted(report[f"{key}_calls"].items()))
+        print(f"\n{title}: {calls or '—'}")
+        if report[f"{key}_injected"]:
+            injected = ", ".join(f"{k}={n}" for k, n in sorted(report[f"{key}_injected"].items()))
+            print(f"  подброшено ошибок: {injected}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушках Telegram и Bitrix24")
+    p.add_argument("--employees", type=int, default=500, help="сколько заявок отправить")
+    p.add_argument("--concurrency", type=int, default=100, help="сколько сотрудников заполняют форму одновременно")
+    p.add_argument("--mode", choices=("polling", "webhook", "cluster"), default="polling")
+    p.add_argument("--workers", type=int, default=2, help="воркеров для --mode cluster")
+    p.add_argument("--lang", default="RU")
+    p.add_argument("--attachments", type=int, default=0, help="фото в заявке (одним альбомом)")
+    p.add_argument("--album-pause", type=float, default=0.5,
+                   help="пауза после альбома перед «Готово», сек (больше ALBUM_LATENCY бота)")
+    p.add_argument("--bitrix-mode", choices=("TASKS", "CRM"), default="TASKS")
+    p.add_argument("--fsm-storage", choices=("memory", "sqlite", "redis"), default="sqlite")
+    p.add_argument("--no-limits", action="store_true", help="снять лимиты отправки в Telegram и Bitrix")
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                   help="дополнительная переменная окружения бота (можно несколько)")
+
+    p.add_argument("--tg-latency", type=float, default=0.03, help="задержка Bot API, сек")
+    p.add_argument("--tg-jitter", type=float, default=0.01)
+    p.add_argument("--tg-error-rate", type=float, default=0.0, help="доля ответов 500")
+    p.add_argument("--tg-flood-rate", type=float, default=0.0, help="доля ответов 429")
+    p.add_argument("--bx-latency", type=float, default=0.2, help="задержка Bitrix24, сек")
+    p.add_argument("--bx-jitter", type=float, default=0.05)
+    p.add_argument("--bx-error-rate", type=float, default=0.0, help="доля ответов 500")
+    p.add_argument("--bx-limit-rate", type=float, default=0.0, help="доля ответов QUERY_LIMIT_EXCEEDED")
+    p.add_argument("--seed", type=int, default=None)
+
+    p.add_argument("--step-timeout", type=float, default=30, help="сколько ждать ответа на шаг, сек")
+    p.add_argument("--drain-timeout", type=float, default=120, help="сколько ждать карточку и сущность, сек")
+    p.add_argument("--startup-timeout", type=float, default=30)
+    p.add_argument("--json", help="сохранить отчёт в JSON (для сравнения между версиями)")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    failed = sum(s["failed"] for s in report["steps"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
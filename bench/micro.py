@@ -0,0 +1,450 @@
+"""
+Микробенчмарки: чистая стоимость CPU на апдейт для каждого обработчика
+handlers_user / handlers_admin и для горячих функций (шаблоны карточки,
+проверки ввода, сборка клавиатур).
+
+Апдейты — заранее собранные Update с Message / CallbackQuery. Они идут
+через настоящий dp со всеми middleware, а сессия бота подменена на
+NoopSession: запросы к Bot API не уходят в сеть, ответом служит готовый
+объект. FSM хранится в памяти, заявки и outbox — во временной SQLite.
+Перед каждым вызовом выставляется нужное состояние формы (вне замера).
+
+По каждому случаю считаются:
+  ops/s, мкс      — вызовов в секунду и время одного вызова;
+  пик, Б          — пиковая память одного вызова (tracemalloc);
+  остаётся, Б     — сколько памяти в среднем не освобождается после вызова;
+  блоков          — сколько выделений памяти (блоков) в среднем переживает
+                    вызов: разница снимков tracemalloc по statistics("filename").
+                    Выделения, освобождённые внутри вызова, tracemalloc не
+                    считает — их цену показывает пик.
+
+  python -m bench.micro                 # таблица
+  python -m bench.micro --save          # записать базовую линию (baselines/micro.json)
+  python -m bench.micro --compare       # сравнить с базовой линией, код 1 при регрессии
+  python -m bench.micro -k review_send  # только случаи с подстрокой в имени
+"""
+
+import argparse
+import asyncio
+from abc import ABC, abstractmethod
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Окружение бота — до импорта app
+_TMP = tempfile.mkdtemp(prefix="bench-micro-")
+ADMIN_ID = 1
+USER_ID = 1000
+SUPPORT_CHAT_ID = -1001000000000
+os.environ.update({
+    "BOT_TOKEN": "123456:bench",
+    "ADMIN_IDS": str(ADMIN_ID),
+    "SUPPORT_CHAT_ID": str(SUPPORT_CHAT_ID),
+    "DB_PATH": os.path.join(_TMP, "bot.sqlite3"),
+    "FSM_STORAGE": "memory",
+    "LOCALES_POLL_INTERVAL": "0",
+    "CARD_ID_WAIT": "0",
+    "BITRIX_MODE": "TASKS",
+})
+
+import aiogram  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.dispatcher.event.bases import UNHANDLED  # noqa: E402
+from aiogram.fsm.state import State  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.types import Chat, Message, MessageId, Update  # noqa: E402
+
+from app import handlers_admin, handlers_user, helpers, keyboards, outbox  # noqa: E402,F401
+from app.bot_core import bot, dp, tickets  # noqa: E402
+from app.localization import catalog, t  # noqa: E402
+from app.states import Form  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "micro.json"
+
+NAME = "Иван Петров"
+PHONE = "+998 90 123-45-67"
+TEXT = "Описание обращения для замера: что случилось, где и когда, кто участвовал."
+TICKET_ID = "HR-2025-000001"
+
+
+# -------------------- Сессия без сети --------------------
+
+
+class NoopSession(BaseSession):
+    """Отвечает на любой метод готовым объектом, не сериализуя запрос."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._message = Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=USER_ID, type="private"),
+            text="ok",
+        )
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        if name == "SendMediaGroup":
+            return [self._message] * len(method.media)
+        if name == "CopyMessage":
+            return MessageId(message_id=1)
+        if name.startswith(("Send", "Edit", "Forward")):
+            return self._message
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+# -------------------- Случаи --------------------
+
+
+_update_id = 0
+
+
+def _update(**event: Any) -> Update:
+    global _update_id
+    _update_id += 1
+    return Update.model_validate({"update_id": _update_id, **event}, context={"bot": bot})
+
+
+def message_update(text: Optional[str] = None, user_id: int = USER_ID, **extra: Any) -> Update:
+    payload = {
+        "message_id": _update_id + 1,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        **extra,
+    }
+    if text is not None:
+        payload["text"] = text
+    return _update(message=payload)
+
+
+def callback_update(data: str) -> Update:
+    return _update(callback_query={
+        "id": str(_update_id + 1),
+        "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "admin"},
+        "chat_instance": "bench",
+        "data": data,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": SUPPORT_CHAT_ID, "type": "supergroup"},
+            "text": "card",
+        },
+    })
+
+
+def form_data(**overrides: Any) -> Dict[str, Any]:
+    data = {
+        "lang": "RU",
+        "attachments": [],
+        "category": catalog.categories["RU"][0],
+        "catalog_version": catalog.version,
+        "name": NAME,
+        "phone": PHONE,
+        "text": TEXT,
+    }
+    data.update(overrides)
+    return data
+
+
+class Case(ABC):
+    """Замер одной функции: run() — замеряемый вызов, prepare(i) — подготовка вне замера."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def prepare(self, i: int) -> None:
+        pass
+
+    @abstractmethod
+    async def run(self) -> Any:
+        ...
+
+    async def check(self, result: Any) -> None:
+        pass
+
+
+class HandlerCase(Case):
+    """Апдейт через dp в заданном состоянии формы; check проверяет, что сработал нужный обработчик."""
+
+    def __init__(
+        self,
+        name: str,
+        make_update: Callable[[int], Update],
+        state: Optional[State] = None,
+        data: Optional[Dict[str, Any]] = None,
+        expect_state: Any = ...,
+        user_id: int = USER_ID,
+        chat_id: Optional[int] = None,
+    ):
+        super().__init__(name)
+        self.make_update = make_update
+        self.state = state
+        self.data = data
+        self.expect_state = expect_state
+        self.key = StorageKey(bot_id=bot.id, chat_id=chat_id or user_id, user_id=user_id)
+        self._update: Optional[Update] = None
+
+    async def prepare(self, i: int) -> None:
+        await dp.storage.set_state(self.key, self.state)
+        await dp.storage.set_data(self.key, dict(self.data or {}))
+        self._update = self.make_update(i)
+
+    async def run(self) -> Any:
+        result = await dp.feed_update(bot, self._update)
+        # Карточка review_send уходит фоновой задачей — её стоимость тоже считаем в вызов
+        await outbox.wait_background()
+        return result
+
+    async def check(self, result: Any) -> None:
+        if result is UNHANDLED:
+            raise RuntimeError(f"{self.name}: апдейт не обработан")
+        if self.expect_state is not ...:
+            state = await dp.storage.get_state(self.key)
+            expected = self.expect_state.state if isinstance(self.expect_state, State) else self.expect_state
+            if state != expected:
+                raise RuntimeError(f"{self.name}: состояние {state!r}, ожидалось {expected!r}")
+
+
+class FuncCase(Case):
+    def __init__(self, name: str, fn: Callable[[], Any]):
+        super().__init__(name)
+        self.fn = fn
+
+    async def run(self) -> Any:
+        return self.fn()
+
+
+def build_cases() -> List[Case]:
+    ru = catalog.texts["RU"]
+    category = catalog.categories["RU"][0]
+    photo = [{"file_id": "photo", "file_unique_id": "u", "width": 1, "height": 1}]
+
+    tickets.add({
+        "id": TICKET_ID, "date": datetime.now(), "language": "RU", "name": NAME, "phone": PHONE,
+        "category": category, "status": t("card_status_new", "RU"), "text_len": len(TEXT),
+        "attachments_count": 0, "task_id": 1, "crm_item_id": None, "channel_message_id": 1, "text": TEXT,
+    })
+    ticket = tickets.get(TICKET_ID)
+    attachments = [{"type": "photo", "file_id": f"photo{i}"} for i in range(3)]
+
+    cases: List[Case] = [
+        HandlerCase("user.cmd_start", lambda i: message_update("/start"), None, None, Form.Lang),
+        HandlerCase("user.set_lang", lambda i: message_update("RU"), Form.Lang, None, Form.Consent),
+        HandlerCase("user.consent_step", lambda i: message_update(ru["consent_agree"]),
+                    Form.Consent, form_data(), Form.Name),
+        HandlerCase("user.name_step", lambda i: message_update(NAME), Form.Name, form_data(), Form.Phone),
+        HandlerCase("user.phone_step", lambda i: message_update(PHONE), Form.Phone, form_data(), Form.Category),
+        HandlerCase("user.category_step", lambda i: message_update(category),
+                    Form.Category, form_data(), Form.Text),
+        HandlerCase("user.text_step", lambda i: message_update(TEXT), Form.Text, form_data(), Form.Attachments),
+        HandlerCase("user.attachments_collect", lambda i: message_update(photo=photo),
+                    Form.Attachments, form_data(), Form.Attachments),
+        HandlerCase("user.attachments_done", lambda i: message_update(ru["btn_done"]),
+                    Form.Attachments, form_data(attachments=attachments), Form.Review),
+        HandlerCase("user.review_edit", lambda i: message_update(ru["btn_edit"]),
+                    Form.Review, form_data(), Form.EditChoice),
+        HandlerCase("user.edit_choice", lambda i: message_update(ru["edit_category"]),
+                    Form.EditChoice, form_data(), Form.Category),
+        HandlerCase("user.review_send", lambda i: message_update(ru["btn_send"]),
+                    Form.Review, form_data(), None),
+        HandlerCase("user.new_request_shortcut", lambda i: message_update(ru["btn_new_request"]),
+                    None, None, Form.Lang),
+        # Чередуем «В работу» / «Закрыть», чтобы каждый вызов менял статус и правил карточку
+        HandlerCase("admin.admin_card_action",
+                    lambda i: callback_update(f"adm:{'work' if i % 2 else 'close'}:{TICKET_ID}"),
+                    user_id=ADMIN_ID, chat_id=SUPPORT_CHAT_ID),
+        HandlerCase("admin.cmd_whereami", lambda i: message_update("/whereami", ADMIN_ID), user_id=ADMIN_ID),
+        HandlerCase("admin.cmd_stats", lambda i: message_update("/stats", ADMIN_ID), user_id=ADMIN_ID),
+        HandlerCase("admin.cmd_export", lambda i: message_update("/export limit=10", ADMIN_ID), user_id=ADMIN_ID),
+
+        FuncCase("helpers.card_text", lambda: helpers.card_text(
+            "RU", TICKET_ID, NAME, PHONE, category, TEXT, ru["card_status_new"])),
+        FuncCase("helpers.render_card", lambda: helpers.render_card(ticket)),
+        FuncCase("helpers.build_bitrix_description", lambda: helpers.build_bitrix_description(
+            "RU", NAME, PHONE, category, TEXT, attachments, TICKET_ID)),
+        FuncCase("helpers.validate_phone", lambda: helpers.validate_phone(PHONE)),
+        FuncCase("keyboards.kb_admin_card", lambda: keyboards.kb_admin_card.__wrapped__(TICKET_ID, "RU")),
+    ]
+    for kb_name, build in keyboards._BUILDERS.items():
+        cases.append(FuncCase(f"keyboards.build_{kb_name}", lambda build=build: build("RU")))
+    return cases
+
+
+# -------------------- Замер --------------------
+
+# Снимки tracemalloc сами выделяют память — её в счёт блоков не берём
+_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+
+def _blocks(snapshot: tracemalloc.Snapshot) -> int:
+    return sum(stat.count for stat in snapshot.filter_traces(_SNAPSHOT_FILTERS).statistics("filename"))
+
+
+async def _time(case: Case, min_time: float, min_iterations: int) -> float:
+    """Секунд на вызов за один проход не короче min_time."""
+    elapsed, n = 0.0, 0
+    if isinstance(case, FuncCase):
+        # Синхронная функция: меряем пачками, без накладных расходов корутины
+        fn, batch = case.fn, max(1, min_iterations)
+        while elapsed < min_time:
+            started = time.perf_counter()
+            for _ in range(batch):
+                fn()
+            elapsed += time.perf_counter() - started
+            n += batch
+    else:
+        while elapsed < min_time or n < min_iterations:
+            await case.prepare(n)
+            started = time.perf_counter()
+            await case.run()
+            elapsed += time.perf_counter() - started
+            n += 1
+    return elapsed / n
+
+
+async def measure(
+    case: Case, min_time: float, min_iterations: int, repeat: int, mem_iterations: int
+) -> Dict[str, float]:
+    # Прогрев и проверка, что случай делает то, что задумано
+    for i in range(3):
+        await case.prepare(i)
+        await case.check(await case.run())
+
+    # Как в timeit: лучший из нескольких проходов меньше всего зависит от соседей по машине
+    per_call = min([await _time(case, min_time, min_iterations) for _ in range(repeat)])
+
+    # Память — отдельным проходом: tracemalloc заметно замедляет код
+    tracemalloc.start()
+    try:
+        peak_total = retained_total = blocks_total = 0
+        for i in range(mem_iterations):
+            await case.prepare(i)
+            blocks_before = _blocks(tracemalloc.take_snapshot())
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            if isinstance(case, FuncCase):
+                case.fn()
+            else:
+                await case.run()
+            after, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - before
+            retained_total += after - before
+            blocks_total += _blocks(tracemalloc.take_snapshot()) - blocks_before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops": 1 / per_call,
+        "us": per_call * 1e6,
+        "peak_bytes": peak_total / mem_iterations,
+        "retained_bytes": max(0.0, retained_total / mem_iterations),
+        "retained_blocks": max(0.0, blocks_total / mem_iterations),
+    }
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "aiogram": aiogram.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+async def run_all(args: argparse.Namespace) -> Dict[str, Any]:
+    bot.session = NoopSession()
+    results: Dict[str, Dict[str, float]] = {}
+    for case in build_cases():
+        if args.k and not any(k in case.name for k in args.k):
+            continue
+        results[case.name] = await measure(
+            case, args.min_time, args.min_iterations, args.repeat, args.mem_iterations
+        )
+        r = results[case.name]
+        print(f"{case.name:<34}{r['ops']:>12,.0f}{r['us']:>10.1f}{r['peak_bytes']:>11,.0f}"
+              f"{r['retained_bytes']:>11,.0f}{r['retained_blocks']:>9.1f}")
+    return {"environment": environment(), "results": results}
+
+
+# -------------------- Базовая линия --------------------
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Регрессии относительно базовой линии: медленнее или больше памяти, чем на threshold."""
+    old_env, new_env = baseline.get("environment", {}), report["environment"]
+    for key in ("python", "aiogram", "machine", "processor", "cpus"):
+        if old_env.get(key) != new_env.get(key):
+            print(f"внимание: {key} отличается от базовой линии ({old_env.get(key)} -> {new_env.get(key)}), "
+                  "сравнение приблизительное", file=sys.stderr)
+
+    regressions = []
+    print(f"\n{'случай':<34}{'ops/s было':>12}{'стало':>12}{'Δ':>8}{'пик было':>11}{'стало':>11}")
+    for name, new in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<34}{'—':>12}{new['ops']:>12,.0f}")
+            continue
+        delta = new["ops"] / old["ops"] - 1
+        mark = ""
+        if delta < -threshold:
+            mark = "  медленнее"
+        if new["peak_bytes"] > old["peak_bytes"] * (1 + threshold) and new["peak_bytes"] - old["peak_bytes"] > 1024:
+            mark += "  память"
+        if mark:
+            regressions.append(name)
+        print(f"{name:<34}{old['ops']:>12,.0f}{new['ops']:>12,.0f}{delta:>+8.0%}"
+              f"{old['peak_bytes']:>11,.0f}{new['peak_bytes']:>11,.0f}{mark}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Микробенчмарки обработчиков и горячих функций бота")
+    p.add_argument("-k", action="append", help="только случаи с этой подстрокой в имени (можно несколько)")
+    p.add_argument("--min-time", type=float, default=0.2, help="минимальное время одного прохода, сек")
+    p.add_argument("--min-iterations", type=int, default=100)
+    p.add_argument("--repeat", type=int, default=5, help="проходов на случай (берётся лучший)")
+    p.add_argument("--mem-iterations", type=int, default=50, help="вызовов для замера памяти")
+    p.add_argument("--save", nargs="?", const=str(BASELINE_PATH), metavar="PATH",
+                   help="записать результаты как базовую линию")
+    p.add_argument("--compare", nargs="?", const=str(BASELINE_PATH), metavar="PATH",
+                   help="сравнить с базовой линией")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="допустимое ухудшение (доля): 0.25 — на 25%% медленнее или больше памяти")
+    args = p.parse_args(argv)
+
+    print(f"{'случай':<34}{'ops/s':>12}{'мкс':>10}{'пик, Б':>11}{'остаётся':>11}{'блоков':>9}")
+    report = asyncio.run(run_all(args))
+
+    if args.save:
+        path = Path(args.save)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\nбазовая линия записана: {path}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\nрегрессии: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
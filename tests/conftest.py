@@ -0,0 +1,20 @@
+"""
+Общие настройки тестов. Конфигурация бота читается при импорте app,
+поэтому окружение выставляется здесь, до первого импорта.
+"""
+
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.update({
+    "BOT_TOKEN": "123456:test",
+    "SUPPORT_CHAT_ID": "-1001000000000",
+    "DB_PATH": os.path.join(_TMP, "bot.sqlite3"),
+    "DB_BUSY_TIMEOUT": "0.1",
+    "FSM_STORAGE": "memory",
+    "LOCALES_POLL_INTERVAL": "0",
+    "CARD_ID_WAIT": "0",
+    "OUTBOX_BASE_DELAY": "2",
+    "OUTBOX_MAX_DELAY": "600",
+})
@@ -0,0 +1,54 @@
+from app.attachments import MEDIA_GROUP_MAX, plan_sends
+
+
+def _a(kind, n):
+    return {"type": kind, "file_id": f"{kind}-{n}"}
+
+
+def _ids(plan):
+    return [[a["file_id"] for a in chunk] for chunk in plan]
+
+
+def test_chunks_at_media_group_max():
+    photos = [_a("photo", n) for n in range(MEDIA_GROUP_MAX + 3)]
+    plan = plan_sends(photos)
+    assert [len(chunk) for chunk in plan] == [MEDIA_GROUP_MAX, 3]
+    assert sum(plan, []) == photos
+
+
+def test_exactly_max_is_one_album():
+    photos = [_a("photo", n) for n in range(MEDIA_GROUP_MAX)]
+    assert plan_sends(photos) == [photos]
+
+
+def test_photos_and_videos_share_album():
+    items = [_a("photo", 1), _a("video", 1), _a("photo", 2)]
+    assert plan_sends(items) == [items]
+
+
+def test_mixed_types_keep_user_order():
+    items = [
+        _a("photo", 1),
+        _a("photo", 2),
+        _a("document", 1),
+        _a("voice", 1),
+        _a("photo", 3),
+        _a("document", 2),
+        _a("document", 3),
+    ]
+    assert _ids(plan_sends(items)) == [
+        ["photo-1", "photo-2"],
+        ["document-1"],
+        ["voice-1"],
+        ["photo-3"],
+        ["document-2", "document-3"],
+    ]
+
+
+def test_voice_is_never_grouped():
+    items = [_a("voice", 1), _a("voice", 2)]
+    assert _ids(plan_sends(items)) == [["voice-1"], ["voice-2"]]
+
+
+def test_empty():
+    assert plan_sends([]) == []
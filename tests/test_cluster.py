@@ -0,0 +1,51 @@
+import time
+
+from app.cluster import Supervisor
+
+
+class _DeadProcess:
+    exitcode = -9
+
+    def is_alive(self):
+        return False
+
+
+def _update(update_id, chat_id):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": "x"}}
+
+
+def _get_all(q):
+    out = []
+    while not q.empty():
+        out.append(q.get(timeout=1))
+    return out
+
+
+def test_unacked_updates_are_redelivered_to_restarted_worker(monkeypatch):
+    sup = Supervisor(2)
+    started = []
+    monkeypatch.setattr(sup, "_start_worker", started.append)
+    for update_id in (1, 2, 3):
+        sup.route(_update(update_id, 10))  # 10 % 2 -> воркер 0
+    sup.route(_update(4, 11))
+    old_queue = sup.queues[0]
+
+    sup.acks.put((0, 1))
+    time.sleep(0.1)  # очередь multiprocessing доставляет через фоновый поток
+    sup.procs = [_DeadProcess(), None]
+    sup._check_workers()
+
+    assert started == [0]
+    assert sup.queues[0] is not old_queue
+    time.sleep(0.1)
+    assert [raw["update_id"] for raw in _get_all(sup.queues[0])] == [2, 3]
+    assert list(sup.pending[1]) == [4]
+
+
+def test_acked_updates_are_forgotten():
+    sup = Supervisor(1)
+    sup.route(_update(7, 5))
+    sup.acks.put((0, 7))
+    time.sleep(0.1)
+    sup._drain_acks()
+    assert sup.pending == [{}]
@@ -0,0 +1,43 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from app.db import connect, retry_locked
+
+
+def test_retry_locked_waits_for_other_writer(tmp_path):
+    path = str(tmp_path / "lock.sqlite3")
+    holder, writer = connect(path), connect(path)
+    holder.execute("CREATE TABLE t (x INTEGER)")
+    holder.execute("BEGIN IMMEDIATE")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.4, holder.execute, "COMMIT")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        background = asyncio.create_task(ticker())
+        started = time.monotonic()
+        await retry_locked(writer.execute, "INSERT INTO t VALUES (1)")
+        background.cancel()
+        return time.monotonic() - started, ticks
+
+    elapsed, ticks = asyncio.run(scenario())
+    assert elapsed >= 0.3
+    # Между попытками цикл событий свободен
+    assert ticks >= 5
+    assert writer.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+
+
+def test_retry_locked_does_not_retry_other_errors(tmp_path):
+    db = connect(str(tmp_path / "err.sqlite3"))
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        asyncio.run(retry_locked(db.execute, "SELECT * FROM missing"))
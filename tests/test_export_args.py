@@ -0,0 +1,54 @@
+from datetime import date
+
+import pytest
+
+from app.config import EXPORT_LOOKBACK
+from app.export import parse_export_args
+
+
+def test_defaults():
+    assert parse_export_args("") == {"query": {"limit": EXPORT_LOOKBACK}, "format": "csv", "gzip": False}
+
+
+def test_full_query():
+    args = parse_export_args('from=2025-01-01 to=2025-01-31 status=new,closed category="Угрозы и давление" limit=0 gz')
+    assert args == {
+        "query": {
+            "limit": 0,
+            "date_from": date(2025, 1, 1),
+            "date_to": date(2025, 1, 31),
+            "statuses": ["new", "closed"],
+            "category": "Угрозы и давление",
+        },
+        "format": "csv",
+        "gzip": True,
+    }
+
+
+def test_jsonl_is_always_gzipped():
+    assert parse_export_args("format=jsonl")["gzip"] is True
+
+
+def test_parquet_ignores_gz(monkeypatch):
+    monkeypatch.setattr("app.export.importlib.util.find_spec", lambda name: object())
+    assert parse_export_args("format=parquet gz")["gzip"] is False
+
+
+def test_parquet_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr("app.export.importlib.util.find_spec", lambda name: None)
+    with pytest.raises(ValueError, match="pyarrow"):
+        parse_export_args("format=parquet")
+
+
+@pytest.mark.parametrize("args, message", [
+    ("from=2025-13-01", "ГГГГ-ММ-ДД"),
+    ("status=new,lost", "неизвестный статус: lost"),
+    ("limit=ten", "limit должен быть числом"),
+    ("format=xlsx", "формат должен быть"),
+    ("owner=me", "неизвестный параметр"),
+    ("nonsense", "непонятный аргумент"),
+    ('category="open', "не разобрать"),
+])
+def test_errors(args, message):
+    with pytest.raises(ValueError, match=message):
+        parse_export_args(args)
@@ -0,0 +1,158 @@
+import asyncio
+import types
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from app import fsm_storage
+from app.states import Form
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+OTHER = StorageKey(bot_id=1, chat_id=200, user_id=200)
+
+
+# -------------------- SQLite --------------------
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fsm_storage, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, clock):
+    storage = fsm_storage.SqliteStorage(str(tmp_path / "fsm.sqlite3"), ttl=60, purge_interval=600)
+    yield storage
+    asyncio.run(storage.close())
+
+
+def _rows(storage):
+    return storage._db.execute("SELECT key, state, data FROM fsm ORDER BY key").fetchall()
+
+
+def test_sqlite_state_and_data_round_trip(sqlite_storage):
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.Text)
+        await sqlite_storage.set_data(KEY, {"lang": "RU", "attachments": [{"type": "photo", "file_id": "x"}]})
+        result = await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+        await sqlite_storage.set_state(KEY, None)
+        return result, await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+
+    (state, data), cleared, kept = asyncio.run(scenario())
+    assert state == Form.Text.state
+    assert data == {"lang": "RU", "attachments": [{"type": "photo", "file_id": "x"}]}
+    assert cleared is None
+    assert kept == data
+
+
+def test_sqlite_form_expires_after_ttl(sqlite_storage, clock):
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.Phone)
+        await sqlite_storage.set_data(KEY, {"name": "Иван"})
+        clock.now += 59
+        fresh = await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+        clock.now += 2
+        return fresh, (await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY))
+
+    fresh, expired = asyncio.run(scenario())
+    assert fresh == (Form.Phone.state, {"name": "Иван"})
+    assert expired == (None, {})
+
+
+@pytest.mark.parametrize("write", ["state", "data"])
+def test_sqlite_write_after_expiry_does_not_resurrect(sqlite_storage, clock, write):
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.Name)
+        await sqlite_storage.set_data(KEY, {"a": 1})
+        clock.now += 61
+        if write == "state":
+            await sqlite_storage.set_state(KEY, Form.Lang)
+        else:
+            await sqlite_storage.set_data(KEY, {"b": 2})
+        return await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+
+    state, data = asyncio.run(scenario())
+    if write == "state":
+        assert (state, data) == (Form.Lang.state, {})
+    else:
+        assert (state, data) == (None, {"b": 2})
+
+
+def test_sqlite_purge_removes_expired_and_empty_forms(sqlite_storage, clock):
+    fresh = StorageKey(bot_id=1, chat_id=300, user_id=300)
+    newest = StorageKey(bot_id=1, chat_id=400, user_id=400)
+
+    async def scenario():
+        await sqlite_storage.set_state(OTHER, Form.Text)  # первая запись — заодно первая чистка
+        await sqlite_storage.set_state(KEY, None)  # очищенная форма
+        clock.now += 599
+        # Ещё не пора: с прошлой чистки прошло меньше purge_interval
+        await sqlite_storage.set_data(fresh, {"x": 1})
+        before = len(_rows(sqlite_storage))
+        clock.now += 1
+        await sqlite_storage.set_data(newest, {"y": 1})
+        return before, [r["key"] for r in _rows(sqlite_storage)]
+
+    before, after = asyncio.run(scenario())
+    assert before == 3
+    # Брошенная OTHER и пустая KEY удалены, свежие формы остались
+    assert after == [sqlite_storage._key_builder.build(fresh), sqlite_storage._key_builder.build(newest)]
+
+
+# -------------------- Redis (fakeredis) --------------------
+
+
+@pytest.fixture
+def redis_storage(monkeypatch):
+    pytest.importorskip("redis")
+    fakeredis = pytest.importorskip("fakeredis")
+    from aiogram.fsm.storage import redis as aiogram_redis
+
+    server = fakeredis.FakeServer()
+    # RedisStorage.from_url строит клиент из пула соединений — подменяем клиент на fakeredis
+    monkeypatch.setattr(aiogram_redis, "Redis", lambda connection_pool: fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(fsm_storage, "FSM_STORAGE", "redis")
+    monkeypatch.setattr(fsm_storage, "FSM_TTL", 1.0)
+    return fsm_storage.build_fsm_storage()
+
+
+def test_redis_state_and_data_round_trip(redis_storage):
+    async def scenario():
+        await redis_storage.set_state(KEY, "Form:Text")
+        await redis_storage.set_data(KEY, {"lang": "RU", "attachments": [{"type": "photo", "file_id": "x"}]})
+        result = await redis_storage.get_state(KEY), await redis_storage.get_data(KEY)
+        await redis_storage.set_state(KEY, None)
+        cleared = await redis_storage.get_state(KEY)
+        await redis_storage.close()
+        return result, cleared
+
+    (state, data), cleared = asyncio.run(scenario())
+    assert state == "Form:Text"
+    assert data == {"lang": "RU", "attachments": [{"type": "photo", "file_id": "x"}]}
+    assert cleared is None
+
+
+def test_redis_abandoned_form_expires_after_ttl(redis_storage):
+    async def scenario():
+        await redis_storage.set_state(KEY, "Form:Phone")
+        await redis_storage.set_data(KEY, {"name": "Иван"})
+        state_ttl = await redis_storage.redis.ttl(redis_storage.key_builder.build(KEY, "state"))
+        await asyncio.sleep(1.2)
+        result = state_ttl, await redis_storage.get_state(KEY), await redis_storage.get_data(KEY)
+        await redis_storage.close()
+        return result
+
+    state_ttl, state, data = asyncio.run(scenario())
+    assert state_ttl == 1
+    assert state is None
+    assert data == {}
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+from app import idgen
+from app.idgen import IdAllocator
+
+
+class _Clock:
+    """Подменяет datetime в idgen: год задаёт тест."""
+
+    year = 2025
+
+    @classmethod
+    def utcnow(cls):
+        return datetime(cls.year, 6, 1)
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    _Clock.year = 2025
+    monkeypatch.setattr(idgen, "datetime", _Clock)
+    return _Clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "ids.sqlite3")
+
+
+def _reserved(allocator, year=2025):
+    row = allocator._conn().execute(
+        "SELECT next_value FROM id_blocks WHERE prefix = ? AND year = ?", (allocator.prefix, year)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def test_ids_are_reserved_in_blocks(path):
+    allocator = IdAllocator(path, "HR", block_size=3)
+
+    assert [allocator.next_id() for _ in range(3)] == ["HR-2025-000001", "HR-2025-000002", "HR-2025-000003"]
+    # Три номера — одна запись в базу
+    assert _reserved(allocator) == 4
+    assert allocator.next_id() == "HR-2025-000004"
+    assert _reserved(allocator) == 7
+
+
+def test_restart_skips_rest_of_block(path):
+    first = IdAllocator(path, "HR", block_size=10)
+    first.next_id()
+
+    assert IdAllocator(path, "HR", block_size=10).next_id() == "HR-2025-000011"
+
+
+def test_numbering_restarts_each_year(path, clock):
+    allocator = IdAllocator(path, "HR", block_size=10)
+    allocator.next_id()
+    allocator.next_id()
+
+    # Блок ещё не исчерпан, но год сменился
+    clock.year = 2026
+    assert allocator.next_id() == "HR-2026-000001"
+    assert _reserved(allocator, 2026) == 11
+    assert _reserved(allocator, 2025) == 11
+
+
+def test_two_allocators_on_one_db_never_collide(path):
+    a = IdAllocator(path, "HR", block_size=4)
+    b = IdAllocator(path, "HR", block_size=4)
+
+    issued = []
+    for _ in range(10):
+        issued.append(a.next_id())
+        issued.append(b.next_id())
+        issued.append(b.next_id())
+
+    assert len(set(issued)) == len(issued)
+    assert issued[:3] == ["HR-2025-000001", "HR-2025-000005", "HR-2025-000006"]
+
+
+def test_continues_after_ids_issued_before_blocks(path):
+    allocator = IdAllocator(path, "HR", block_size=5)
+    db = allocator._conn()
+    db.execute("CREATE TABLE tickets (id TEXT PRIMARY KEY)")
+    db.executemany("INSERT INTO tickets VALUES (?)", [("HR-2025-000041",), ("HR-2024-000900",)])
+
+    assert allocator.next_id() == "HR-2025-000042"
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from pydantic import ValidationError
+
+from app import keyboards
+
+
+def _sent_markup(markup):
+    session = AiohttpSession()
+    bot = Bot("123456:test", session=session)
+    try:
+        form = session.build_form_data(bot, SendMessage(chat_id=1, text="x", reply_markup=markup))
+        return json.loads(dict((f[0]["name"], f[2]) for f in form._fields)["reply_markup"])
+    finally:
+        asyncio.run(session.close())
+
+
+def test_cached_keyboard_cannot_be_changed():
+    kb = keyboards.kb_review("RU")
+    with pytest.raises(ValidationError):
+        kb.resize_keyboard = False
+    with pytest.raises(ValidationError):
+        kb.keyboard[0][0].text = "HACK"
+    with pytest.raises(AttributeError):
+        kb.keyboard[0].append(kb.keyboard[0][0])
+    assert keyboards.kb_review("RU") is kb
+    assert kb.resize_keyboard is True
+
+
+def test_cached_keyboard_is_sent_like_built_one():
+    for name, build in keyboards._BUILDERS.items():
+        assert _sent_markup(keyboards._kb(name, "RU")) == _sent_markup(build("RU")), name
+
+
+def test_admin_card_keyboard_is_frozen_and_serializable():
+    kb = keyboards.kb_admin_card("HR-2025-000001", "RU")
+    with pytest.raises(ValidationError):
+        kb.inline_keyboard[0][0].callback_data = "adm:close:other"
+    assert _sent_markup(kb) == {"inline_keyboard": [[
+        {"text": "🛠 В работу", "callback_data": "adm:work:HR-2025-000001"},
+        {"text": "✅ Закрыть", "callback_data": "adm:close:HR-2025-000001"},
+    ]]}
@@ -0,0 +1,58 @@
+import asyncio
+
+from app.middlewares import ChatEventIsolation
+
+
+def test_isolation_close_while_lock_is_held():
+    async def scenario():
+        iso = ChatEventIsolation()
+        async with iso.lock("chat"):
+            await iso.close()
+        return iso._locks
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_isolation_old_holder_keeps_new_entry_after_close():
+    async def scenario():
+        iso = ChatEventIsolation()
+        release = asyncio.Event()
+        entered = asyncio.Event()
+
+        async def new_holder():
+            async with iso.lock("chat"):
+                entered.set()
+                await release.wait()
+
+        async with iso.lock("chat"):
+            await iso.close()
+            task = asyncio.create_task(new_holder())
+            await entered.wait()
+        # Старый владелец вышел, а запись нового владельца осталась
+        alive = "chat" in iso._locks
+        release.set()
+        await task
+        return alive, iso._locks
+
+    alive, locks = asyncio.run(scenario())
+    assert alive
+    assert locks == {}
+
+
+def test_isolation_serializes_one_chat():
+    async def scenario():
+        iso = ChatEventIsolation()
+        order = []
+
+        async def handler(n):
+            async with iso.lock("chat"):
+                order.append(("in", n))
+                await asyncio.sleep(0.01)
+                order.append(("out", n))
+
+        await asyncio.gather(handler(1), handler(2))
+        return order, iso._locks
+
+    order, locks = asyncio.run(scenario())
+    assert order == [("in", 1), ("out", 1), ("in", 2), ("out", 2)]
+    assert locks == {}
@@ -0,0 +1,188 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+from app import outbox
+from app.bot_core import tickets
+
+
+@pytest.fixture(autouse=True)
+def clean_outbox():
+    outbox._conn().execute("DELETE FROM outbox")
+    yield
+    outbox._conn().execute("DELETE FROM outbox")
+    with tickets.transaction() as db:
+        db.execute("DELETE FROM tickets WHERE id LIKE 'TX-%'")
+
+
+def _set(job_id, **fields):
+    sets = ", ".join(f"{k} = ?" for k in fields)
+    outbox._conn().execute(f"UPDATE outbox SET {sets} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _ids(external_id):
+    return [r["id"] for r in outbox._conn().execute(
+        "SELECT id FROM outbox WHERE external_id = ? ORDER BY id", (external_id,))]
+
+
+def test_enqueue_duplicate_create_is_reported():
+    assert outbox.enqueue("HR-1", "create", {"mode": "TASKS"})
+    assert not outbox.enqueue("HR-1", "create", {"mode": "TASKS"})
+    # Статусные задания одной заявки не склеиваются
+    assert outbox.enqueue("HR-1", "work", {"comment": "a"})
+    assert outbox.enqueue("HR-1", "work", {"comment": "b"})
+    assert len(_ids("HR-1")) == 3
+
+
+def test_claim_takes_only_first_job_of_each_ticket():
+    outbox.enqueue("HR-1", "create", {})
+    outbox.enqueue("HR-1", "work", {"comment": ""})
+    outbox.enqueue("HR-2", "create", {})
+
+    claimed = outbox._claim_due()
+    assert [(r["external_id"], r["kind"]) for r in claimed] == [("HR-1", "create"), ("HR-2", "create")]
+
+
+def test_claim_leases_jobs():
+    outbox.enqueue("HR-1", "create", {})
+    assert len(outbox._claim_due()) == 1
+    # Аренда действует — второй проход (или другой процесс) задание не берёт
+    assert outbox._claim_due() == []
+
+    _set(_ids("HR-1")[0], locked_until=time.time() - 1)
+    assert len(outbox._claim_due()) == 1
+
+
+def test_claim_skips_backoff_and_waits_for_head():
+    outbox.enqueue("HR-1", "create", {})
+    outbox.enqueue("HR-1", "close", {"comment": ""})
+    create_id, close_id = _ids("HR-1")
+    _set(create_id, next_attempt_at=time.time() + 60)
+
+    # close готов по сроку, но create ещё в backoff — порядок важнее
+    assert outbox._claim_due() == []
+    assert outbox._next_due_in() > 0
+
+
+def test_due_jobs_are_claimed_behind_many_backoff_rows():
+    db = outbox._conn()
+    later = time.time() + 3600
+    db.executemany(
+        "INSERT INTO outbox (external_id, kind, payload, next_attempt_at, created_at) VALUES (?, 'create', '{}', ?, ?)",
+        [(f"OLD-{i}", later, time.time()) for i in range(1500)],
+    )
+    outbox.enqueue("HR-NEW", "create", {})
+
+    claimed = outbox._claim_due()
+    assert [r["external_id"] for r in claimed] == ["HR-NEW"]
+
+
+def test_next_due_in_without_jobs_is_poll_interval():
+    assert outbox._next_due_in() == outbox.POLL_INTERVAL
+
+
+def test_failed_job_backs_off_exponentially(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("portal down")
+
+    monkeypatch.setattr(outbox, "_run_create", fail)
+    monkeypatch.setattr(outbox.random, "uniform", lambda a, b: 1.0)
+    outbox.enqueue("HR-1", "create", {"card": {"lang": "RU"}})
+    job_id = _ids("HR-1")[0]
+
+    delays = []
+    for _ in range(3):
+        _set(job_id, next_attempt_at=0, locked_until=0)
+        (row,) = outbox._claim_due()
+        started = time.time()
+        asyncio.run(outbox._process(row))
+        row = outbox._conn().execute("SELECT * FROM outbox WHERE id = ?", (job_id,)).fetchone()
+        delays.append(row["next_attempt_at"] - started)
+        assert row["status"] == "pending"
+        assert row["locked_until"] == 0
+        assert "portal down" in row["last_error"]
+
+    assert row["attempts"] == 3
+    assert delays == pytest.approx([2, 4, 8], abs=0.5)
+
+
+def test_successful_create_is_recorded(monkeypatch):
+    async def create(external_id, payload, attempts, created_at):
+        return {"task_id": 42, "crm_item_id": None}
+
+    monkeypatch.setattr(outbox, "_run_create", create)
+    outbox.enqueue("HR-1", "create", {"card": {"lang": "RU"}})
+    (row,) = outbox._claim_due()
+    asyncio.run(outbox._process(row))
+
+    assert outbox.created_entity("HR-1") == {"task_id": 42, "crm_item_id": None}
+    assert outbox._claim_due() == []
+
+
+def test_background_tasks_are_kept_and_awaited(caplog):
+    async def scenario():
+        done = []
+
+        async def send():
+            await asyncio.sleep(0.01)
+            done.append(True)
+
+        async def fail():
+            raise RuntimeError("telegram down")
+
+        outbox.spawn(send())
+        outbox.spawn(fail())
+        assert len(outbox._background) == 2
+        await outbox.wait_background()
+        return done
+
+    assert asyncio.run(scenario()) == [True]
+    assert outbox._background == set()
+    assert "telegram down" in caplog.text
+
+
+def _ticket(external_id, name="Иван"):
+    return {
+        "id": external_id,
+        "date": datetime(2025, 1, 1, 12, 0),
+        "language": "RU",
+        "name": name,
+        "phone": "+79990000000",
+        "category": "Другое",
+        "status": "новое",
+        "text_len": 10,
+        "attachments_count": 0,
+    }
+
+
+def test_create_ticket_writes_ticket_and_job_together():
+    assert outbox.create_ticket(_ticket("TX-1"), {"mode": "TASKS"})
+    assert tickets.get("TX-1")["name"] == "Иван"
+    assert len(_ids("TX-1")) == 1
+
+
+def test_create_ticket_with_taken_id_writes_nothing():
+    outbox.create_ticket(_ticket("TX-1"), {"mode": "TASKS"})
+
+    assert not outbox.create_ticket(_ticket("TX-1", name="Пётр"), {"mode": "TASKS"})
+    # Чужая заявка с тем же ID не перезаписана
+    assert tickets.get("TX-1")["name"] == "Иван"
+    assert len(_ids("TX-1")) == 1
+
+
+def test_create_ticket_rolls_back_job_when_ticket_fails(monkeypatch):
+    def broken_add(ticket):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(tickets, "add", broken_add)
+    with pytest.raises(sqlite3.OperationalError):
+        outbox.create_ticket(_ticket("TX-1"), {"mode": "TASKS"})
+    monkeypatch.undo()
+
+    # Ни задания без заявки, ни заявки без задания; повтор проходит
+    assert _ids("TX-1") == []
+    assert tickets.get("TX-1") is None
+    assert outbox.create_ticket(_ticket("TX-1"), {"mode": "TASKS"})
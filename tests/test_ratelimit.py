@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+from app.ratelimit import AdaptiveLimiter, OutboundLimiter, PriorityTokenBucket, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_paces():
+    async def run():
+        bucket = TokenBucket(rate=20, burst=3)
+        waits = [await bucket.acquire() for _ in range(5)]
+        return waits
+
+    waits = asyncio.run(run())
+    assert all(w < 0.01 for w in waits[:3])
+    # Дальше по токену раз в 1/rate секунд
+    assert all(0.03 < w < 0.2 for w in waits[3:])
+
+
+def test_token_bucket_drain_drops_burst():
+    async def run():
+        bucket = TokenBucket(rate=20, burst=5)
+        bucket.drain()
+        return await bucket.acquire()
+
+    assert asyncio.run(run()) >= 0.03
+
+
+def test_priority_bucket_serves_higher_priority_first():
+    async def run():
+        bucket = PriorityTokenBucket(rate=50, burst=1)
+        await bucket.acquire()  # забираем всплеск
+        order = []
+
+        async def take(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        low = asyncio.create_task(take("low-1", 2))
+        await asyncio.sleep(0)
+        low2 = asyncio.create_task(take("low-2", 2))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(take("high", 0))
+        await asyncio.sleep(0)
+        assert bucket.waiting_by_priority() == {2: 2, 0: 1}
+        await asyncio.gather(low, low2, high)
+        return order
+
+    assert asyncio.run(run()) == ["high", "low-1", "low-2"]
+
+
+def test_priority_bucket_cancelled_waiter_is_skipped():
+    async def run():
+        bucket = PriorityTokenBucket(rate=50, burst=1)
+        await bucket.acquire()
+        gone = asyncio.create_task(bucket.acquire(0))
+        stays = asyncio.create_task(bucket.acquire(1))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.wait_for(stays, 1)
+        return bucket.waiting
+
+    assert asyncio.run(run()) == 0
+
+
+def test_priority_bucket_drain_pauses():
+    async def run():
+        bucket = PriorityTokenBucket(rate=100, burst=5)
+        bucket.drain(pause=0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_adaptive_limiter_halves_on_overload_and_grows_back():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=8, cooldown=60)
+
+    async def run():
+        await limiter.acquire()
+        limiter.release(overloaded=True)
+        assert limiter.limit == 4
+        # В пределах cooldown повторная перегрузка предел не режет
+        await limiter.acquire()
+        limiter.release(overloaded=True)
+        assert limiter.limit == 4
+        for _ in range(20):
+            await limiter.acquire()
+            limiter.release()
+        return limiter.limit
+
+    limit = asyncio.run(run())
+    assert 4 < limit <= 8
+
+
+def test_adaptive_limiter_never_below_min():
+    limiter = AdaptiveLimiter(min_limit=2, max_limit=8, cooldown=0)
+
+    async def run():
+        for _ in range(10):
+            await limiter.acquire()
+            limiter.release(overloaded=True)
+
+    asyncio.run(run())
+    assert limiter.limit == 2
+
+
+def test_adaptive_limiter_bounds_concurrency():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        limiter.release()
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+
+
+def test_adaptive_limiter_cancel_after_wake_skipped_waiter():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1)
+
+    async def run():
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        # release() успевает до обработчика отмены: _wake() выбрасывает
+        # отменённый future из очереди, и удалять его уже нечего
+        limiter.release()
+        results = await asyncio.gather(waiting, return_exceptions=True)
+        return results[0]
+
+    result = asyncio.run(run())
+    assert isinstance(result, asyncio.CancelledError)
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+
+
+def test_outbound_limiter_releases_slot_when_cancelled_in_bucket():
+    async def run():
+        limiter = OutboundLimiter(rate=1, burst=1, min_concurrency=1, max_concurrency=4)
+        await limiter.acquire()
+        limiter.release()
+        waiting = asyncio.create_task(limiter.acquire())  # токенов нет — ждёт в бакете
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0
+    assert stats["calls"] == 1
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from aiogram.methods import SendMessage
+
+from app.send_queue import SendScheduler
+
+SUPPORT_CHAT_ID = -100
+
+
+def _scheduler() -> SendScheduler:
+    return SendScheduler(SUPPORT_CHAT_ID, global_rate=30, chat_rate=1, group_rate=20)
+
+
+async def _send(scheduler: SendScheduler, chat_id: int) -> float:
+    async def make_request(bot, method):
+        return None
+
+    started = time.monotonic()
+    await scheduler(make_request, None, SendMessage(chat_id=chat_id, text="x"))
+    return time.monotonic() - started
+
+
+def test_private_chat_paced_without_incoming():
+    async def run():
+        scheduler = _scheduler()
+        return [await _send(scheduler, 42) for _ in range(4)]
+
+    waits = asyncio.run(run())
+    assert all(w < 0.05 for w in waits[:3])
+    # Всплеск CHAT_BURST исчерпан — дальше по TELEGRAM_CHAT_RATE
+    assert waits[3] > 0.5
+
+
+def test_reply_to_incoming_message_skips_chat_limit():
+    async def run():
+        scheduler = _scheduler()
+        waits = []
+        for _ in range(6):
+            scheduler.incoming(42)
+            waits.append(await _send(scheduler, 42))
+        return waits
+
+    assert all(w < 0.05 for w in asyncio.run(run()))
+
+
+def test_incoming_credit_wakes_waiting_send():
+    async def run():
+        scheduler = _scheduler()
+        for _ in range(3):
+            await _send(scheduler, 42)
+        waiting = asyncio.create_task(_send(scheduler, 42))
+        await asyncio.sleep(0.05)
+        scheduler.incoming(42)
+        return await waiting
+
+    assert asyncio.run(run()) < 0.2
+
+
+def test_incoming_ignores_groups():
+    scheduler = _scheduler()
+    scheduler.incoming(SUPPORT_CHAT_ID)
+    assert scheduler.stats()["chats"] == 0
@@ -0,0 +1,138 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from app.storage import SqliteTicketRepository
+
+
+def _ticket(external_id, status="новое", category="Угрозы и давление", language="RU", day=1):
+    return {
+        "id": external_id,
+        "date": datetime(2025, 1, day, 12, 0),
+        "language": language,
+        "name": "Иван",
+        "phone": "+79990000000",
+        "category": category,
+        "status": status,
+        "text_len": 20,
+        "attachments_count": 0,
+        "text": "Текст обращения сотрудника",
+    }
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return SqliteTicketRepository(str(tmp_path / "tickets.sqlite3"))
+
+
+def test_counters_follow_add(repo):
+    repo.add(_ticket("HR-1"))
+    repo.add(_ticket("HR-2", category="Другое", language="EN", day=2))
+
+    assert repo.counters() == {
+        "status": {"new": 2},
+        "category": {"Угрозы и давление": 1, "Другое": 1},
+        "language": {"RU": 1, "EN": 1},
+        "day": {"2025-01-01": 1, "2025-01-02": 1},
+    }
+
+
+def test_counters_follow_status_change(repo):
+    repo.add(_ticket("HR-1"))
+    repo.add(_ticket("HR-2"))
+
+    repo.update("HR-1", status="в работе")
+    assert repo.counters()["status"] == {"new": 1, "work": 1}
+    repo.update("HR-1", status="закрыто")
+    # Повтор того же статуса счётчики не трогает
+    repo.update("HR-1", status="закрыто")
+    assert repo.counters()["status"] == {"new": 1, "closed": 1}
+    assert repo.get("HR-1")["status_code"] == "closed"
+    # Остальные разрезы от смены статуса не меняются
+    assert repo.counters()["category"] == {"Угрозы и давление": 2}
+
+
+def test_counters_not_doubled_on_re_add(repo):
+    repo.add(_ticket("HR-1"))
+    repo.add(_ticket("HR-1", status="в работе", category="Другое"))
+
+    counters = repo.counters()
+    assert counters["status"] == {"work": 1}
+    assert counters["category"] == {"Другое": 1}
+
+
+def test_update_unknown_ticket_keeps_counters(repo):
+    repo.add(_ticket("HR-1"))
+    repo.update("HR-404", status="закрыто")
+    assert repo.counters()["status"] == {"new": 1}
+
+
+def test_old_schema_is_migrated(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    # Первая версия таблицы: без text и status_code, без счётчиков
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE tickets (
+            id                 TEXT PRIMARY KEY,
+            date               TEXT NOT NULL,
+            language           TEXT NOT NULL,
+            name               TEXT NOT NULL,
+            phone              TEXT NOT NULL,
+            category           TEXT NOT NULL,
+            status             TEXT NOT NULL,
+            text_len           INTEGER NOT NULL,
+            attachments_count  INTEGER NOT NULL,
+            task_id            INTEGER,
+            crm_item_id        INTEGER,
+            channel_message_id INTEGER
+        );
+    """)
+    db.executemany(
+        "INSERT INTO tickets VALUES (?, ?, 'RU', 'Иван', '+7999', 'Другое', ?, 10, 0, NULL, NULL, 100)",
+        [
+            ("HR-1", "2025-01-01T10:00:00", "новое"),
+            ("HR-2", "2025-01-01T11:00:00", "в работе"),
+            ("HR-3", "2025-01-02T09:00:00", "в работе"),
+        ],
+    )
+    db.commit()
+    db.close()
+
+    repo = SqliteTicketRepository(path)
+    old = repo.get("HR-2")
+    assert old["status_code"] == "work"
+    assert old["text"] is None
+    assert old["channel_message_id"] == 100
+    assert repo.counters() == {
+        "status": {"new": 1, "work": 2},
+        "category": {"Другое": 3},
+        "language": {"RU": 3},
+        "day": {"2025-01-01": 2, "2025-01-02": 1},
+    }
+
+    # После миграции счётчики ведутся как обычно, а повторное открытие их не пересчитывает
+    repo.add(_ticket("HR-4", category="Другое"))
+    reopened = SqliteTicketRepository(path)
+    assert reopened.counters()["status"] == {"new": 2, "work": 2}
+    assert reopened.get("HR-4")["text"] == "Текст обращения сотрудника"
+
+
+def test_iter_tickets_pages_over_equal_timestamps(repo):
+    # Семь заявок в одну секунду: граница страниц приходится на одинаковые date
+    for n in range(7):
+        repo.add(_ticket(f"HR-{n}", status="закрыто" if n == 3 else "новое"))
+
+    ids = [t["id"] for t in repo.iter_tickets(page_size=3)]
+    assert ids == [f"HR-{n}" for n in range(7)]
+
+    new = [t["id"] for t in repo.iter_tickets(statuses=["new"], page_size=2)]
+    assert new == ["HR-0", "HR-1", "HR-2", "HR-4", "HR-5", "HR-6"]
+
+
+def test_iter_tickets_limit_keeps_latest_across_pages(repo):
+    for n in range(7):
+        repo.add(_ticket(f"HR-{n}", status="закрыто" if n % 2 else "новое"))
+
+    latest = [t["id"] for t in repo.iter_tickets(statuses=["new"], limit=3, page_size=2)]
+    assert latest == ["HR-2", "HR-4", "HR-6"]